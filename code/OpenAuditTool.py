@@ -100,6 +100,14 @@ class Election(object):
         e.max_num_it = max_num_it
         e.sample_by_size = sample_by_size
         e.use_discrete_rm = False
+        e.use_greedy_planner = False
+        e.stage_budget = None
+        e.plan_time_budget = None
+        e.simulate = False
+        e.async_ingest = False
+        e.ingest_processes = None
+        e.column_cache = False
+        e.reported_cache = False
         e.pick_county_func = None
         # *** Notation
 
@@ -116,6 +124,7 @@ class Election(object):
         # b = ballot id (bid)
         # t = audit stage_time (time audit started, used as stage id)
         # m = risk measurement id (mid) from audit_parameters_contest
+        # k = box (batch) id, for batch audits (see batch_audit.py)
 
         # and where de may be something like:
         # rn = reported number (from initial scan)
@@ -334,6 +343,29 @@ class Election(object):
         # reported number of votes for each reported vote in cid
         # dict mapping cid and reported vote to int (reported number)
 
+        e.outcome_index_c = {}
+        # Computed as needed (outcomes.outcome_index)
+        # cid->(votes, index)
+        # cache of precomputed index structures used by batched outcome
+        # rules, for the given tuple of votes.
+
+        # *** Reported batches (batch audits only; see batch_audit.py)
+
+        e.boxids_p = {}
+        # input (21-reported-ballot-manifests/reported-ballot-manifest-PBCID.csv)
+        # pbcid->[boxids]
+        # boxes of each collection, in ballot manifest order
+
+        e.rn_pk = {}
+        # input (21-reported-ballot-manifests/reported-ballot-manifest-PBCID.csv)
+        # pbcid->boxid->int
+        # number of ballots in each box
+
+        e.rn_cpkr = {}
+        # input (24-reported-batch-tallies/reported-batch-tallies-PBCID.csv)
+        # cid->pbcid->boxid->rvote->count
+        # reported number of votes by contest, collection, box, and vote
+
         # *** Reported outcomes
 
         e.ro_c = {}
@@ -423,6 +455,11 @@ class Election(object):
         e.n_trials = 100000
         # number of trials used to estimate risk in compute_contest_risk
 
+        e.batch_pseudocount = 1.0
+        # Fixed parameter
+        # Dirichlet weight of each prior pseudo-box in batch audits
+        # (see batch_audit.py)
+
         e.shuffled_indices_p = {}
         e.shuffled_bids_p = {}
         # computed in audit_orders.py (but probably will be replaced)
@@ -486,10 +523,38 @@ class Election(object):
         # sampled number stage_time->cid->pbcid->vote->count
         # sampled number by stage_time, contest, pbcid, and reported vote
 
+        e.shuffled_boxids_p = {}
+        # computed in batch_audit.py
+        # pbcid->[boxids]
+        # order in which boxes of each pbcid are audited, for batch audits
+
+        e.audited_boxids_p = {}
+        # input (33-audited-votes/audited-batch-tallies-PBCID.csv)
+        # pbcid->[boxids]
+        # boxes audited so far, for batch audits
+
+        e.plan_boxes_tp = {}
+        # computed in batch_audit.py
+        # stage_time->pbcid->int
+        # number of boxes (in batch audit order) wanted audited after next
+        # stage, for batch audits; e.plan_tp gives the number of ballots in them
+
+        e.an_cpka = {}
+        # input (33-audited-votes/audited-batch-tallies-PBCID.csv)
+        # cid->pbcid->boxid->avote->count
+        # audited (actual) number of votes by contest, collection, box, and vote
+
         # *** saved-state ***
         # see saved-state.py
         e.saved_state = {}
 
+        e.planner_state = {}
+        # planner state carried from stage to stage (and in saved-state):
+        # "x_p": pbcid->int, last planned increment (warm start for planner)
+        # "rm_k": int, number of Robbins-Monro steps taken so far
+        # "iterations": int, random-walk steps in last planning pass
+        # "last_change": float, largest change in x over last planner block
+
 
 def main():
     logger.info("OpenAuditTool.py -- Bayesian audit support program.")
@@ -7,6 +7,8 @@
 Routines to work with OpenAuditTool.py on post-election audits.
 """
 
+import copy
+import io
 import logging
 import os
 import warnings
@@ -15,6 +17,7 @@ import time
 import OpenAuditTool
 import csv_readers
 import ids
+import ingest
 import outcomes
 import planner
 import risk_bayes
@@ -39,7 +42,7 @@ logger = logging.getLogger(__name__)
 ##############################################################################
 
 
-def draw_sample(e):
+def draw_sample(e, pbcids=None):
     """ 
     "Draw sample", tally it, save sample tally in 
         e.sn_tcpra[stage_time][cid][pbcid]. 
@@ -58,6 +61,10 @@ def draw_sample(e):
     to number of ballots sampled in each pbc (equal to plan).
     Note that in real life actual sampling number might be different than planned;
     here it will be the same.  But code elsewhere allows for such differences.
+
+    If pbcids is given, only those collections (whose audited votes
+    changed) are sampled as planned; the others keep their sample sizes
+    from the previous stage, since none of their ballots were newly audited.
     """
 
     if "plan_tp" in e.saved_state:
@@ -65,6 +72,11 @@ def draw_sample(e):
     else:
         e.sn_tp[e.stage_time] = { pbcid: int(e.max_audit_rate_p[pbcid])
                                   for pbcid in e.pbcids }
+    if pbcids != None:
+        last_sn_p = e.saved_state["sn_tp"].get(e.saved_state["stage_time"], {})
+        e.sn_tp[e.stage_time] = {pbcid: e.sn_tp[e.stage_time][pbcid]
+                                        if pbcid in pbcids else last_sn_p.get(pbcid, 0)
+                                 for pbcid in e.sn_tp[e.stage_time]}
         
     e.sn_tcpr[e.stage_time] = {}
     for cid in e.cids:
@@ -387,25 +399,110 @@ def read_audited_votes(e):
     Read audited votes from 3-audit/33-audited-votes/audited-votes-PBCID.csv 
     """
 
+    if e.async_ingest or e.ingest_processes != None:
+        ingest.read_collections(e, [(parse_audited_votes, merge_audited_votes)],
+                                processes=e.ingest_processes)
+    else:
+        for pbcid in e.pbcids:
+            read_audited_votes_pbcid(e, pbcid)
+
+
+def read_audited_votes_pbcid(e, pbcid):
+    """
+    Read audited votes for one collection pbcid from
+    3-audit/33-audited-votes/audited-votes-PBCID.csv, replacing any
+    audited votes previously read for pbcid.
+    """
+
+    merge_audited_votes(e, pbcid, parse_audited_votes(e, pbcid, stream=True))
+
+
+def audited_votes_pbcid(e, filename):
+    """
+    Return the pbcid whose audited-votes file filename is, or None.
+
+    The filename (less any compression suffix) is audited-votes-PBCID.csv,
+    possibly with a version label starting with a hyphen just before the
+    ".csv", and PBCID is ids.filename_safe(pbcid).  Since collection ids
+    may themselves contain hyphens (as "DEN" and "DEN-A01"), the pbcid
+    with the longest such name matching filename is returned.
+    """
+
+    basename = utils.strip_compression_suffix(filename)
+    if not (basename.startswith("audited-votes-") and basename.endswith(".csv")):
+        return None
+    label = basename[len("audited-votes-"):-len(".csv")]
+    matches = [pbcid for pbcid in e.pbcids
+               if label == ids.filename_safe(pbcid) or \
+                  label.startswith(ids.filename_safe(pbcid)+"-")]
+    if len(matches) == 0:
+        return None
+    return max(matches, key=lambda pbcid: len(ids.filename_safe(pbcid)))
+
+
+def audited_votes_filename(e, pbcid):
+    """
+    Return pathname of the audited-votes file for pbcid: of those in
+    3-audit/33-audited-votes for pbcid (see audited_votes_pbcid), the one
+    with the greatest name, as utils.greatest_name would choose.
+    Raise FileNotFoundError if there is none.
+    """
+
     election_pathname = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
                                      e.election_dirname)
     audited_votes_pathname = os.path.join(election_pathname,
                                           "3-audit",
                                           "33-audited-votes")
-    for pbcid in e.pbcids:
-        safe_pbcid = ids.filename_safe(pbcid)
-        filename = utils.greatest_name(audited_votes_pathname,
-                                       "audited-votes-"+safe_pbcid,
-                                       ".csv")
-        file_pathname = os.path.join(audited_votes_pathname, filename)
-        fieldnames = ["Collection", "Ballot id", "Contest", "Selections"]
-        rows = csv_readers.read_csv_file(file_pathname, fieldnames, varlen=True)
-        for row in rows:
-            pbcid = row["Collection"]
-            bid = row["Ballot id"]
-            cid = row["Contest"]
-            vote = row["Selections"]
-            utils.nested_set(e.av_cpb, [cid, pbcid, bid], vote)
+    filenames = [filename for filename in os.listdir(audited_votes_pathname)
+                 if os.path.isfile(os.path.join(audited_votes_pathname, filename)) and \
+                    audited_votes_pbcid(e, filename) == pbcid]
+    if len(filenames) == 0:
+        raise FileNotFoundError("No audited-votes file in `{}` for collection `{}`."
+                                .format(audited_votes_pathname, pbcid))
+    # prefer an uncompressed file to a compressed variant of it
+    filename = max(filenames,
+                   key=lambda filename: (utils.strip_compression_suffix(filename),
+                                         utils.strip_compression_suffix(filename) == filename,
+                                         filename))
+    return os.path.join(audited_votes_pathname, filename)
+
+
+def parse_audited_votes(e, pbcid, stream=False, file_pathname=None):
+    """
+    Return columns (list of lists of values, one list per field, in the
+    order of fieldnames below) of
+    3-audit/33-audited-votes/audited-votes-PBCID.csv
+    (or of file_pathname, if given).
+    If stream is True, return instead an iterator over its rows (tuples
+    of values in the same order), read lazily.
+    Does not change e.
+    """
+
+    if file_pathname == None:
+        file_pathname = audited_votes_filename(e, pbcid)
+    fieldnames = ["Collection", "Ballot id", "Contest", "Selections"]
+    if stream:
+        return csv_readers.iter_csv_file(file_pathname, fieldnames, varlen=True,
+                                         columns=fieldnames)
+    columns = csv_readers.read_csv_columns(file_pathname, fieldnames, varlen=True,
+                                           processes=e.ingest_processes,
+                                           columns=fieldnames)
+    return [columns[fieldname] for fieldname in fieldnames]
+
+
+def merge_audited_votes(e, pbcid, rows):
+    """
+    Merge audited votes rows for pbcid into e.av_cpb, replacing any
+    audited votes previously read for pbcid.
+    Each row is a tuple of values in the field order of parse_audited_votes.
+    """
+
+    for cid in e.av_cpb:
+        if pbcid in e.av_cpb[cid]:
+            e.av_cpb[cid][pbcid] = {}
+    for row in rows:
+        (pbcid, bid, cid, vote) = row
+        utils.nested_set(e.av_cpb, [cid, pbcid, bid], vote)
 
 
 def audit_stage(e, stage_time):
@@ -423,19 +520,15 @@ def audit_stage(e, stage_time):
     e.stage_time = "{}".format(stage_time)
 
     saved_state.read_saved_state(e)
+    if "planner_state" in e.saved_state:
+        e.planner_state = e.saved_state["planner_state"]
 
-    e.status_tm[e.stage_time] = {}
-    e.sn_tp[e.stage_time] = {}
-
-    e.risk_tm[e.stage_time] = {}
-    e.sn_tcpra[e.stage_time] = {}
+    start_stage(e)
 
     # this is global read, not just per stage, for now
     read_audited_votes(e)
 
-    draw_sample(e)
-    risk_bayes.compute_risks(e, e.sn_tcpra)
-    compute_statuses(e)
+    compute_stage(e)
 
     write_audit_output_contest_status(e)
     write_audit_output_collection_status(e)
@@ -445,6 +538,52 @@ def audit_stage(e, stage_time):
     show_risks_and_statuses(e)
 
 
+def start_stage(e):
+    """ Set up per-stage data structures for stage e.stage_time. """
+
+    e.status_tm[e.stage_time] = {}
+    e.sn_tp[e.stage_time] = {}
+
+    e.risk_tm[e.stage_time] = {}
+    e.sn_tcpra[e.stage_time] = {}
+
+
+def compute_stage(e, risk_module=risk_bayes, pbcids=None):
+    """
+    Draw the sample for stage e.stage_time (as planned in e.saved_state),
+    then compute risks (with risk_module.compute_risk) and statuses.
+
+    If pbcids is given, only the samples of those collections grow (see
+    draw_sample), and only the measurements whose sample tallies changed
+    since the previous stage (when there is one in memory) have their
+    risks recomputed; the others keep their risks from the previous stage.
+    """
+
+    draw_sample(e, pbcids)
+    last_stage_time = e.saved_state["stage_time"]
+    for mid in e.mids:
+        if pbcids == None or \
+           mid not in e.risk_tm.get(last_stage_time, {}) or \
+           sample_changed(e, e.cid_m[mid], last_stage_time):
+            risk_module.compute_risk(e, mid, e.sn_tcpra)
+        else:
+            e.risk_tm[e.stage_time][mid] = e.risk_tm[last_stage_time][mid]
+    compute_statuses(e)
+
+
+def sample_changed(e, cid, last_stage_time):
+    """
+    Return True if the sample tallies for contest cid of stage e.stage_time
+    differ from those of stage last_stage_time (or those are not in memory).
+    """
+
+    last_sn_cpra = e.sn_tcpra.get(last_stage_time, {})
+    if cid not in last_sn_cpra:
+        return True
+    return any(e.sn_tcpra[e.stage_time][cid][pbcid] != last_sn_cpra[cid].get(pbcid)
+               for pbcid in e.possible_pbcid_c[cid])
+
+
 def write_audit_output_contest_status(e):
     """
     Write audit_output_contest_status; same format as audit_spec_contest,
@@ -459,31 +598,43 @@ def write_audit_output_contest_status(e):
     filename = os.path.join(dirpath,
                             "audit-output-contest-status-"+e.stage_time+".csv")
     with open(filename, "w") as file:
-        fieldnames = ["Measurement id",
-                      "Contest",
-                      "Risk Measurement Method",
-                      "Risk Limit",
-                      "Risk Upset Threshold",
-                      "Sampling Mode",
-                      "Status",
-                      "Param 1",
-                      "Param 2"]
-        file.write(",".join(fieldnames))
+        print_audit_output_contest_status(e, file)
+
+
+def print_audit_output_contest_status(e, file):
+    """ Print contest status for e.stage_time, in csv format, to file. """
+
+    fieldnames = ["Measurement id",
+                  "Contest",
+                  "Risk Measurement Method",
+                  "Risk Limit",
+                  "Risk Upset Threshold",
+                  "Sampling Mode",
+                  "Status",
+                  "Param 1",
+                  "Param 2"]
+    file.write(",".join(fieldnames))
+    file.write("\n")
+    for mid in e.mids:
+        file.write("{},".format(mid))
+        file.write("{},".format(e.cid_m[mid]))
+        file.write("{},".format(e.risk_method_m[mid]))
+        file.write("{},".format(e.risk_limit_m[mid]))
+        file.write("{},".format(e.risk_upset_m[mid]))
+        file.write("{},".format(e.sampling_mode_m[mid]))
+        file.write("{},".format(e.status_tm[e.stage_time][mid]))
+        file.write("{},".format(e.risk_measurement_parameters_m[mid][0]))
+        file.write("{}".format(e.risk_measurement_parameters_m[mid][1]))
         file.write("\n")
-        for mid in e.mids:
-            file.write("{},".format(mid))
-            file.write("{},".format(e.cid_m[mid]))
-            file.write("{},".format(e.risk_method_m[mid]))
-            file.write("{},".format(e.risk_limit_m[mid]))
-            file.write("{},".format(e.risk_upset_m[mid]))
-            file.write("{},".format(e.sampling_mode_m[mid]))
-            file.write("{},".format(e.status_tm[e.stage_time][mid]))
-            file.write("{},".format(e.risk_measurement_parameters_m[mid][0]))
-            file.write("{}".format(e.risk_measurement_parameters_m[mid][1]))
-            file.write("\n")
 
 def write_audit_output_collection_status(e):
-    """ Write 3-audit/34-audit-output/audit_output_collection_status.csv """
+    """ 
+    Write 3-audit/34-audit-output/audit_output_collection_status.csv 
+
+    The last three fields (planned sample size for the next stage, and
+    the planner's convergence diagnostics) are empty until the plan for
+    this stage has been computed; the file is rewritten after planning.
+    """
 
     dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
                            e.election_dirname,
@@ -493,23 +644,38 @@ def write_audit_output_collection_status(e):
     filename = os.path.join(dirpath,
                             "audit-output-collection-status-"+e.stage_time+".csv")
     with open(filename, "w") as file:
-        fieldnames = ["Collection",
-                      "Number of ballots",
-                      "Number of allots sampled total",
-                      "Number of ballots sample this stage."]
-        file.write(",".join(fieldnames))
-        file.write("\n")
-        for pbcid in e.pbcids:
-            file.write("{},".format(pbcid))
-            file.write("{},".format(len(e.bids_p[pbcid])))
-            file.write("{},".format(e.sn_tp[e.stage_time][pbcid]))
-            if "sn_tp" in e.saved_state:
-                new_sample_size = e.sn_tp[e.stage_time][pbcid]
-                old_sample_size = e.saved_state["sn_tp"] \
-                                    [e.saved_state["stage_time"]][pbcid]
-                diff_sample_size = new_sample_size - old_sample_size
-                file.write("{}".format(diff_sample_size))
-            file.write("\n")            
+        print_audit_output_collection_status(e, file)
+
+
+def print_audit_output_collection_status(e, file):
+    """ Print collection status for e.stage_time, in csv format, to file. """
+
+    fieldnames = ["Collection",
+                  "Number of ballots",
+                  "Number of allots sampled total",
+                  "Number of ballots sample this stage.",
+                  "Planned sample size",
+                  "Planner iterations",
+                  "Planner last change"]
+    file.write(",".join(fieldnames))
+    file.write("\n")
+    for pbcid in e.pbcids:
+        file.write("{},".format(pbcid))
+        file.write("{},".format(len(e.bids_p[pbcid])))
+        file.write("{},".format(e.sn_tp[e.stage_time][pbcid]))
+        if "sn_tp" in e.saved_state:
+            new_sample_size = e.sn_tp[e.stage_time][pbcid]
+            old_sample_size = e.saved_state["sn_tp"] \
+                                [e.saved_state["stage_time"]][pbcid]
+            diff_sample_size = new_sample_size - old_sample_size
+            file.write("{}".format(diff_sample_size))
+        if e.stage_time in e.plan_tp:
+            file.write(",{}".format(e.plan_tp[e.stage_time][pbcid]))
+            file.write(",{}".format(e.planner_state.get("iterations", "")))
+            file.write(",{}".format(e.planner_state.get("last_change_p", {}).get(pbcid, "")))
+        else:
+            file.write(",,,")
+        file.write("\n")            
 
 
 def stop_audit(e):
@@ -526,10 +692,119 @@ def stop_audit(e):
     return True
 
 
+class AuditOutput(object):
+    """
+    Outputs of an audit run in simulation mode, collected in memory:
+    for each stage, the contest status and collection status files and
+    the saved-state.  They are all written at once, by write, at the end.
+    """
+
+    def __init__(self):
+
+        self.contest_status_t = {}
+        self.collection_status_t = {}
+        self.saved_state_t = {}
+
+    def add_stage(self, e):
+        """ Collect status outputs for stage e.stage_time. """
+
+        file = io.StringIO()
+        print_audit_output_contest_status(e, file)
+        self.contest_status_t[e.stage_time] = file.getvalue()
+        file = io.StringIO()
+        print_audit_output_collection_status(e, file)
+        self.collection_status_t[e.stage_time] = file.getvalue()
+
+    def add_saved_state(self, ss):
+        """ Collect (a copy of) saved-state dict ss. """
+
+        self.saved_state_t[ss["stage_time"]] = copy.deepcopy(ss)
+
+    def write(self, e):
+        """ Write all collected outputs to 3-audit/34-audit-output. """
+
+        dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                               e.election_dirname,
+                               "3-audit",
+                               "34-audit-output")
+        os.makedirs(dirpath, exist_ok=True)
+        for (prefix, text_t) in [("audit-output-contest-status-", self.contest_status_t),
+                                 ("audit-output-collection-status-", self.collection_status_t)]:
+            for stage_time in text_t:
+                filename = os.path.join(dirpath, prefix+stage_time+".csv")
+                with open(filename, "w") as file:
+                    file.write(text_t[stage_time])
+        for stage_time in self.saved_state_t:
+            saved_state.write_state(e, self.saved_state_t[stage_time])
+
+
+MAX_SIMULATED_STAGES = 1000
+# bound on the number of stages of a simulated audit (see simulate_audit)
+
+
+def simulate_audit(e, max_stages=MAX_SIMULATED_STAGES, output=None,
+                   risk_module=risk_bayes):
+    """
+    Run a whole audit in simulation mode, with no disk I/O or sleeping.
+
+    Stages are numbered by counters ("000001", "000002", ...) rather than
+    datetimes, e.max_stage_time is ignored, and the saved-state is passed
+    along in memory.  The audited votes must already be in e.av_cpb.
+    Stops when the audit would stop, when the plan for the next stage
+    would sample no more ballots in any collection (so the audit cannot
+    progress), or after max_stages stages.  If output (an AuditOutput)
+    is given, stage outputs are collected there.
+
+    Returns the number of stages done.
+    """
+
+    if max_stages == None:
+        max_stages = MAX_SIMULATED_STAGES
+    e.saved_state = saved_state.initial_saved_state(e)
+    if output != None:
+        output.add_saved_state(e.saved_state)
+    stage = 0
+    while stage < max_stages:
+        stage += 1
+        e.stage_time = "{:06d}".format(stage)
+        start_stage(e)
+        compute_stage(e, risk_module)
+        if stop_audit(e):
+            if output != None:
+                output.add_stage(e)
+            break
+        planner.compute_plan(e)
+        if output != None:
+            output.add_stage(e)
+        if all(e.plan_tp[e.stage_time].get(pbcid, 0) <= e.sn_tp[e.stage_time][pbcid]
+               for pbcid in e.pbcids):
+            logger.info("Simulated audit stopped at stage %s: the plan samples "
+                        "no more ballots.", e.stage_time)
+            break
+        e.saved_state = saved_state.intermediate_saved_state(e)
+        if output != None:
+            output.add_saved_state(e.saved_state)
+    else:
+        logger.info("Simulated audit stopped after %s stages.", max_stages)
+    return stage
+
+
 def audit(e, args):
 
     read_audit_spec(e, args)
     initialize_audit(e)
+    if e.simulate:
+        show_audit_spec(e)
+        logger.info("====== Audit (simulation mode) ======")
+        read_audited_votes(e)
+        output = AuditOutput()
+        simulate_audit(e, output=output)
+        output.write(e)
+        show_sample_counts(e)
+        show_risks_and_statuses(e)
+        show_audit_summary(e)
+        return
+
     saved_state.write_initial_saved_state(e)
     show_audit_spec(e)
 
@@ -543,6 +818,7 @@ def audit(e, args):
         if stop_audit(e):
             break
         planner.compute_plan(e)
+        write_audit_output_collection_status(e)
 
         mid = e.mids[0]
         risk_bayes.tweak_all(e, mid)
@@ -0,0 +1,243 @@
+# audit_server.py
+# Ronald L. Rivest
+# October 19, 2026
+# python3
+
+"""
+Long-running audit service for OpenAuditTool.py.
+
+The election spec, reported data, and audit spec are read once, and the
+election is kept in memory; audit stages are then driven by requests
+over a local HTTP API (bound to 127.0.0.1 only):
+
+    GET  /status                    risks, statuses, sample sizes, and
+                                    plan of the latest stage
+    POST /audited-votes/PBCID       request body is the audited-votes csv
+                                    file for collection PBCID; it is saved
+                                    as 3-audit/33-audited-votes/
+                                    audited-votes-PBCID.csv (replacing
+                                    the old one) and ingested
+    POST /stage                     run an audit stage on the audited
+                                    votes so far; returns the new status
+
+Responses are JSON.  Stage outputs (status files and saved-state) are
+written to 3-audit/34-audit-output just as by the --audit loop.
+"""
+
+import http.server
+import json
+import logging
+import os
+import time
+import urllib.parse
+
+import OpenAuditTool
+import audit
+import election_spec
+import ids
+import planner
+import reported
+import saved_state
+import utils
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class AuditService(object):
+    """
+    Audit state for one election, kept in memory between requests.
+    """
+
+    def __init__(self, e):
+
+        self.e = e
+
+    def load(self, args):
+        """ Read election spec, reported data, and audit spec for self.e. """
+
+        e = self.e
+        election_spec.read_election_spec(e)
+        reported.read_reported(e)
+        audit.read_audit_spec(e, args)
+        audit.initialize_audit(e)
+
+    def start(self):
+        """
+        Resume from the latest saved-state, if any (else start a new
+        audit), and read whatever audited votes are already present.
+        """
+
+        e = self.e
+        try:
+            saved_state.read_saved_state(e)
+            if "planner_state" in e.saved_state:
+                e.planner_state = e.saved_state["planner_state"]
+        except FileNotFoundError:
+            e.saved_state = saved_state.initial_saved_state(e)
+            saved_state.write_state(e, e.saved_state)
+        e.stage_time = None
+        for pbcid in e.pbcids:
+            try:
+                audit.read_audited_votes_pbcid(e, pbcid)
+            except FileNotFoundError:
+                logger.info("No audited votes yet for collection %s.", pbcid)
+
+    def submit_audited_votes(self, pbcid, text):
+        """
+        Save text as the audited-votes file for pbcid, and ingest it.
+
+        The text is parsed and checked (see check_audited_votes_rows)
+        before the old file is replaced, so a bad upload leaves both the
+        file and e.av_cpb unchanged.  The saved
+        file has no version label, so it is the one read for pbcid when
+        the audit is resumed (see audit.audited_votes_filename).
+        """
+
+        e = self.e
+        if pbcid not in e.pbcids:
+            raise ValueError("Unknown collection: {}".format(pbcid))
+        dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                               e.election_dirname,
+                               "3-audit",
+                               "33-audited-votes")
+        os.makedirs(dirpath, exist_ok=True)
+        filename = os.path.join(dirpath,
+                                "audited-votes-"+ids.filename_safe(pbcid)+".csv")
+        with open(filename+".tmp", "w") as file:
+            file.write(text)
+        try:
+            rows = list(audit.parse_audited_votes(e, pbcid, stream=True,
+                                                  file_pathname=filename+".tmp"))
+            check_audited_votes_rows(e, pbcid, rows)
+        except:
+            os.remove(filename+".tmp")
+            raise
+        os.replace(filename+".tmp", filename)
+        audit.merge_audited_votes(e, pbcid, rows)
+
+    def compute_stage(self, pbcids=None):
+        """
+        Run an audit stage (sample, risks, statuses, and plan for the next
+        stage), writing its outputs; return the new status.
+
+        If pbcids is given, only those collections' samples grow, and only
+        the risks of measurements whose samples changed are recomputed
+        (see audit.compute_stage).
+        """
+
+        e = self.e
+        stage_time = utils.datetime_string()
+        while stage_time <= e.saved_state["stage_time"]:
+            # stage ids are datetimes, so must differ from the last one
+            time.sleep(0.1)
+            stage_time = utils.datetime_string()
+        if stage_time > e.max_stage_time:
+            raise ValueError("Maximum audit stage time ({}) reached."
+                             .format(e.max_stage_time))
+        e.stage_time = stage_time
+        audit.start_stage(e)
+        audit.compute_stage(e, pbcids=pbcids)
+        audit.write_audit_output_contest_status(e)
+        audit.write_audit_output_collection_status(e)
+        if not audit.stop_audit(e):
+            planner.compute_plan(e)
+            audit.write_audit_output_collection_status(e)
+            e.saved_state = saved_state.intermediate_saved_state(e)
+            saved_state.write_state(e, e.saved_state)
+        return self.status()
+
+    def status(self):
+        """ Return dict giving the status of the latest stage. """
+
+        e = self.e
+        if e.stage_time == None:
+            return {"stage_time": None,
+                    "plan_p": e.saved_state["plan_tp"][e.saved_state["stage_time"]]}
+        t = e.stage_time
+        return {"stage_time": t,
+                "risk_m": e.risk_tm[t],
+                "status_m": e.status_tm[t],
+                "election_status": e.election_status_t[t],
+                "sn_p": e.sn_tp[t],
+                "plan_p": e.plan_tp.get(t, {})}
+
+
+def check_audited_votes_rows(e, pbcid, rows):
+    """
+    Raise ValueError unless every audited-votes row is for collection
+    pbcid, and for a ballot in it.
+    """
+
+    bids = set(e.bids_p[pbcid])
+    for (row_pbcid, bid, cid, vote) in rows:
+        if row_pbcid != pbcid:
+            raise ValueError("Audited votes for collection {} include a row for "
+                             "collection {}.".format(pbcid, row_pbcid))
+        if bid not in bids:
+            raise ValueError("Ballot {} is not in collection {}.".format(bid, pbcid))
+
+
+def make_handler(service):
+    """ Return request handler class for HTTP requests to service. """
+
+    class AuditRequestHandler(http.server.BaseHTTPRequestHandler):
+
+        def send_json(self, code, value):
+            body = json.dumps(value, indent=2).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            try:
+                if self.path == "/status":
+                    self.send_json(200, service.status())
+                else:
+                    self.send_json(404, {"error": "Unknown path: {}".format(self.path)})
+            except Exception as error:
+                logger.exception("Error handling GET %s", self.path)
+                self.send_json(500, {"error": str(error)})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode("utf-8")
+            try:
+                if self.path == "/stage":
+                    self.send_json(200, service.compute_stage())
+                elif self.path.startswith("/audited-votes/"):
+                    pbcid = urllib.parse.unquote(self.path[len("/audited-votes/"):])
+                    service.submit_audited_votes(pbcid, body)
+                    self.send_json(200, {"collection": pbcid})
+                else:
+                    self.send_json(404, {"error": "Unknown path: {}".format(self.path)})
+            except (ValueError, FileNotFoundError) as error:
+                self.send_json(400, {"error": str(error)})
+            except Exception as error:
+                logger.exception("Error handling POST %s", self.path)
+                self.send_json(500, {"error": str(error)})
+
+        def log_message(self, format, *args):
+            logger.info("%s %s", self.address_string(), format % args)
+
+    return AuditRequestHandler
+
+
+def serve(e, args):
+    """ Load election e and serve audit requests on 127.0.0.1:args.port. """
+
+    service = AuditService(e)
+    service.load(args)
+    service.start()
+    server = http.server.HTTPServer(("127.0.0.1", int(args.port)),
+                                    make_handler(service))
+    logger.info("Audit service for %s listening on 127.0.0.1:%s",
+                e.election_dirname, server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Audit service stopped.")
+    finally:
+        server.server_close()
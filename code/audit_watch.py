@@ -0,0 +1,145 @@
+# audit_watch.py
+# Ronald L. Rivest
+# October 19, 2026
+# python3
+
+"""
+Watch mode for OpenAuditTool.py.
+
+Keeps the election in memory (as audit_server.AuditService does) and
+watches 3-audit/33-audited-votes for new or changed audited-votes files.
+When some appear, only the affected collections are re-read, and a new
+audit stage is run in which only those collections' samples grow (the
+others have had no more ballots audited), so only the measurements
+whose contests touch those collections have their risks recomputed.
+Status files and saved-state are written as usual.
+
+Uses inotify (via the optional inotify_simple package) to wake up when
+the directory changes, where available; otherwise polls file
+modification times.
+"""
+
+import logging
+import os
+import time
+
+import OpenAuditTool
+import audit
+import audit_server
+import utils
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class AuditedVotesWatcher(object):
+    """
+    Watches 3-audit/33-audited-votes of election e for changed
+    audited-votes files.
+    """
+
+    def __init__(self, e, poll_interval=1.0):
+
+        self.e = e
+        self.poll_interval = poll_interval
+        self.dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                                    e.election_dirname,
+                                    "3-audit",
+                                    "33-audited-votes")
+        os.makedirs(self.dirpath, exist_ok=True)
+        self.mtimes = self.scan()
+        self.inotify = None
+        if inotify_simple != None:
+            try:
+                self.inotify = inotify_simple.INotify()
+                flags = inotify_simple.flags
+                self.inotify.add_watch(self.dirpath,
+                                       flags.CLOSE_WRITE | flags.MOVED_TO | flags.DELETE)
+            except OSError:
+                self.inotify = None
+
+    def scan(self):
+        """ Return dict mapping audited-votes filenames to (mtime, size). """
+
+        mtimes = {}
+        for filename in os.listdir(self.dirpath):
+            if filename.startswith("audited-votes-") and \
+               utils.strip_compression_suffix(filename).endswith(".csv"):
+                stat = os.stat(os.path.join(self.dirpath, filename))
+                mtimes[filename] = (stat.st_mtime_ns, stat.st_size)
+        return mtimes
+
+    def changed_pbcids(self):
+        """
+        Return sorted list of pbcids having an audited-votes file that is
+        new or changed since the last call.
+        """
+
+        mtimes = self.scan()
+        changed = [filename for filename in mtimes
+                   if self.mtimes.get(filename) != mtimes[filename]]
+        self.mtimes = mtimes
+        return sorted(set(audit.audited_votes_pbcid(self.e, filename)
+                          for filename in changed) - set([None]))
+
+    def wait(self):
+        """
+        Wait for audited-votes files to change; return list of pbcids whose
+        files changed (possibly empty, if nothing changed for a while).
+        """
+
+        if self.inotify != None:
+            if len(self.inotify.read(timeout=int(1000*self.poll_interval))) > 0:
+                time.sleep(0.1)       # let a burst of writes settle
+                self.inotify.read(timeout=0)
+        else:
+            time.sleep(self.poll_interval)
+        return self.changed_pbcids()
+
+
+def affected_mids(e, pbcids):
+    """ Return list of mids whose contests may appear in one of pbcids. """
+
+    return [mid for mid in e.mids
+            if any(pbcid in e.possible_pbcid_c[e.cid_m[mid]] for pbcid in pbcids)]
+
+
+def update(service, pbcids):
+    """
+    Re-read the audited votes of pbcids, and run a stage growing just
+    their samples, and so recomputing the risks of just the affected
+    measurements (see affected_mids); return the new status.
+    """
+
+    e = service.e
+    for pbcid in pbcids:
+        audit.read_audited_votes_pbcid(e, pbcid)
+    return service.compute_stage(pbcids=pbcids)
+
+
+def watch(e, args):
+    """ Load election e, then recompute stages as audited votes arrive. """
+
+    service = audit_server.AuditService(e)
+    service.load(args)
+    service.start()
+    watcher = AuditedVotesWatcher(e, float(args.watch_interval))
+    logger.info("Watching %s for audited votes (%s).", watcher.dirpath,
+                "inotify" if watcher.inotify != None else "polling")
+    try:
+        while True:
+            pbcids = watcher.wait()
+            if len(pbcids) == 0:
+                continue
+            logger.info("Audited votes changed for: %s (affecting %s)", ", ".join(pbcids),
+                        ", ".join(affected_mids(e, pbcids)))
+            status = update(service, pbcids)
+            logger.info("Stage %s: risks %s; statuses %s",
+                        status["stage_time"], status["risk_m"], status["status_m"])
+    except KeyboardInterrupt:
+        logger.info("Watch mode stopped.")
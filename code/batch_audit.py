@@ -0,0 +1,540 @@
+# batch_audit.py
+# Ronald L. Rivest
+# October 19, 2026
+# python3
+
+"""
+Batch-level comparison audit for OpenAuditTool.py.
+
+Here the sampling unit is a manifest batch (a "Box" of the ballot
+manifest, of size "Number of ballots"), rather than a single ballot.
+Reported votes are given as per-batch tallies in the compact file
+
+    2-reported/24-reported-batch-tallies/reported-batch-tallies-PBCID.csv
+
+with one row per (box, contest, vote):
+
+    Collection, Box, Contest, Count, Selections
+
+(Selections is last, since a vote may have several selids, as for the
+Selections field of a CVR file).  Collection managers audit whole
+batches, in the order given by the batch audit order file, and report
+the hand tallies in
+
+    3-audit/33-audited-votes/audited-batch-tallies-PBCID.csv
+
+in the same format.  Nothing here is per-ballot: reading manifests and
+tallies, sampling, and risk measurement are all O(number of batches).
+
+Risk is measured from batch-level discrepancies (audited tally minus
+reported tally) by a Bayesian bootstrap: each trial draws Dirichlet
+weights over the audited batches of a collection, plus a few prior
+pseudo-batches, and uses the weighted discrepancy per ballot as the
+discrepancy rate for the unaudited ballots of the collection.  There
+is one pseudo-batch per vote of the contest, of average batch size,
+all of whose ballots are actually for that vote; these keep the risk
+high until enough batches have been audited, and their weight fades
+as the audit goes on.  The risk is the fraction of trials for which
+the outcome of the resulting tally differs from the reported outcome.
+
+Use write_reported_batch_tallies to produce the tallies file from
+reported CVRs, where there are any.
+"""
+
+import logging
+import numpy as np
+import os
+
+import OpenAuditTool
+import audit
+import audit_orders
+import csv_readers
+import election_spec
+import ids
+import outcomes
+import reported
+import utils
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+##############################################################################
+# Reported batches and batch tallies
+##############################################################################
+
+
+def read_batch_reported(e):
+    """
+    Read what a batch audit needs of the reported data: the ballot
+    manifests (as batches), the reported batch tallies, and the
+    reported outcomes.
+    """
+
+    read_manifest_batches(e)
+    read_reported_batch_tallies(e)
+    reported.read_reported_outcomes(e)
+
+
+def read_manifest_batches(e):
+    """
+    Read ballot manifests 21-reported-ballot-manifests, giving just the
+    boxes and the number of ballots in each (e.boxids_p and e.rn_pk).
+
+    Rows are not expanded into ballots; a box given in several rows
+    (e.g. one row per ballot) has its numbers of ballots added up.
+    """
+
+    election_pathname = os.path.join(OpenAuditTool.ELECTIONS_ROOT, e.election_dirname)
+    specification_pathname = os.path.join(election_pathname,
+                                          "2-reported",
+                                          "21-reported-ballot-manifests")
+    fieldnames = ["Collection", "Box", "Position", "Stamp",
+                  "Ballot id", "Number of ballots",
+                  "Required Contests", "Possible Contests", "Comments"]
+    for pbcid in e.pbcids:
+        safe_pbcid = ids.filename_safe(pbcid)
+        filename = utils.greatest_name(specification_pathname,
+                                       "manifest-" + safe_pbcid,
+                                       ".csv")
+        file_pathname = os.path.join(specification_pathname, filename)
+        rows = csv_readers.iter_csv_file(file_pathname, fieldnames, varlen=False,
+                                         columns=["Box", "Number of ballots"])
+        e.boxids_p[pbcid] = []
+        e.rn_pk[pbcid] = {}
+        for (boxid, num) in rows:
+            try:
+                num = int(num)
+            except ValueError as error:
+                raise ValueError("Number {} of ballots not an integer."
+                                 .format(num)) from error
+            if boxid not in e.rn_pk[pbcid]:
+                e.boxids_p[pbcid].append(boxid)
+                e.rn_pk[pbcid][boxid] = 0
+            e.rn_pk[pbcid][boxid] += num
+
+
+def read_batch_tallies_file(file_pathname, n_cpkr):
+    """
+    Read batch tallies file file_pathname into n_cpkr
+    (cid->pbcid->boxid->vote->count); return list of the boxids seen.
+    """
+
+    fieldnames = ["Collection", "Box", "Contest", "Count", "Selections"]
+    rows = csv_readers.iter_csv_file(file_pathname, fieldnames, varlen=True)
+    boxids = []
+    seen = set()
+    for row in rows:
+        pbcid = row["Collection"]
+        boxid = row["Box"]
+        cid = row["Contest"]
+        vote = row["Selections"]
+        count = int(row["Count"])
+        if count < 0:
+            raise ValueError("Negative count {} for box {} of collection {}."
+                             .format(count, boxid, pbcid))
+        if boxid not in seen:
+            seen.add(boxid)
+            boxids.append(boxid)
+        old_count = n_cpkr.get(cid, {}).get(pbcid, {}).get(boxid, {}).get(vote, 0)
+        utils.nested_set(n_cpkr, [cid, pbcid, boxid, vote], old_count + count)
+    return boxids
+
+
+def read_reported_batch_tallies(e):
+    """
+    Read 2-reported/24-reported-batch-tallies/reported-batch-tallies-PBCID.csv
+    into e.rn_cpkr.
+    """
+
+    dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                           e.election_dirname,
+                           "2-reported",
+                           "24-reported-batch-tallies")
+    for pbcid in e.pbcids:
+        safe_pbcid = ids.filename_safe(pbcid)
+        filename = utils.greatest_name(dirpath,
+                                       "reported-batch-tallies-" + safe_pbcid,
+                                       ".csv")
+        boxids = read_batch_tallies_file(os.path.join(dirpath, filename), e.rn_cpkr)
+        for boxid in boxids:
+            if boxid not in e.rn_pk.get(pbcid, {}):
+                raise ValueError("Box {} of collection {} has reported tallies "
+                                 "but is not in the ballot manifest."
+                                 .format(boxid, pbcid))
+
+
+def read_audited_batch_tallies(e):
+    """
+    Read 3-audit/33-audited-votes/audited-batch-tallies-PBCID.csv into
+    e.an_cpka, and the boxes audited into e.audited_boxids_p.
+    Collections with no such file have no audited batches yet.
+
+    The boxes audited must be the first ones of the batch audit order
+    (e.shuffled_boxids_p, from compute_batch_audit_orders), since the
+    risk measurement assumes they are a random sample of the boxes;
+    raise ValueError if they are not.
+    """
+
+    dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                           e.election_dirname,
+                           "3-audit",
+                           "33-audited-votes")
+    e.an_cpka = {}
+    for pbcid in e.pbcids:
+        e.audited_boxids_p[pbcid] = []
+        safe_pbcid = ids.filename_safe(pbcid)
+        try:
+            filename = utils.greatest_name(dirpath,
+                                           "audited-batch-tallies-" + safe_pbcid,
+                                           ".csv")
+        except FileNotFoundError:
+            continue
+        boxids = read_batch_tallies_file(os.path.join(dirpath, filename), e.an_cpka)
+        for boxid in boxids:
+            if boxid not in e.rn_pk[pbcid]:
+                raise ValueError("Audited box {} is not in collection {}."
+                                 .format(boxid, pbcid))
+        expected = e.shuffled_boxids_p[pbcid][:len(boxids)]
+        if set(boxids) != set(expected):
+            raise ValueError(("Audited boxes of collection {} are not the first {} "
+                              "boxes of the batch audit order; not audited: {}; "
+                              "audited out of order: {}.")
+                             .format(pbcid, len(boxids),
+                                     sorted(set(expected) - set(boxids)),
+                                     sorted(set(boxids) - set(expected))))
+        e.audited_boxids_p[pbcid] = boxids
+
+
+def write_reported_batch_tallies(e):
+    """
+    Write 2-reported/24-reported-batch-tallies/reported-batch-tallies-PBCID.csv
+    from the reported CVRs (e.rv_cpb) and the boxes of the ballot
+    manifests (e.boxid_pb), as read by reported.read_reported.
+
+    Collections without CVRs are skipped.
+    """
+
+    dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                           e.election_dirname,
+                           "2-reported",
+                           "24-reported-batch-tallies")
+    os.makedirs(dirpath, exist_ok=True)
+    for pbcid in e.pbcids:
+        if e.cvr_type_p[pbcid] != "CVR":
+            logger.info("Collection %s has no CVRs; no batch tallies written.", pbcid)
+            continue
+        tally_kcr = {}
+        boxids = []
+        for bid in e.bids_p[pbcid]:
+            boxid = e.boxid_pb[pbcid][bid]
+            if boxid not in tally_kcr:
+                boxids.append(boxid)
+                tally_kcr[boxid] = {}
+            for cid in e.cids:
+                if bid in e.rv_cpb.get(cid, {}).get(pbcid, {}):
+                    vote = e.rv_cpb[cid][pbcid][bid]
+                    tally_r = tally_kcr[boxid].setdefault(cid, {})
+                    tally_r[vote] = tally_r.get(vote, 0) + 1
+        safe_pbcid = ids.filename_safe(pbcid)
+        filename = os.path.join(dirpath,
+                                "reported-batch-tallies-" + safe_pbcid + ".csv")
+        with open(filename, "w") as file:
+            fieldnames = ["Collection", "Box", "Contest", "Count", "Selections"]
+            file.write(",".join(fieldnames))
+            file.write("\n")
+            for boxid in boxids:
+                for cid in e.cids:
+                    tally_r = tally_kcr[boxid].get(cid, {})
+                    for vote in sorted(tally_r):
+                        file.write("{},".format(pbcid))
+                        file.write("{},".format(boxid))
+                        file.write("{},".format(cid))
+                        file.write("{},".format(tally_r[vote]))
+                        file.write(",".join(vote))
+                        file.write("\n")
+        logger.info("Batch tallies for collection %s written to: %s", pbcid, filename)
+
+
+##############################################################################
+# Batch audit order
+##############################################################################
+
+
+def compute_batch_audit_orders(e):
+    """
+    Compute e.shuffled_boxids_p, the order in which the boxes of each
+    collection are to be audited, from the audit seed (as in
+    audit_orders.compute_audit_order, but for boxes).
+    """
+
+    for pbcid in e.pbcids:
+        e.shuffled_boxids_p[pbcid] = \
+            audit_orders.shuffle(e.boxids_p[pbcid], str(e.audit_seed)+","+pbcid)
+
+
+def write_batch_audit_orders(e):
+    """ Write 3-audit/32-audit-orders/batch-audit-order-PBCID-DATETIME.csv """
+
+    dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT, e.election_dirname,
+                           "3-audit", "32-audit-orders")
+    os.makedirs(dirpath, exist_ok=True)
+    for pbcid in e.pbcids:
+        safe_pbcid = ids.filename_safe(pbcid)
+        filename = os.path.join(dirpath,
+                                "batch-audit-order-"+safe_pbcid+"-"+e.stage_time+".csv")
+        with open(filename, "w") as file:
+            fieldnames = ["Batch order",
+                          "Collection",
+                          "Box",
+                          "Number of ballots"]
+            file.write(",".join(fieldnames))
+            file.write("\n")
+            for i, boxid in enumerate(e.shuffled_boxids_p[pbcid]):
+                file.write("{},".format(i))
+                file.write("{},".format(pbcid))
+                file.write("{},".format(boxid))
+                file.write("{}".format(e.rn_pk[pbcid][boxid]))
+                file.write("\n")
+
+
+def plan_batches(e):
+    """
+    Return dict mapping pbcids to the number of boxes (in audit order)
+    that should have been audited by the end of the next stage: enough
+    more boxes to add at least e.max_audit_rate_p[pbcid] ballots.
+    """
+
+    plan_p = {}
+    for pbcid in e.pbcids:
+        order = e.shuffled_boxids_p[pbcid]
+        k = len(e.audited_boxids_p[pbcid])
+        added = 0
+        while k < len(order) and added < int(e.max_audit_rate_p[pbcid]):
+            added += e.rn_pk[pbcid][order[k]]
+            k += 1
+        plan_p[pbcid] = k
+    return plan_p
+
+
+##############################################################################
+# Risk measurement
+##############################################################################
+
+
+def batch_votes(e, cid):
+    """ Return sorted list of votes appearing in reported or audited tallies for cid. """
+
+    votes = set()
+    for n_cpkr in (e.rn_cpkr, e.an_cpka):
+        for pbcid in n_cpkr.get(cid, {}):
+            for boxid in n_cpkr[cid][pbcid]:
+                votes.update(n_cpkr[cid][pbcid][boxid])
+    return sorted(votes)
+
+
+def stratum_arrays(e, cid, pbcid, votes):
+    """
+    Return arrays describing collection pbcid for the bootstrap of contest cid:
+        base           reported tally of pbcid plus the discrepancies of
+                       its audited boxes (shape (V,))
+        unaudited      number of ballots in boxes not audited
+        discrepancies  audited minus reported tally for each audited box,
+                       then for each prior pseudo-box (shape (K, V))
+        sizes          number of ballots in each of these boxes (shape (K,))
+        alphas         Dirichlet parameter of each of these boxes (shape (K,))
+    Here V = len(votes), and K is the number of audited boxes plus V.
+    """
+
+    index = {vote: j for (j, vote) in enumerate(votes)}
+
+    def tally_vector(n_cpkr, boxid):
+        vector = np.zeros(len(votes))
+        tally_r = n_cpkr.get(cid, {}).get(pbcid, {}).get(boxid, {})
+        for vote in tally_r:
+            vector[index[vote]] += tally_r[vote]
+        return vector
+
+    reported_total = np.zeros(len(votes))
+    for boxid in e.boxids_p[pbcid]:
+        reported_total += tally_vector(e.rn_cpkr, boxid)
+    num_ballots = sum(e.rn_pk[pbcid].values())
+    audited = e.audited_boxids_p[pbcid]
+    discrepancies = [tally_vector(e.an_cpka, boxid) - tally_vector(e.rn_cpkr, boxid)
+                     for boxid in audited]
+    sizes = [e.rn_pk[pbcid][boxid] for boxid in audited]
+    base = reported_total + sum(discrepancies, np.zeros(len(votes)))
+    unaudited = num_ballots - sum(sizes)
+
+    # prior pseudo-boxes: one per vote, of average size, all for that vote
+    mean_size = num_ballots / max(1, len(e.boxids_p[pbcid]))
+    reported_rate = reported_total / max(1, num_ballots)
+    pseudo = mean_size * (np.eye(len(votes)) - reported_rate)
+    discrepancies = np.vstack([np.array(discrepancies).reshape(-1, len(votes)), pseudo])
+    sizes = np.array(sizes + [mean_size] * len(votes), dtype=float)
+    alphas = np.array([1.0] * len(audited) + [e.batch_pseudocount] * len(votes))
+    return base, unaudited, discrepancies, sizes, alphas
+
+
+def compute_batch_risk(e, mid, trials=None, chunk_size=10000, rs=None):
+    """
+    Compute (estimate) Bayesian risk for measurement mid (chance that
+    the reported outcome of contest e.cid_m[mid] is wrong), from the
+    audited and reported batch tallies, by the Bayesian bootstrap
+    described at the top of this file.
+
+    Trials are done in chunks of at most chunk_size, to bound memory.
+    """
+
+    cid = e.cid_m[mid]
+    if trials == None:
+        trials = e.n_trials
+    if rs is None:
+        rs = audit.auditRandomState
+    votes = batch_votes(e, cid)
+    strata = [stratum_arrays(e, cid, pbcid, votes)
+              for pbcid in sorted(e.possible_pbcid_c[cid])
+              if pbcid in e.rn_pk and sum(e.rn_pk[pbcid].values()) > 0]
+    wrong_outcome_count = 0
+    done = 0
+    while done < trials:
+        n = min(chunk_size, trials - done)
+        tallies = np.zeros((n, len(votes)))
+        for (base, unaudited, discrepancies, sizes, alphas) in strata:
+            # unnormalized Dirichlet weights (normalization cancels in the ratio)
+            weights = rs.gamma(alphas, size=(n, len(alphas)))
+            rate = weights.dot(discrepancies) / weights.dot(sizes)[:, None]
+            tallies += base + unaudited * rate
+        tallies = np.maximum(tallies, 0.0)
+        test_outcomes = outcomes.compute_outcomes_batch(e, cid, votes, tallies)
+        wrong_outcome_count += sum([1 for outcome in test_outcomes
+                                    if outcome != e.ro_c[cid]])
+        done += n
+
+    risk = wrong_outcome_count / trials
+    e.risk_tm[e.stage_time][mid] = risk
+    return risk
+
+
+def previous_batch_statuses(e):
+    """
+    Return dict mapping mids to their statuses at the end of the previous
+    stage: the latest earlier stage in e.status_tm, else the latest audit
+    output contest status file (written by an earlier run), else
+    e.initial_status_m.
+    """
+
+    earlier = [t for t in e.status_tm if t < e.stage_time]
+    if len(earlier) > 0:
+        return e.status_tm[max(earlier)]
+    dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                           e.election_dirname,
+                           "3-audit",
+                           "34-audit-output")
+    status_m = dict(e.initial_status_m)
+    try:
+        filename = utils.greatest_name(dirpath,
+                                       "audit-output-contest-status-",
+                                       ".csv")
+    except FileNotFoundError:
+        return status_m
+    fieldnames = ["Measurement id", "Contest", "Risk Measurement Method",
+                  "Risk Limit", "Risk Upset Threshold", "Sampling Mode",
+                  "Status", "Param 1", "Param 2"]
+    rows = csv_readers.read_csv_file(os.path.join(dirpath, filename), fieldnames)
+    for row in rows:
+        if row["Measurement id"] in status_m:
+            status_m[row["Measurement id"]] = row["Status"]
+    return status_m
+
+
+def compute_batch_statuses(e):
+    """
+    Compute status of each measurement from its status at the end of the
+    previous stage (see previous_batch_statuses) and its risk, as
+    audit.compute_statuses does for ballot-level audits: a measurement
+    moves from Open to Passed, Upset, or Exhausted, but not back.
+    """
+
+    previous_status_m = previous_batch_statuses(e)
+    e.status_tm[e.stage_time] = {}
+    exhausted = all(len(e.audited_boxids_p[pbcid]) == len(e.boxids_p[pbcid])
+                    for pbcid in e.pbcids)
+    for mid in e.mids:
+        status = previous_status_m[mid]
+        if status == "Open":
+            if e.risk_tm[e.stage_time][mid] < e.risk_limit_m[mid]:
+                status = "Passed"
+            elif e.risk_tm[e.stage_time][mid] > e.risk_upset_m[mid]:
+                status = "Upset"
+            elif exhausted:
+                status = "Exhausted"
+        e.status_tm[e.stage_time][mid] = status
+    e.election_status_t[e.stage_time] = \
+        sorted(list(set([e.status_tm[e.stage_time][mid]
+                         for mid in e.mids])))
+
+
+##############################################################################
+# Batch audit stage
+##############################################################################
+
+
+def batch_audit_stage(e):
+    """
+    Measure risks and statuses from the audited batch tallies so far,
+    and plan how many boxes (e.plan_boxes_tp), holding how many ballots
+    (e.plan_tp), each collection should have audited by the end of the
+    next stage.
+    """
+
+    e.risk_tm[e.stage_time] = {}
+    for mid in e.mids:
+        compute_batch_risk(e, mid)
+    compute_batch_statuses(e)
+    e.sn_tp[e.stage_time] = {pbcid: sum(e.rn_pk[pbcid][boxid]
+                                        for boxid in e.audited_boxids_p[pbcid])
+                             for pbcid in e.pbcids}
+    if not audit.stop_audit(e):
+        e.plan_boxes_tp[e.stage_time] = plan_batches(e)
+        e.plan_tp[e.stage_time] = \
+            {pbcid: sum(e.rn_pk[pbcid][boxid]
+                        for boxid in e.shuffled_boxids_p[pbcid]
+                                     [:e.plan_boxes_tp[e.stage_time][pbcid]])
+             for pbcid in e.pbcids}
+
+
+def batch_audit(e, args):
+    """
+    Run one stage of a batch-level comparison audit of election e.
+    """
+
+    election_spec.read_election_spec(e)
+    read_batch_reported(e)
+    audit.read_audit_spec(e, args)
+    e.stage_time = utils.datetime_string()
+    compute_batch_audit_orders(e)
+    read_audited_batch_tallies(e)
+
+    logger.info("====== Batch audit ======")
+    batch_audit_stage(e)
+    audit.show_risks_and_statuses(e)
+    audit.write_audit_output_contest_status(e)
+    logger.info("Audited boxes (ballots), by paper ballot collection:")
+    for pbcid in e.pbcids:
+        logger.info("  {}: {} of {} ({} of {})"
+                    .format(pbcid,
+                            len(e.audited_boxids_p[pbcid]),
+                            len(e.boxids_p[pbcid]),
+                            e.sn_tp[e.stage_time][pbcid],
+                            sum(e.rn_pk[pbcid].values())))
+    if e.stage_time in e.plan_boxes_tp:
+        write_batch_audit_orders(e)
+        logger.info("Audit the boxes in batch audit order up to number (exclusive):")
+        for pbcid in e.pbcids:
+            logger.info("  {}: {} ({} ballots)"
+                        .format(pbcid,
+                                e.plan_boxes_tp[e.stage_time][pbcid],
+                                e.plan_tp[e.stage_time][pbcid]))
+    else:
+        logger.info("No `Active' measurement still has `Open' status.")
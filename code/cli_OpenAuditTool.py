@@ -12,11 +12,15 @@ import argparse
 import logging
 
 import audit_orders
+import audit_server
+import audit_watch
+import batch_audit
 import OpenAuditTool
 import election_spec
 import ids
 import audit
 import reported
+import workload
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -71,10 +75,105 @@ def parse_args():
                         action="store_true",
                         help="Run audit based on current info.")
 
+    parser.add_argument("--simulate",
+                        action="store_true",
+                        help="With --audit, run the whole audit in simulation mode: stages "
+                        "are numbered by counters, state is kept in memory, and all "
+                        "outputs are written at the end.")
+
     parser.add_argument("--pause",
                         action="store_true",
                         help="Pause after each audit stage to obtain confirmation before proceedings.")
 
+    parser.add_argument("--serve",
+                        action="store_true",
+                        help="Load the election once and serve audit requests "
+                        "(submit audited votes, compute stage, get status) over "
+                        "HTTP on 127.0.0.1.")
+
+    parser.add_argument("--port",
+                        help="With --serve, the port to listen on.",
+                        default=8421)
+
+    parser.add_argument("--async_ingest",
+                        action="store_true",
+                        help="Read and parse the files of all collections concurrently "
+                        "(manifests, CVRs, and audited votes).")
+
+    parser.add_argument("--ingest_processes",
+                        help="Parse the files of all collections in this many worker "
+                        "processes (0 means one per CPU), merging the results.",
+                        default=None)
+
+    parser.add_argument("--column_cache",
+                        action="store_true",
+                        help="Keep parsed ballot manifests and CVRs in a binary cache "
+                        "(ELECTION/.cache), reused while the files are unchanged.")
+
+    parser.add_argument("--reported_cache",
+                        action="store_true",
+                        help="Keep totals derived from the reported data in a cache "
+                        "(ELECTION/.cache), reused while the election spec and "
+                        "reported data are unchanged; implies --column_cache.")
+
+    parser.add_argument("--batch_audit",
+                        action="store_true",
+                        help="Run a stage of a batch-level comparison audit, "
+                        "from reported and audited per-box tallies "
+                        "(see batch_audit.py).")
+
+    parser.add_argument("--make_batch_tallies",
+                        action="store_true",
+                        help="Write reported per-box tallies files "
+                        "(2-reported/24-reported-batch-tallies) from the reported CVRs.")
+
+    parser.add_argument("--watch",
+                        action="store_true",
+                        help="Load the election once, then run a new audit stage "
+                        "whenever audited-votes files are added or changed, "
+                        "recomputing risks only for affected contests.")
+
+    parser.add_argument("--watch_interval",
+                        help="With --watch, seconds between checks for changed "
+                        "audited-votes files.",
+                        default=1.0)
+
+    parser.add_argument("--workload",
+                        action="store_true",
+                        help="Forecast audit workload (ballots per collection and "
+                        "number of stages) by running many simulated audits.")
+
+    parser.add_argument("--workload_runs",
+                        help="With --workload, the number of simulated audits to run.",
+                        default=1000)
+
+    parser.add_argument("--workload_error_rate",
+                        help="With --workload, the chance that a ballot's actual vote "
+                        "differs from its reported (or synthetic) vote.",
+                        default=0.0)
+
+    parser.add_argument("--workload_processes",
+                        help="With --workload, the number of worker processes "
+                        "(default: number of CPUs).",
+                        default=None)
+
+    parser.add_argument("--workload_trials",
+                        help="With --workload, the number of trials used to "
+                        "estimate each risk.",
+                        default=1000)
+
+    parser.add_argument("--workload_from_syn2",
+                        action="store_true",
+                        help="With --workload, build the election from the syn2 spec "
+                        "elections/syn2_specs/ELECTION_DIRNAME.csv instead of "
+                        "from reported data.")
+
+    parser.add_argument("--workload_seed",
+                        help="With --workload, the audit seed to use if none is "
+                        "given by --set_audit_seed or the audit spec, so that "
+                        "forecasts can be repeated exactly.",
+                        default=1)
+
     parser.add_argument("--sample_by_size",
                         help="If true, then use sampling schemes, which use varying sample sizes on each"
                         " county, based on Dirichlet-Multinomial simulations.",
@@ -85,6 +184,22 @@ def parse_args():
                         " on how many votes to sample at each given step.",
                         default=False)
 
+    parser.add_argument("--use_greedy_planner",
+                        action="store_true",
+                        help="Allocate each stage's sample greedily to the collections where "
+                        "more ballots most reduce the projected risk of open contests.")
+
+    parser.add_argument("--stage_budget",
+                        help="With --use_greedy_planner, the total number of ballots "
+                        "to allocate per stage (default: no limit beyond "
+                        "the per-collection audit rates).",
+                        default=None)
+
+    parser.add_argument("--plan_time_budget",
+                        help="Wall-clock time (in seconds) allowed for planning each stage; "
+                        "when it runs out the planner returns the best plan found so far.",
+                        default=None)
+
     parser.add_argument("--num_winners",
                         help="When doing a sampling scheme with different sample sizes per county, "
                         "the number of winners required to consider a single "
@@ -116,6 +231,17 @@ def dispatch(e, args):
     e.max_num_it = int(args.max_num_it)
     e.sample_by_size = args.sample_by_size
     e.use_discrete_rm = args.use_discrete_rm
+    e.use_greedy_planner = args.use_greedy_planner
+    e.simulate = args.simulate
+    e.async_ingest = args.async_ingest
+    if args.ingest_processes != None:
+        e.ingest_processes = int(args.ingest_processes)
+    e.column_cache = args.column_cache
+    e.reported_cache = args.reported_cache
+    if args.stage_budget != None:
+        e.stage_budget = int(args.stage_budget)
+    if args.plan_time_budget != None:
+        e.plan_time_budget = float(args.plan_time_budget)
     e.pick_county_func = args.pick_county_func
 
     OpenAuditTool.ELECTIONS_ROOT = args.elections_root
@@ -130,7 +256,7 @@ def dispatch(e, args):
     elif args.read_reported:
         logger.info("read_reported")
         election_spec.read_election_spec(e)
-        reported.read_reported(e)
+        reported.read_reported(e, aggregates_only=True)
 
     elif args.make_audit_orders:
         logger.info("make_audit_orders")
@@ -144,5 +270,22 @@ def dispatch(e, args):
         reported.read_reported(e)
         audit.audit(e, args)
 
+    elif args.batch_audit:
+        batch_audit.batch_audit(e, args)
+
+    elif args.make_batch_tallies:
+        election_spec.read_election_spec(e)
+        reported.read_reported(e)
+        batch_audit.write_reported_batch_tallies(e)
+
+    elif args.serve:
+        audit_server.serve(e, args)
+
+    elif args.watch:
+        audit_watch.watch(e, args)
+
+    elif args.workload:
+        workload.forecast(e, args)
+
 
 
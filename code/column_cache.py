@@ -0,0 +1,296 @@
+# column_cache.py
+# Ronald L. Rivest
+# October 19, 2026
+# python3
+
+"""
+Binary columnar cache of parsed per-collection input files for OpenAuditTool.py.
+
+Parsing the reported ballot manifests and CVRs is by far the slowest
+part of reading an election, and the files rarely change once an
+audit starts.  So (when e.column_cache is True; command-line option
+--column_cache) the columns parsed from each such file are saved as
+integer codes in uncompressed numpy .npy files in a directory under
+ELECTION/.cache/, mirroring the layout of the election directory; for
+example
+
+    2-reported/22-reported-cvrs/reported-cvrs-PBCID.csv
+is cached in
+    .cache/2-reported/22-reported-cvrs/reported-cvrs-PBCID.csv/
+
+which holds:
+
+    strings.npy     code table: every distinct string value in the file
+                    (ballot ids, box ids, contest ids, style (group) ids,
+                    selids, ...), as a fixed-width unicode array
+    col-J.npy       for each column J (in the order requested), one int32
+                    code per row: for a plain field, the index in strings
+                    of the row's value (so ballot ids become bid indices);
+                    for the tuple-valued last field of a varlen file (the
+                    votes of a CVR file), the index of the row's tuple
+                    among the tuples below (a vote code)
+    tuple-items.npy, tuple-offsets.npy
+                    the distinct tuples: tuple T is
+                    strings[tuple-items[tuple-offsets[T]:tuple-offsets[T+1]]]
+    meta.json       the size, modification time, and SHA256 hash (see
+                    snapshot.hash_file) of the source file, the
+                    fieldnames and columns asked for, which columns are
+                    tuple-valued, and the cache format version
+
+The arrays are loaded with mmap_mode="r", so a cache hit reads only
+meta.json and the pages of the arrays actually used.  The columns are
+returned as CodedColumn sequences, which decode values as they are read.
+
+The cache is used only if meta.json matches the fieldnames and columns
+asked for and the source file; a source file whose size and
+modification time are unchanged is taken to be unchanged, and it is
+hashed only when they differ (if its hash still matches, just meta.json
+is updated).  Otherwise the source file is parsed as usual
+(csv_readers.read_csv_columns) and the cache rewritten.
+
+The cache is only an optimization: it may be deleted at any time.
+"""
+
+import collections.abc
+import json
+import logging
+import numpy as np
+import os
+
+import OpenAuditTool
+import csv_readers
+import snapshot
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+CACHE_VERSION = 2
+# increase whenever the cache file layout (or the parsing it records) changes
+
+CHUNK_SIZE = 65536
+# number of codes decoded at a time when iterating over a CodedColumn
+
+
+class CodedColumn(collections.abc.Sequence):
+    """
+    Read-only sequence of the values of one cached column: values[codes[i]]
+    for each i, decoded as they are read.
+    """
+
+    def __init__(self, codes, values):
+
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+
+        return len(self.codes)
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return [self.values[code] for code in self.codes[i].tolist()]
+        return self.values[int(self.codes[i])]
+
+    def __iter__(self):
+
+        for start in range(0, len(self.codes), CHUNK_SIZE):
+            yield from self.values.decode(self.codes[start:start+CHUNK_SIZE])
+
+
+class StringTable(object):
+    """ Strings of a cache's code table (a memory-mapped unicode array). """
+
+    def __init__(self, strings):
+
+        self.strings = strings
+
+    def __getitem__(self, code):
+
+        return str(self.strings[code])
+
+    def decode(self, codes):
+        """ Return list of the strings with the given array of codes. """
+
+        return self.strings[codes].tolist()
+
+
+class TupleTable(object):
+    """
+    Tuples of strings of a cache's code table; each is built once, when
+    first read, and then shared, as equal parsed values are.
+    """
+
+    def __init__(self, strings, items, offsets):
+
+        self.strings = strings
+        self.items = items
+        self.offsets = offsets
+        self.tuples = {}
+
+    def __getitem__(self, code):
+
+        value = self.tuples.get(code)
+        if value == None:
+            items = self.items[self.offsets[code]:self.offsets[code+1]]
+            value = self.tuples[code] = tuple(self.strings[items].tolist())
+        return value
+
+    def decode(self, codes):
+        """ Return list of the tuples with the given array of codes. """
+
+        return [self[code] for code in codes.tolist()]
+
+
+def cache_pathname(e, file_pathname):
+    """ Return pathname of cache directory for the given election input file. """
+
+    election_pathname = os.path.join(OpenAuditTool.ELECTIONS_ROOT, e.election_dirname)
+    relpath = os.path.relpath(file_pathname, election_pathname)
+    return os.path.join(election_pathname, ".cache", relpath)
+
+
+def source_meta(file_pathname, fieldnames, varlen, columns, sha256=None):
+    """
+    Return dict describing file file_pathname and what was parsed from it;
+    the file is hashed only if sha256 is None.
+    """
+
+    stat = os.stat(file_pathname)
+    if sha256 == None:
+        sha256 = snapshot.hash_file(file_pathname)
+    return {"version": CACHE_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+            "fieldnames": list(fieldnames),
+            "varlen": varlen,
+            "columns": list(columns)}
+
+
+def read_csv_columns(e, file_pathname, fieldnames, varlen, columns, processes=None):
+    """
+    Return columns (list of sequences of values, one per field named
+    in columns) of csv file file_pathname, as from
+    csv_readers.read_csv_columns(file_pathname, fieldnames, varlen,
+    processes, columns=columns), but from the cache if it is up to date;
+    otherwise parse the file and save the columns in the cache.
+    """
+
+    cache_dirname = cache_pathname(e, file_pathname)
+    result = load_columns(cache_dirname, file_pathname, fieldnames, varlen, columns)
+    if result != None:
+        return result
+    meta = source_meta(file_pathname, fieldnames, varlen, columns)
+    parsed = csv_readers.read_csv_columns(file_pathname, fieldnames, varlen,
+                                          processes=processes, columns=columns)
+    result = [parsed[column] for column in columns]
+    # values of the last field of a varlen file are tuples
+    meta["is_tuple"] = [varlen and column == fieldnames[-1] for column in columns]
+    try:
+        save_columns(cache_dirname, meta, result)
+    except OSError as error:
+        logger.warning("Could not write cache %s: %s", cache_dirname, error)
+    return result
+
+
+def save_array(cache_dirname, name, array):
+    """ Save array as cache_dirname/name.npy (atomically). """
+
+    filename = os.path.join(cache_dirname, name + ".npy")
+    with open(filename + ".tmp", "wb") as file:
+        np.save(file, array, allow_pickle=False)
+    os.replace(filename + ".tmp", filename)
+
+
+def save_meta(cache_dirname, meta):
+    """ Save meta as cache_dirname/meta.json (atomically). """
+
+    filename = os.path.join(cache_dirname, "meta.json")
+    with open(filename + ".tmp", "w") as file:
+        json.dump(meta, file)
+    os.replace(filename + ".tmp", filename)
+
+
+def save_columns(cache_dirname, meta, result):
+    """
+    Save columns result, coded as described at the top of this file, in
+    cache directory cache_dirname, with meta.json giving meta (which says
+    which columns are tuple-valued).  meta.json is removed first and
+    written last, so an interrupted save leaves no usable cache.
+    """
+
+    string_index = {}
+    tuple_index = {}
+    arrays = {}
+    for (j, column) in enumerate(result):
+        index = tuple_index if meta["is_tuple"][j] else string_index
+        codes = []
+        for value in column:
+            code = index.get(value)
+            if code == None:
+                code = index[value] = len(index)
+            codes.append(code)
+        arrays["col-{}".format(j)] = np.array(codes, dtype=np.int32)
+    tuple_items = []
+    tuple_offsets = [0]
+    for value in tuple_index:
+        for item in value:
+            if item not in string_index:
+                string_index[item] = len(string_index)
+            tuple_items.append(string_index[item])
+        tuple_offsets.append(len(tuple_items))
+    arrays["strings"] = np.array(list(string_index), dtype=str)
+    arrays["tuple-items"] = np.array(tuple_items, dtype=np.int32)
+    arrays["tuple-offsets"] = np.array(tuple_offsets, dtype=np.int64)
+
+    os.makedirs(cache_dirname, exist_ok=True)
+    if os.path.exists(os.path.join(cache_dirname, "meta.json")):
+        os.remove(os.path.join(cache_dirname, "meta.json"))
+    for name in arrays:
+        save_array(cache_dirname, name, arrays[name])
+    save_meta(cache_dirname, meta)
+
+
+def load_columns(cache_dirname, file_pathname, fieldnames, varlen, columns):
+    """
+    Return columns (as CodedColumns) saved in cache directory
+    cache_dirname, or None if there is no such cache, or it is not for
+    the given source file, fieldnames, and columns.
+    """
+
+    meta_filename = os.path.join(cache_dirname, "meta.json")
+    try:
+        with open(meta_filename) as file:
+            meta = json.load(file)
+        wanted = source_meta(file_pathname, fieldnames, varlen, columns,
+                             sha256=meta["sha256"])
+        if any(meta[key] != wanted[key]
+               for key in ["version", "fieldnames", "varlen", "columns"]):
+            return None
+        if meta["size"] != wanted["size"] or meta["mtime_ns"] != wanted["mtime_ns"]:
+            if wanted["size"] != meta["size"] or \
+               snapshot.hash_file(file_pathname) != meta["sha256"]:
+                return None
+            # same contents, just touched: remember the new modification time
+            meta["mtime_ns"] = wanted["mtime_ns"]
+            save_meta(cache_dirname, meta)
+
+        def load(name):
+            return np.load(os.path.join(cache_dirname, name + ".npy"),
+                           mmap_mode="r", allow_pickle=False)
+
+        strings = load("strings")
+        tuples = TupleTable(strings, load("tuple-items"), load("tuple-offsets"))
+        string_table = StringTable(strings)
+        result = []
+        for j in range(len(columns)):
+            values = tuples if meta["is_tuple"][j] else string_table
+            result.append(CodedColumn(load("col-{}".format(j)), values))
+        return result
+    except FileNotFoundError:
+        return None
+    except (OSError, KeyError, ValueError, TypeError) as error:
+        logger.warning("Ignoring unreadable cache %s: %s", cache_dirname, error)
+        return None
@@ -37,67 +37,296 @@ becomes:
       {'A':'4', 'B':'5', 'C':()},
       {'A':'6', 'B':'7', 'C':('8','9')},
     ]
+
+The readers may also be given a projection, columns=[fieldnames...];
+then each row is instead a tuple of the values of just those fields,
+in that order, and the other fields are not cleaned at all.
+Example: (varlen csv file above, with columns=['C', 'A'])
+    [ (('3',), '1'),
+      ((), '4'),
+      (('8','9'), '6'),
+    ]
+
+A file with a compression suffix (e.g. "reported-cvrs-P1.csv.gz",
+or .bz2 or .xz) is decompressed as it is read; see utils.open_file.
 """
 
+import concurrent.futures
 import csv
+import io
+import locale
+import os
 import warnings
 
 import ids
+import utils
 
-def read_csv_file(filename, required_fieldnames=None, varlen=False):
+CHUNK_SIZE = 2**24
+# size in bytes of the pieces a file is split into for chunked parsing
+# (see read_csv_columns_chunked)
+
+def read_csv_file(filename, required_fieldnames=None, varlen=False, columns=None):
     """
     Read CSV file and check required fieldnames present; varlen if variable-length rows.
+    If columns is given, rows are tuples of the values of those fields only.
+    """
+
+    return list(iter_csv_file(filename, required_fieldnames, varlen, columns))
+
+
+def iter_csv_file(filename, required_fieldnames=None, varlen=False, columns=None):
+    """
+    Return iterator over the rows (as dicts, or if columns is given, as
+    tuples of the values of those fields) of CSV file, as read_csv_file
+    would give them, but read lazily, so memory use does not grow with
+    the size of the file.
+
+    The header is read and checked (raising ValueError if required
+    fieldnames are missing) before this returns; the file is closed
+    when the iterator is exhausted.
+    """
+
+    file = utils.open_file(filename)
+    try:
+        reader = csv.reader(file)
+        fieldnames = read_header(filename, reader)
+        check_fieldnames(filename, fieldnames, required_fieldnames)
+        indices = column_indices(filename, fieldnames, columns)
+    except:
+        file.close()
+        raise
+    return iter_rows(file, reader, fieldnames, varlen, indices, columns == None)
+
+
+def iter_rows(file, reader, fieldnames, varlen, indices, as_dicts):
+    """ Generate rows from csv reader on file; close file at end. """
+
+    with file:
+        if as_dicts:
+            for row in clean_rows(reader, fieldnames, varlen, indices):
+                yield dict(zip(fieldnames, row))
+        else:
+            yield from clean_rows(reader, fieldnames, varlen, indices)
+
+
+def read_header(filename, reader):
+    """ Return cleaned fieldnames from the header row of csv reader. """
+
+    try:
+        return clean_fieldnames(next(reader))
+    except StopIteration:
+        raise ValueError("File {} has no header row.".format(filename)) from None
+
+
+def column_indices(filename, fieldnames, columns):
+    """
+    Return list of positions in fieldnames of the fields in columns
+    (all fields, if columns is None); raise ValueError if one is missing.
+    """
+
+    if columns == None:
+        return list(range(len(fieldnames)))
+    columns = [ids.clean_id(column) for column in columns]
+    missing = [column for column in columns if column not in fieldnames]
+    if len(missing) > 0:
+        raise ValueError("File {} has fieldnames {}; missing requested columns {}."
+                         .format(filename, fieldnames, missing))
+    return [fieldnames.index(column) for column in columns]
+
+
+def read_csv_columns(filename, required_fieldnames=None, varlen=False,
+                     processes=None, chunk_size=CHUNK_SIZE, columns=None):
     """
+    Read CSV file as read_csv_file does, but return it by columns:
+    a dict mapping each fieldname (or just each one in columns, if
+    given) to the list of its values, one per row.
 
-    with open(filename) as file:
+    Equal values within a column are made the same object, so
+    repetitive columns (such as collection, contest, or vote) take
+    little memory, and pickle compactly (as when returned from a
+    worker process).
+
+    If processes is not None and the file is at least two chunks long,
+    it is parsed in chunks by that many worker processes (0 means one
+    per CPU); see read_csv_columns_chunked.  (Compressed files are
+    always read sequentially.)
+    """
+
+    if processes != None and utils.compression_suffix(filename) == "" and \
+       os.path.getsize(filename) >= 2 * chunk_size:
+        result = read_csv_columns_chunked(filename, required_fieldnames, varlen,
+                                          processes, chunk_size, columns)
+        if result != None:
+            return result
+
+    with utils.open_file(filename) as file:
         reader = csv.reader(file)
-        rows = [row for row in reader]
-        fieldnames = rows[0]
-        rows = rows[1:]
-
-        # gather, clean, and trim field names, eliminating blanks
-        fieldnames = [ids.clean_id(fieldname) for fieldname in fieldnames]
-        while len(fieldnames)>0 and fieldnames[-1]=='':
-            fieldnames.pop()
-        if len(set(fieldnames)) != len(fieldnames):
-            raise ValueError("Duplicate field name: {}".format(fieldnames))
-
-        # data rows
-        row_dicts = []
-        for row in rows:
-            row = ["" if item==None else ids.clean_id(item) for item in row]
-            while len(row)>0 and row[-1] == '':
-                row.pop()
-            if not varlen:
-                if len(row) > len(fieldnames):
-                    warnings.warn("Ignoring extra values in row: {}".format(row))
-                    row = row[:len(fieldnames)]
-                while len(row) < len(fieldnames):
-                    row.append("")
-            row_dict = {}
-            for (fieldname, value) in zip(fieldnames, row):
-                row_dict[fieldname] = value
-            if varlen:
-                if len(row) < len(fieldnames)-1:
-                    if len(row) > 0:
-                        warnings.warn("Ignoring too-short row: {}".format(row))
-                    continue
-                last_fieldname = fieldnames[-1]
-                last_value = tuple(row[len(fieldnames)-1:])
-                row_dict[last_fieldname] = last_value
-            row_dicts.append(row_dict)
-        if required_fieldnames != None:
-            # check that all required fieldnames are present
-            required_fieldnames = [ids.clean_id(id) for id in required_fieldnames]
-            missing_fieldnames = set(required_fieldnames).difference(set(fieldnames))
-            if len(missing_fieldnames) > 0:
-                raise ValueError("File {} has fieldnames {}, while {} are required. Missing {}."
-                                 .format(filename, fieldnames, required_fieldnames, missing_fieldnames))
-            # check to see if extra fieldnames present; warn user if so
-            extra_fieldnames = set(fieldnames).difference(set(required_fieldnames))
-            if len(extra_fieldnames) > 0:
-                warnings.warn("File {} has extra fieldnames (ignored): {}"
-                              .format(filename, extra_fieldnames))
-        return row_dicts
-
-    
+        fieldnames = read_header(filename, reader)
+        check_fieldnames(filename, fieldnames, required_fieldnames)
+        indices = column_indices(filename, fieldnames, columns)
+        result = rows_to_columns(reader, fieldnames, varlen, indices)
+        return dict(zip([fieldnames[i] for i in indices], result))
+
+
+def read_csv_columns_chunked(filename, required_fieldnames, varlen,
+                             processes=0, chunk_size=CHUNK_SIZE, columns=None):
+    """
+    Read CSV file by columns, as read_csv_columns does, but split the
+    part after the header into byte ranges of about chunk_size bytes,
+    each ending at a line boundary, parse the ranges in a pool of
+    processes worker processes (0 means one per CPU), and join the
+    resulting columns in file order.
+
+    Splitting at line boundaries is only correct if no quoted value
+    contains a newline, so if the file has any quote character at all,
+    nothing is returned (None), and the caller should read the file
+    sequentially.  (Election data files are not normally quoted.)
+    Likewise for a compressed file, which cannot be split by byte offsets.
+
+    Warnings about malformed rows are given in the worker processes.
+    """
+
+    if utils.compression_suffix(filename) != "":
+        return None
+    encoding = locale.getpreferredencoding(False)
+    with open(filename, "rb") as file:
+        header = file.readline()
+        if b'"' in header:
+            return None
+        fieldnames = read_header(filename, csv.reader([header.decode(encoding)]))
+        check_fieldnames(filename, fieldnames, required_fieldnames)
+        indices = column_indices(filename, fieldnames, columns)
+        size = os.fstat(file.fileno()).st_size
+        starts = [file.tell()]
+        while starts[-1] + chunk_size < size:
+            file.seek(starts[-1] + chunk_size)
+            file.readline()
+            if file.tell() >= size:
+                break
+            starts.append(file.tell())
+    ranges = list(zip(starts, starts[1:] + [size]))
+
+    max_workers = min(processes or os.cpu_count() or 1, len(ranges))
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        chunks = list(executor.map(parse_chunk,
+                                   [filename] * len(ranges),
+                                   ranges,
+                                   [fieldnames] * len(ranges),
+                                   [varlen] * len(ranges),
+                                   [indices] * len(ranges),
+                                   [encoding] * len(ranges)))
+    if any(chunk == None for chunk in chunks):
+        return None
+
+    # join in file order, sharing equal values across chunks too
+    result = []
+    for j in range(len(indices)):
+        unique = {}
+        result.append([unique.setdefault(value, value)
+                       for chunk in chunks
+                       for value in chunk[j]])
+    return dict(zip([fieldnames[i] for i in indices], result))
+
+
+def parse_chunk(filename, byte_range, fieldnames, varlen, indices, encoding):
+    """
+    Parse the data rows in the given byte range (start, end) of filename,
+    which has the given fieldnames; return list of columns (for the fields
+    at the given indices), or None if the range contains a quote character.
+    """
+
+    (start, end) = byte_range
+    with open(filename, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+    if b'"' in data:
+        return None
+    rows = csv.reader(io.StringIO(data.decode(encoding), newline=""))
+    return rows_to_columns(rows, fieldnames, varlen, indices)
+
+
+def rows_to_columns(rows, fieldnames, varlen, indices):
+    """
+    Convert raw csv rows to cleaned columns (list of lists of values,
+    one for each of the fields at the given indices), sharing equal
+    values within each column.
+    """
+
+    result = [[] for i in indices]
+    uniques = [{} for i in indices]
+    for row in clean_rows(rows, fieldnames, varlen, indices):
+        for (column, unique, value) in zip(result, uniques, row):
+            column.append(unique.setdefault(value, value))
+    return result
+
+
+def clean_fieldnames(fieldnames):
+    """
+    Gather, clean, and trim field names, eliminating blanks;
+    raise ValueError if there are duplicates.
+    """
+
+    fieldnames = [ids.clean_id(fieldname) for fieldname in fieldnames]
+    while len(fieldnames)>0 and fieldnames[-1]=='':
+        fieldnames.pop()
+    if len(set(fieldnames)) != len(fieldnames):
+        raise ValueError("Duplicate field name: {}".format(fieldnames))
+    return fieldnames
+
+
+def clean_item(item):
+
+    return "" if item==None else ids.clean_id(item)
+
+
+def clean_rows(rows, fieldnames, varlen, indices):
+    """
+    Generate cleaned data rows, as tuples of the values of the fields
+    at the given indices (for varlen files the value of the last field
+    is a tuple; see above).
+
+    Only the values of those fields (and any trailing blank values,
+    which are dropped) are cleaned.
+    """
+
+    last = len(fieldnames) - 1
+    for row in rows:
+        # drop trailing values that are blank once cleaned
+        k = len(row)
+        while k > 0 and clean_item(row[k-1]) == '':
+            k -= 1
+        if not varlen:
+            if k > len(fieldnames):
+                warnings.warn("Ignoring extra values in row: {}"
+                              .format([clean_item(item) for item in row[:k]]))
+            yield tuple(clean_item(row[i]) if i < k else ""
+                        for i in indices)
+        else:
+            if k < last:
+                if k > 0:
+                    warnings.warn("Ignoring too-short row: {}"
+                                  .format([clean_item(item) for item in row[:k]]))
+                continue
+            yield tuple(clean_item(row[i]) if i < last
+                        else tuple(clean_item(item) for item in row[last:k])
+                        for i in indices)
+
+
+def check_fieldnames(filename, fieldnames, required_fieldnames):
+    """
+    Check that all required fieldnames are present (raising ValueError
+    if not); warn if there are extra fieldnames.
+    """
+
+    if required_fieldnames != None:
+        # check that all required fieldnames are present
+        required_fieldnames = [ids.clean_id(id) for id in required_fieldnames]
+        missing_fieldnames = set(required_fieldnames).difference(set(fieldnames))
+        if len(missing_fieldnames) > 0:
+            raise ValueError("File {} has fieldnames {}, while {} are required. Missing {}."
+                             .format(filename, fieldnames, required_fieldnames, missing_fieldnames))
+        # check to see if extra fieldnames present; warn user if so
+        extra_fieldnames = set(fieldnames).difference(set(required_fieldnames))
+        if len(extra_fieldnames) > 0:
+            warnings.warn("File {} has extra fieldnames (ignored): {}"
+                          .format(filename, extra_fieldnames))
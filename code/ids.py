@@ -24,6 +24,9 @@ def clean_id(id):
     blank.  Also, all nonprintable characters are removed.
     """
 
+    if id.isprintable() and "  " not in id:
+        # common case: nothing to do but trim blanks from the ends
+        return id.strip()
     id = id.strip()
     new_id = ""
     for c in id:
@@ -0,0 +1,140 @@
+# ingest.py
+# Ronald L. Rivest
+# October 19, 2026
+# python3
+
+"""
+Concurrent ingestion of per-collection input files for OpenAuditTool.py.
+
+Reading the files of a collection is split into two steps:
+
+    parse(e, pbcid)          finds and reads the file(s) for pbcid,
+                             returning its columns (one list of values
+                             per field); it does not change e
+    merge(e, pbcid, rows)    puts the rows (tuples of values) into the
+                             election tables
+
+(for example reported.parse_reported_cvrs and reported.merge_reported_cvrs).
+The sequential readers just call merge(e, pbcid, zip(*parse(e, pbcid)))
+for each pbcid in turn.
+
+Here all the parses (for all collections, and for several kinds of file
+at once) are started together under asyncio, each one run in an
+executor, so waiting on disk and parsing overlap; the merges are then
+done in this thread, in sorted pbcid order (and in the order the kinds
+of file are given), so the resulting tables do not depend on which
+parse finishes first.
+
+The executor is a pool of threads, or, if e.ingest_processes is set
+(command-line option --ingest_processes), a pool of that many worker
+processes, so that parsing itself runs on several cores.  (If there
+are fewer collections than worker processes, the collections are
+instead parsed one after another, with each big file split into chunks
+parsed by the workers.)  Parses only
+look at e.election_dirname, e.column_cache, and
+OpenAuditTool.ELECTIONS_ROOT, so a worker process is sent just those,
+not the election.  Columns come
+back with equal values shared (see csv_readers.read_csv_columns), so
+they are cheap to send from the worker.
+
+This is used instead of the sequential readers when e.async_ingest is
+True (command-line option --async_ingest) or e.ingest_processes is set.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+
+import OpenAuditTool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ElectionDir(object):
+    """ Stand-in for an Election, with just what parse routines need. """
+
+    def __init__(self, election_dirname, pbcids, column_cache=False):
+        self.election_dirname = election_dirname
+        self.pbcids = pbcids                # to tell apart files of collections
+        self.ingest_processes = None      # no chunked parsing within a worker
+        self.column_cache = column_cache
+
+
+def parse_in_worker(parse, elections_root, election_dirname, pbcids, column_cache, pbcid):
+    """ Run parse for pbcid in a worker process. """
+
+    OpenAuditTool.ELECTIONS_ROOT = elections_root
+    return parse(ElectionDir(election_dirname, pbcids, column_cache), pbcid)
+
+
+async def read_collections_async(e, readers, executor=None, processes=False):
+    """
+    For each (parse, merge) pair in readers, parse the files of every
+    collection of e concurrently in executor (the event loop's default
+    executor if None), then merge the results into e in sorted pbcid order.
+
+    If processes is True, executor is a process pool.
+    """
+
+    loop = asyncio.get_event_loop()       # the running loop (Python 3.6 has no get_running_loop)
+    pbcids = sorted(e.pbcids)
+    if processes:
+        futures = [[loop.run_in_executor(executor, parse_in_worker, parse,
+                                         OpenAuditTool.ELECTIONS_ROOT,
+                                         e.election_dirname, pbcids,
+                                         e.column_cache, pbcid)
+                    for pbcid in pbcids]
+                   for (parse, merge) in readers]
+    else:
+        futures = [[loop.run_in_executor(executor, parse, e, pbcid)
+                    for pbcid in pbcids]
+                   for (parse, merge) in readers]
+    try:
+        for ((parse, merge), futures_p) in zip(readers, futures):
+            for (pbcid, future) in zip(pbcids, futures_p):
+                merge(e, pbcid, zip(*await future))
+    finally:
+        for futures_p in futures:
+            for future in futures_p:
+                future.cancel()
+
+
+def run(coroutine):
+    """
+    Run coroutine to completion in a new event loop, and return its
+    result (as asyncio.run does, but also on Python 3.6).
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def read_collections(e, readers, processes=None):
+    """
+    Run read_collections_async(e, readers), with parses done in a pool
+    of threads, or if processes is not None, in a pool of that many
+    worker processes (0 means one per CPU).  With fewer collections
+    than worker processes, parse the collections in turn instead,
+    each file in chunks.
+    """
+
+    if processes == None:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            run(read_collections_async(e, readers, executor))
+        return
+    max_workers = processes or os.cpu_count() or 1
+    if len(e.pbcids) < max_workers:
+        # too few collections to keep the workers busy: parse collections
+        # in turn here, each big file split into chunks that are parsed
+        # by the workers (see csv_readers.read_csv_columns)
+        for (parse, merge) in readers:
+            for pbcid in sorted(e.pbcids):
+                merge(e, pbcid, zip(*parse(e, pbcid)))
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        run(read_collections_async(e, readers, executor, processes=True))
@@ -14,10 +14,13 @@ An outcome is always a *tuple* of ids, even if there is only one winner.
 # TBD: Tie-breaking, etc.
 
 
+import numpy as np
+
 import ids
 
 
 
+
 def compute_tally(vec):
     """
     Here vec is an iterable of hashable elements.
@@ -30,22 +33,52 @@ def compute_tally(vec):
     return tally
 
 
+def number_of_winners(e, cid):
+    """
+    Return number of winners for contest cid: for a plurality contest,
+    from e.params_c[cid] (default 1 if not given); for other contest
+    types (whose params mean something else, if anything), 1.
+    """
+
+    if e is None or e.contest_type_c.get(cid, "").lower() != "plurality" or \
+       e.params_c.get(cid, "") == "":
+        return 1
+    return int(e.params_c[cid])
+
+
 def plurality(e, cid, tally):
     """
     Return, for input dict tally mapping votes to (int) counts, 
-    vote with largest count.  (Tie-breaking done arbitrarily here.)
+    vote with largest count.  Ties are broken in favor of the smallest
+    selid, as in plurality_batch.
     Winning vote must be a valid winner 
     (e.g. not ("-Invalid",) or ("-NoSuchContest",) )
     an Exception is raised if this is not possible.
     An undervote or an overvote can't win.
+
+    If the contest has k>1 winners (see number_of_winners), then each
+    vote with 1 to k selids counts once for each of its selids, and
+    the outcome is the tuple of the k selids with the largest counts,
+    in sorted (canonical) order.
     """
-    max_cnt = -1e90
+
+    k = number_of_winners(e, cid)
+    if k > 1:
+        selid_tally = {}
+        for vote in tally:
+            if 1 <= len(vote) <= k and \
+               not any(ids.is_error_selid(selid) for selid in vote):
+                for selid in vote:
+                    selid_tally[selid] = selid_tally.get(selid, 0) + tally[vote]
+        winners = sorted(selid_tally,
+                         key=lambda selid: (-selid_tally[selid], selid))[:k]
+        return tuple(sorted(winners))
+
     max_vote = None
-    for vote in tally:
-        if tally[vote] > max_cnt and \
+    for vote in sorted(tally):
+        if (max_vote == None or tally[vote] > tally[max_vote]) and \
            len(vote) == 1 and \
            not ids.is_error_selid(vote[0]):
-            max_cnt = tally[vote]
             max_vote = vote
 
     if max_vote==None:
@@ -53,6 +86,63 @@ def plurality(e, cid, tally):
     return max_vote
 
 
+def plurality_index(votes, k):
+    """
+    Precompute index structures for plurality with k winners.
+
+    Output: (selids, incidence) where selids is the sorted list of
+            selids that can win, and incidence is an array of shape
+            (len(votes), len(selids)) with incidence[v, j] = 1 if
+            vote votes[v] counts for selids[j] (see plurality), else 0.
+    """
+
+    def valid(vote):
+        return 1 <= len(vote) <= k and \
+            not any(ids.is_error_selid(selid) for selid in vote)
+
+    selids = sorted(set(selid for vote in votes if valid(vote) for selid in vote))
+    selid_index = {selid: j for (j, selid) in enumerate(selids)}
+    incidence = np.zeros((len(votes), len(selids)))
+    for v, vote in enumerate(votes):
+        if valid(vote):
+            for selid in vote:
+                incidence[v, selid_index[selid]] = 1
+    return (selids, incidence)
+
+
+def plurality_batch(e, cid, votes, tallies, index=None):
+    """
+    Compute plurality outcomes for many tallies at once.
+
+    Input:  votes     list of votes
+            tallies   array of shape (trials, len(votes))
+            index     optional result of plurality_index(votes, k)
+    Output: list (of length trials) of outcomes.
+
+    Selid totals for all trials are one matrix product, and the top k
+    selids of each trial are found with one (stable) sort, so a contest
+    with several winners costs about the same per trial as one with
+    a single winner.  Ties are broken in favor of the smallest selid,
+    as in plurality.
+    """
+
+    k = number_of_winners(e, cid)
+    if index is None:
+        index = plurality_index(votes, k)
+    (selids, incidence) = index
+    if len(selids) == 0:
+        raise ValueError("No winner allowed in plurality contest {}.".format(cid))
+    totals = np.asarray(tallies, dtype=float).dot(incidence)
+    if k == 1:
+        return [(selids[j],) for j in np.argmax(totals, axis=1)]
+    # selids are sorted, so a stable sort by decreasing total puts the
+    # smallest of tied selids first, and sorting indices of the top k
+    # gives canonical order
+    top = np.argsort(-totals, axis=1, kind="stable")[:, :k]
+    top.sort(axis=1)
+    return [tuple(selids[j] for j in row) for row in top]
+
+
 def approval(e,cid,tally):
     """
     {("Alice","Bob"):3,("Alice"):2,("Eve"):1,():4}
@@ -70,6 +160,263 @@ def approval(e,cid,tally):
     return outcome
 
 
+##############################################################################
+# Ranked-choice (preferential) contests
+#
+# Tallies for ranked contests are keyed by ranking pattern: the vote
+# tuple itself, e.g. ("Bob", "Alice", "Carol") for a ballot ranking Bob
+# first, Alice second, and Carol third.  A tally thus compresses all
+# ballots with the same ranking into a single count, and elimination
+# rounds work on these pattern counts, not on individual ballots.
+
+
+def ranking_index(votes):
+    """
+    Precompute index structures for ranked votes.
+
+    Input:  votes   list of votes (tuples of selids, in preference order)
+
+    Output: (candidates, prefs) where
+            candidates  sorted list of selids that can win (error selids,
+                        those starting with "-", are dropped).
+            prefs       array of shape (len(votes), width) where 
+                        prefs[v, k] is the index (into candidates) of the
+                        k-th valid preference of votes[v].  Rows are padded
+                        with the sentinel len(candidates), which denotes an
+                        exhausted ballot; every row ends with a sentinel.
+    Repeated selids in a ranking count only at their first position.
+    """
+
+    candidates = sorted(set(selid
+                            for vote in votes
+                            for selid in vote
+                            if not ids.is_error_selid(selid)))
+    cand_index = {selid: i for (i, selid) in enumerate(candidates)}
+    C = len(candidates)
+    rankings = []
+    for vote in votes:
+        ranking = []
+        for selid in vote:
+            if selid in cand_index and cand_index[selid] not in ranking:
+                ranking.append(cand_index[selid])
+        rankings.append(ranking)
+    width = 1 + max([len(ranking) for ranking in rankings], default=0)
+    prefs = np.full((len(votes), width), C, dtype=int)
+    for v, ranking in enumerate(rankings):
+        prefs[v, :len(ranking)] = ranking
+    return (candidates, prefs)
+
+
+def irv_batch(e, cid, votes, tallies, index=None):
+    """
+    Compute IRV (instant-runoff) outcomes for many tallies at once.
+
+    Input:  votes     list of ranking patterns (votes)
+            tallies   array of shape (trials, len(votes)); tallies[t, v] is
+                      the count of pattern votes[v] in trial t.
+            index     optional result of ranking_index(votes), so that it
+                      can be computed once and reused.
+    Output: list (of length trials) of outcomes (winner,)
+
+    All trials run their elimination rounds together.  Each trial keeps,
+    for each pattern, a pointer to its current preference; when a
+    candidate is eliminated, only the patterns whose current preference
+    is that candidate advance their pointers (to their next preference).
+    A candidate wins when it has a majority of the continuing (not
+    exhausted) ballots, or is the only one left.  Ties for elimination
+    are broken in favor of eliminating the candidate that is first in
+    sorted order.  (TBD: better tie-breaking.)
+    """
+
+    if index is None:
+        index = ranking_index(votes)
+    (candidates, prefs) = index
+    C = len(candidates)
+    if C == 0:
+        raise ValueError("No winner allowed in IRV contest {}.".format(cid))
+    tallies = np.asarray(tallies, dtype=float)
+    trials = tallies.shape[0]
+    V = len(votes)
+
+    rows = np.arange(V)
+    trial_offsets = (C+1) * np.arange(trials)[:, None]
+    ptr = np.zeros((trials, V), dtype=int)
+    eliminated = np.zeros((trials, C+1), dtype=bool)   # column C: exhausted
+    winner = np.full(trials, -1, dtype=int)
+    trial_rows = np.arange(trials)[:, None]
+
+    for _ in range(C):
+        # advance pointers of patterns whose current preference is eliminated
+        top = prefs[rows, ptr]
+        stale = eliminated[trial_rows, top]
+        while stale.any():
+            ptr += stale
+            top = prefs[rows, ptr]
+            stale = eliminated[trial_rows, top]
+
+        totals = np.bincount((trial_offsets + top).ravel(),
+                             weights=tallies.ravel(),
+                             minlength=trials*(C+1)).reshape(trials, C+1)[:, :C]
+        active = ~eliminated[:, :C]
+        continuing = totals.sum(axis=1)
+        leader = np.argmax(np.where(active, totals, -1.0), axis=1)
+        leader_total = totals[np.arange(trials), leader]
+        done = (winner < 0) & ((2 * leader_total > continuing) | (active.sum(axis=1) == 1))
+        winner[done] = leader[done]
+        if (winner >= 0).all():
+            break
+
+        loser = np.argmin(np.where(active, totals, np.inf), axis=1)
+        still_running = winner < 0
+        eliminated[np.arange(trials)[still_running], loser[still_running]] = True
+
+    return [(candidates[w],) for w in winner]
+
+
+def irv(e, cid, tally):
+    """
+    Return IRV outcome (winner,) for input dict tally mapping 
+    ranking patterns (votes) to counts.
+    """
+
+    votes = list(tally)
+    tallies = np.array([[tally[vote] for vote in votes]], dtype=float)
+    return irv_batch(e, cid, votes, tallies)[0]
+
+
+##############################################################################
+# Condorcet-family contests (from pairwise-preference matrices)
+#
+# The pairwise-preference matrix d for a tally has d[i, j] equal to the
+# number of ballots ranking candidate i above candidate j (a ranked
+# candidate is above every unranked one).  Since d is linear in the
+# tally, it is computed for many tallies at once as a single tensor
+# contraction of the (trials x patterns) tally matrix with a
+# precomputed (patterns x candidates x candidates) pattern tensor;
+# likewise the matrix for a sum of tallies (e.g. sample plus nonsample)
+# is the sum of their matrices.
+
+
+def pairwise_index(votes):
+    """
+    Precompute index structures for pairwise preferences.
+
+    Output: (candidates, W) where candidates is as for ranking_index, and
+            W is an array of shape (len(votes), C, C), C = len(candidates),
+            with W[v, i, j] = 1 if votes[v] ranks candidates[i] above
+            candidates[j], else 0.
+    """
+
+    (candidates, prefs) = ranking_index(votes)
+    C = len(candidates)
+    W = np.zeros((len(votes), C, C))
+    for v in range(len(votes)):
+        ranking = [i for i in prefs[v] if i < C]
+        unranked = [j for j in range(C) if j not in ranking]
+        for k, i in enumerate(ranking):
+            W[v, i, ranking[k+1:]] = 1
+            W[v, i, unranked] = 1
+    return (candidates, W)
+
+
+def pairwise_matrix(tallies, index):
+    """
+    Return array of shape (trials, C, C) of pairwise-preference matrices
+    for the rows of tallies (shape (trials, len(votes))), given
+    index = pairwise_index(votes).
+    """
+
+    (candidates, W) = index
+    return np.tensordot(np.asarray(tallies, dtype=float), W, axes=(1, 0))
+
+
+def schulze_batch(e, cid, votes, tallies, index=None):
+    """
+    Compute Schulze-method outcomes for many tallies at once.
+
+    Strongest-path strengths are computed by a Floyd-Warshall pass
+    done on all trials' pairwise matrices together.  Among candidates
+    beating or tying all others on path strength, the first in sorted
+    order wins.  (TBD: better tie-breaking.)
+    """
+
+    if index is None:
+        index = pairwise_index(votes)
+    (candidates, W) = index
+    C = len(candidates)
+    if C == 0:
+        raise ValueError("No winner allowed in Schulze contest {}.".format(cid))
+    d = pairwise_matrix(tallies, index)
+    p = np.where(d > d.transpose(0, 2, 1), d, 0.0)
+    for k in range(C):
+        p = np.maximum(p, np.minimum(p[:, :, k:k+1], p[:, k:k+1, :]))
+    wins = (p >= p.transpose(0, 2, 1)).all(axis=2)
+    return [(candidates[w],) for w in np.argmax(wins, axis=1)]
+
+
+def ranked_pairs_winner(d):
+    """
+    Return index of the ranked-pairs (Tideman) winner for the
+    pairwise-preference matrix d (a C x C array).
+
+    Pairs (i, j) with positive margin d[i, j] - d[j, i] are taken in order
+    of decreasing margin (ties by index order), and locked in unless
+    they would create a cycle with pairs already locked.
+    """
+
+    C = d.shape[0]
+    margin = d - d.T
+    pairs = [(i, j) for i in range(C) for j in range(C) if margin[i, j] > 0]
+    pairs.sort(key=lambda ij: -margin[ij])
+    reach = np.eye(C, dtype=bool)            # reach[i, j]: path from i to j
+    locked_in = np.zeros(C, dtype=bool)      # has a locked edge into it
+    for (i, j) in pairs:
+        if not reach[j, i]:
+            locked_in[j] = True
+            # everything reaching i now reaches everything j reaches
+            reach |= np.outer(reach[:, i], reach[j, :])
+    return int(np.argmin(locked_in))
+
+
+def ranked_pairs_batch(e, cid, votes, tallies, index=None):
+    """
+    Compute ranked-pairs outcomes for many tallies at once.
+
+    Pairwise matrices for all trials come from one tensor contraction;
+    the locking step is then done per trial, on the small C x C matrix.
+    """
+
+    if index is None:
+        index = pairwise_index(votes)
+    (candidates, W) = index
+    if len(candidates) == 0:
+        raise ValueError("No winner allowed in ranked-pairs contest {}.".format(cid))
+    d = pairwise_matrix(tallies, index)
+    return [(candidates[ranked_pairs_winner(dt)],) for dt in d]
+
+
+def schulze(e, cid, tally):
+    """
+    Return Schulze-method outcome (winner,) for input dict tally mapping
+    ranking patterns (votes) to counts.
+    """
+
+    votes = list(tally)
+    tallies = np.array([[tally[vote] for vote in votes]], dtype=float)
+    return schulze_batch(e, cid, votes, tallies)[0]
+
+
+def ranked_pairs(e, cid, tally):
+    """
+    Return ranked-pairs outcome (winner,) for input dict tally mapping
+    ranking patterns (votes) to counts.
+    """
+
+    votes = list(tally)
+    tallies = np.array([[tally[vote] for vote in votes]], dtype=float)
+    return ranked_pairs_batch(e, cid, votes, tallies)[0]
+
+
 def compute_ro_c(e):
     """ 
     Compute reported outcomes ro_c for each cid, from e.rn_cr. 
@@ -81,20 +428,123 @@ def compute_ro_c(e):
         e.ro_c[cid] = compute_outcome(e, cid, tally)
 
 
+##############################################################################
+# Registry of outcome rules (social choice functions)
+#
+# Each contest type registers a scalar function
+#     scalar(e, cid, tally) -> outcome
+# taking a dict tally mapping votes to counts, and optionally a batched
+# function
+#     batch(e, cid, votes, tallies, index) -> list of outcomes
+# taking a list of votes and an array tallies of shape (trials, len(votes)),
+# together with a precompute hook
+#     precompute(e, cid, votes) -> index
+# producing per-contest index structures for the batched function.
+# Rules for which the order of selids within a vote matters (rankings)
+# are registered with ranked=True; their votes are not put into
+# canonical (sorted) order when read.
+
+OUTCOME_RULES = {}
+# contest type (lowercase) -> dict with keys
+#     "scalar", "batch", "precompute", "ranked"
+
+
+def register_outcome_rule(contest_type, scalar,
+                          batch=None, precompute=None, ranked=False):
+    """
+    Register outcome rule for given contest type (e.g. "plurality").
+    """
+
+    OUTCOME_RULES[contest_type.lower()] = {"scalar": scalar,
+                                           "batch": batch,
+                                           "precompute": precompute,
+                                           "ranked": ranked}
+
+
+def outcome_rule(e, cid):
+    """
+    Return registered outcome rule (a dict) for contest cid.
+    """
+
+    contest_type = e.contest_type_c[cid].lower()
+    if contest_type not in OUTCOME_RULES:
+        raise NotImplementedError(("Outcome rule {} for contest {} "
+                                   "not yet implemented!")
+                                  .format(e.contest_type_c[cid], cid))
+    return OUTCOME_RULES[contest_type]
+
+
+def is_ranked(e, cid):
+    """
+    Return True if votes for contest cid are rankings.
+    """
+
+    contest_type = e.contest_type_c.get(cid, "").lower()
+    return contest_type in OUTCOME_RULES and OUTCOME_RULES[contest_type]["ranked"]
+
+
 def compute_outcome(e, cid, tally):
     """
     Return outcome for the given contest, given tally of votes.
     """
 
-    if e.contest_type_c[cid].lower()=="plurality":
-        return plurality(e, cid, tally)
-    elif e.contest_type_c[cid].lower()=="approval":
-        return approval(e, cid, tally)
-    else:
-        # TBD: IRV, etc...
-        raise NotImplementedError(("Non-plurality outcome rule {} for contest {}"
-                                   "not yet implemented!")
-                                   .format(e.contest_type_c[cid], cid))
+    return outcome_rule(e, cid)["scalar"](e, cid, tally)
+
+
+def outcome_index(e, cid, votes):
+    """
+    Return precomputed index structure for the batched outcome rule
+    of contest cid on the given list of votes.  
+    The result is cached in e.outcome_index_c, keyed by cid, 
+    as long as the list of votes is unchanged.
+    """
+
+    rule = outcome_rule(e, cid)
+    if rule["precompute"] is None:
+        return None
+    votes = tuple(votes)
+    if cid in e.outcome_index_c and e.outcome_index_c[cid][0] == votes:
+        return e.outcome_index_c[cid][1]
+    index = rule["precompute"](e, cid, votes)
+    e.outcome_index_c[cid] = (votes, index)
+    return index
+
+
+def compute_outcomes_batch(e, cid, votes, tallies):
+    """
+    Return list of outcomes for contest cid, one for each row of tallies
+    (an array of shape (trials, len(votes))).
+
+    Uses the batched rule for the contest type if one is registered,
+    and otherwise calls the scalar rule once per row.
+    """
+
+    rule = outcome_rule(e, cid)
+    if rule["batch"] is not None:
+        return rule["batch"](e, cid, votes, tallies,
+                             outcome_index(e, cid, votes))
+    votes = list(votes)
+    return [rule["scalar"](e, cid, dict(zip(votes, row)))
+            for row in tallies]
+
+
+register_outcome_rule("plurality", plurality,
+                      batch=plurality_batch,
+                      precompute=lambda e, cid, votes: \
+                          plurality_index(votes, number_of_winners(e, cid)))
+register_outcome_rule("approval", approval)
+register_outcome_rule("irv", irv,
+                      batch=irv_batch,
+                      precompute=lambda e, cid, votes: ranking_index(votes),
+                      ranked=True)
+register_outcome_rule("schulze", schulze,
+                      batch=schulze_batch,
+                      precompute=lambda e, cid, votes: pairwise_index(votes),
+                      ranked=True)
+register_outcome_rule("rankedpairs", ranked_pairs,
+                      batch=ranked_pairs_batch,
+                      precompute=lambda e, cid, votes: pairwise_index(votes),
+                      ranked=True)
 
 
 def compute_tally2(vec):
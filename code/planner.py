@@ -9,50 +9,44 @@ Specifically, to produce an "audit plan" for the next stage,
 given what has been done already, and the results obtained
 from the previous stage.
 """
-import copy
+import logging
+import numpy as np
 import random
+import time
 
+import audit
 import outcomes
-import risk_bayes
+import risk_bayes_2
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 ##############################################################################
 # Compute audit plan for next stage
 
-def update_correct(xs, pbcids_to_adjust, nonsample_sizes, num_winners, risk_limit):
+def update_correct(xs, nonsample_sizes, num_winners, risk_limit, coin):
     """
-    Update how much to extend the county's sampling by.
+    Update how much to extend each county's sampling by.
 
+    Here xs, nonsample_sizes, and coin are arrays indexed by pbcid position;
+    coin holds uniform random values from [0,1).
     With probability 1 - (1-alpha)^(num_winners), we decrease the sampling since all
     the winners are correct. If not, keep the same value.
     """
-    update = {}
-    for pbcid in xs:
-        if xs[pbcid] == 0:
-            update[pbcid] = xs[pbcid]
-        elif random.random() < 1-(1-risk_limit)**num_winners:
-            update[pbcid] = (xs[pbcid]-1)
-        else:
-            update[pbcid] = (xs[pbcid])
-    return update
 
-def update_incorrect(xs, pbcids_to_adjust, nonsample_sizes, num_winners, risk_limit):
+    return np.where((xs != 0) & (coin < 1-(1-risk_limit)**num_winners), xs-1, xs)
+
+def update_incorrect(xs, nonsample_sizes, num_winners, risk_limit, coin):
     """
-    Update how much to extend the county's sampling by.
+    Update how much to extend each county's sampling by.
 
+    Here xs, nonsample_sizes, and coin are arrays indexed by pbcid position;
+    coin holds uniform random values from [0,1).
     With probability (1-alpha)^(num_winners), we increase the sampling since not all
     the winners are correct. If not, keep the same value.
     """
 
-    update = {}
-    for pbcid in xs:
-        if xs[pbcid] == nonsample_sizes[pbcid]:
-            update[pbcid] = (xs[pbcid])
-        elif random.random() < (1-risk_limit)**num_winners:
-            update[pbcid] = (xs[pbcid]+1)
-        else:
-            update[pbcid] = (xs[pbcid])
-    return update
+    return np.where((xs != nonsample_sizes) & (coin < (1-risk_limit)**num_winners), xs+1, xs)
 
 def random_naive(pbcids):
     """
@@ -95,54 +89,37 @@ def random_min_var(pbcids, actual_votes, xs, nonsample_sizes):
             best_var = (var_after - var_before)
     return best_pbcid
 
-def get_noisy_guess(e, mid, pbcids, actual_votes, xs, nonsample_sizes, num_trials=100):
+def get_noisy_guess(e, mid, votes, actual_votes, xs, nonsample_sizes, num_trials=100, rs=None):
     """
     Use Dirichlet a certain number of times, to measure the probability that
     a winner that isn't the reported winner wins in the overall election.
-    """
-    winners = []
-    cid = e.cid_m[mid]
-    for _ in range(num_trials):
-        current_sample = copy.deepcopy(actual_votes)
-
-        for pbcid in actual_votes:
-            for av in current_sample[pbcid]:
-                if current_sample[pbcid][av] == 0:
-                    current_sample[pbcid][av] += 50 # pseudocount
-            dirichlet_dict = risk_bayes.dirichlet(current_sample[pbcid])
-            extended_sample = risk_bayes.multinomial(xs[pbcid], dirichlet_dict)
-            for av in current_sample[pbcid]:
-                current_sample[pbcid][av] += extended_sample[av]
-
-        for pbcid in actual_votes:
-            dirichlet_dict = risk_bayes.dirichlet(current_sample[pbcid])
-            extended_sample = risk_bayes.multinomial(nonsample_sizes[pbcid] - xs[pbcid], dirichlet_dict)
-            for av in current_sample[pbcid]:
-                current_sample[pbcid][av] += extended_sample[av]
-
-
-        merged_sample = {}
-        for pbcid in pbcids:
-            for av in current_sample[pbcid]:
-                if av not in merged_sample:
-                    merged_sample[av] = 0
-                merged_sample[av] += current_sample[pbcid][av]
-
-        if outcomes.compute_outcome(e, cid, merged_sample) == e.ro_c[cid]:
-            winners.append(1)
-    return abs(float(num_trials - len(winners)) / len(winners) - 0.05)
 
-def subtract_from_all(xs, num):
-    """
-    Helper function to subtract num from all values in x dictionary,
-    without modifying the x dictionary.
+    Here actual_votes is an array of shape (number of pbcids, len(votes))
+    and xs and nonsample_sizes are arrays indexed by pbcid position, as
+    returned by create_helper_arrays.  All num_trials simulations are
+    drawn at once, and their outcomes computed with the batched outcome
+    rule, if any.  Random numbers come from rs, a numpy.random.Generator;
+    calling this twice with generators seeded alike gives common random
+    numbers for the two guesses.
     """
-    new = copy.deepcopy(xs)
-    for k in new:
-        new[k] -= num
-    return new
 
-def discrete_rm(e, pbcids_to_adjust, init_x=0, num_trials=40, power=-2./3):
+    if rs is None:
+        rs = planner_generator()
+    cid = e.cid_m[mid]
+    xs = np.clip(xs, 0, nonsample_sizes)
+    current_sample = np.where(actual_votes == 0, 50, actual_votes)    # pseudocount
+    ps = risk_bayes_2.dirichlet_batch(current_sample, num_trials, rs)
+    current_sample = current_sample + risk_bayes_2.multinomial_batch(xs, ps, rs)
+    ps = risk_bayes_2.dirichlet_batch(current_sample, 1, rs)[0]
+    current_sample += risk_bayes_2.multinomial_batch(nonsample_sizes - xs, ps, rs)
+    merged_samples = current_sample.sum(axis=1)
+
+    sample_outcomes = outcomes.compute_outcomes_batch(e, cid, votes, merged_samples)
+    winners = sum(1 for outcome in sample_outcomes if outcome == e.ro_c[cid])
+    return abs(float(num_trials - winners) / max(winners, 1) - 0.05)
+
+def discrete_rm(e, pbcids_to_adjust, init_x=0, num_trials=40, power=-2./3,
+                guess_trials=100, rs=None, first_step=0, deadline=None):
     """
     Run discrete Robbins-Monro simulation on the loss function defined by
     the number of trials, where someone who isn't the reported winner wins.
@@ -154,119 +131,560 @@ def discrete_rm(e, pbcids_to_adjust, init_x=0, num_trials=40, power=-2./3):
     x_new = x_old - a_k (noisy_guess(x_old) - noisy_guess(x_old - 1))
     a_k must fulfill properties of RM step size - currently using
     (k+1)^power, where normally power is -1. In our case, we currently use -2/3.
+
+    The two noisy guesses of each step use common random numbers, so
+    their difference reflects the change in x rather than sampling noise.
+    Each mid is planned over the pbcids relevant to its contest, and
+    each pbcid gets the largest x needed by any mid.
+
+    For a warm start, init_x may be a dict mapping pbcids to starting x
+    values, and first_step gives the number of RM steps already taken
+    in earlier stages (so the step sizes keep decreasing).  If
+    deadline is given, no more RM steps are started once time.time()
+    passes it, and the x values reached so far are used.  The number of
+    RM steps taken and the last change in x are recorded in
+    e.planner_state.
     """
+
+    if rs is None:
+        rs = planner_generator()
+    pbcids = list(pbcids_to_adjust)
+    result = {pbcid: 0 for pbcid in pbcids}
+    steps = 0
+    changes = np.zeros(len(pbcids))
     for mid in e.cid_m:
         cid = e.cid_m[mid]
-        xs, actual_votes, nonsample_sizes = create_helper_dicts(e, mid, init_x, pbcids_to_adjust)
+        mid_pbcids = [pbcid for pbcid in pbcids
+                      if pbcid in e.possible_pbcid_c.get(cid, pbcids)]
+        if len(mid_pbcids) == 0:
+            continue
+        votes, actual_votes, nonsample_sizes = create_helper_arrays(e, mid, mid_pbcids)
+        xs = initial_xs(init_x, mid_pbcids, nonsample_sizes, 0)
 
         for k in range(num_trials):
-            finite_diff = (get_noisy_guess(e, mid, pbcids_to_adjust, actual_votes, xs, nonsample_sizes) - 
-                get_noisy_guess(
-                    e, mid, pbcids_to_adjust, actual_votes, subtract_from_all(xs, 1),
-                    subtract_from_all(nonsample_sizes, -1)))
-            step_size = (k+1)**power
-            xs = subtract_from_all(xs, step_size * finite_diff-1)
-            xs = {k:int(xs[k]) for k in xs}
-        for pbcid in pbcids_to_adjust:
-            if xs[pbcid] < 0:
-                xs[pbcid] = 0
-        return xs
-
-def create_helper_dicts(e, mid, init_x, pbcids_to_adjust):
-    """
-    Helper function to create dictionary of actual votes, initialize
-    x values and get nonsample sizes per pbcid.
-    """
-    actual_votes = {}
-    nonsample_sizes = {}
-    xs = {}
+            if deadline is not None and time.time() >= deadline:
+                break
+            seed = rs.integers(2**63)
+            finite_diff = (get_noisy_guess(e, mid, votes, actual_votes, xs, nonsample_sizes,
+                                           guess_trials, np.random.default_rng(seed)) -
+                           get_noisy_guess(e, mid, votes, actual_votes, xs - 1, nonsample_sizes + 1,
+                                           guess_trials, np.random.default_rng(seed)))
+            step_size = (first_step+k+1)**power
+            new_xs = (xs - (step_size * finite_diff - 1)).astype(int)
+            for (i, pbcid) in enumerate(mid_pbcids):
+                changes[pbcids.index(pbcid)] = abs(new_xs[i] - xs[i])
+            xs = new_xs
+            steps = max(steps, k+1)
+        for (i, pbcid) in enumerate(mid_pbcids):
+            result[pbcid] = max(result[pbcid], int(max(xs[i], 0)))
+    record_planner_diagnostics(e, pbcids, steps, changes)
+    return result
+
+def planner_generator():
+    """
+    Return numpy.random.Generator for planner simulations, seeded from 
+    audit.auditRandomState (so planning is reproducible from the audit seed).
+    """
+
+    return np.random.default_rng(audit.auditRandomState.randint(2**31, size=4))
+
+def create_helper_arrays(e, mid, pbcids_to_adjust):
+    """
+    Helper function to get the actual votes sampled so far and the
+    nonsample sizes for the given pbcids.
+
+    Returns (votes, actual_votes, nonsample_sizes) where votes is the
+    list of possible actual votes, actual_votes is an array of shape
+    (len(pbcids_to_adjust), len(votes)) giving the number of sampled
+    ballots so far for each pbcid and vote, and nonsample_sizes is an
+    array giving the number of unsampled ballots for each pbcid.
+    """
+
     cid = e.cid_m[mid]
+    votes = [vote for vote in sorted(e.votes_c[cid]) if vote != ('-noCVR',)]
+    vote_index = {vote: i for (i, vote) in enumerate(votes)}
+    actual_votes = np.zeros((len(pbcids_to_adjust), len(votes)))
+    nonsample_sizes = np.zeros(len(pbcids_to_adjust))
+    for k, pbcid in enumerate(pbcids_to_adjust):
+        sn_ra = e.sn_tcpra[e.stage_time][cid].get(pbcid, {})
+        for rv in sn_ra:
+            for av in sn_ra[rv]:
+                if av in vote_index:
+                    actual_votes[k, vote_index[av]] += sn_ra[rv][av]
+        nonsample_sizes[k] = e.rn_p[pbcid] - actual_votes[k].sum()
+    return votes, actual_votes, nonsample_sizes
+
+def initial_xs(init_x, pbcids, nonsample_sizes, default_x):
+    """
+    Return array of starting x values for the given pbcids.
 
-    # First, we create a dictionary of actual votes, where 
-    # actual_votes maps a county to a dictionary of possible candidates
-    # and actual_votes[county][candidate] gives the actual number of votes
-    # that we have sampled for the candidate so far.
-    for pbcid in pbcids_to_adjust:
-        for possible_candidate in e.votes_c[cid]:
-            if possible_candidate == ('-noCVR',):
+    init_x is either a number (used for every pbcid) or a dict mapping
+    pbcids to numbers, such as the x values planned at the previous stage
+    (pbcids not in the dict start at default_x).  Values are clipped to
+    lie between 0 and the pbcid's nonsample size.
+    """
+
+    if isinstance(init_x, dict):
+        xs = np.array([init_x.get(pbcid, default_x) for pbcid in pbcids])
+    else:
+        xs = np.full(len(pbcids), init_x)
+    return np.clip(xs, 0, nonsample_sizes).astype(int)
+
+def open_mids(e):
+    """
+    Return list of mids still open at e.stage_time (all mids, if no
+    statuses have been computed for this stage).
+    """
+
+    if e.stage_time not in e.status_tm:
+        return list(e.cid_m)
+    return [mid for mid in e.cid_m
+            if e.status_tm[e.stage_time].get(mid) == "Open"]
+
+def create_joint_arrays(e, cids, pbcids_to_adjust):
+    """
+    Helper function for planning several contests at once.
+
+    Sampled ballots are classified by their joint pattern of actual
+    votes (one per contest in cids, ("-NoSuchContest",) if absent).
+    To each observed pattern we add, for every contest and vote, a
+    synthetic pattern having that vote in that contest (so votes not
+    yet seen can still appear in simulated extensions).
+
+    Returns (projections, actual_votes, pseudocounts, nonsample_sizes)
+    where projections maps each cid to (votes, M), with M a 0/1 matrix
+    of shape (number of patterns, len(votes)) taking pattern tallies to
+    the contest's vote tallies; actual_votes has shape (number of pbcids,
+    number of patterns) and gives the sampled ballots so far;
+    pseudocounts (same shape) gives the pseudocount of 50 for each vote
+    not yet seen in a pbcid relevant to its contest; and nonsample_sizes
+    gives the number of unsampled ballots for each pbcid.
+    """
+
+    no_such = ("-NoSuchContest",)
+    pbcids = list(pbcids_to_adjust)
+    counts_p = []
+    for pbcid in pbcids:
+        counts = {}
+        sample_size = int(e.sn_tp[e.stage_time].get(pbcid, 0))
+        for bid in e.bids_p[pbcid][:sample_size]:
+            pattern = tuple(e.av_cpb.get(cid, {}).get(pbcid, {}).get(bid, no_such)
+                            for cid in cids)
+            counts[pattern] = counts.get(pattern, 0) + 1
+        counts_p.append(counts)
+
+    patterns = sorted(set(pattern for counts in counts_p for pattern in counts))
+    pattern_index = {pattern: j for (j, pattern) in enumerate(patterns)}
+    votes_c = {cid: [vote for vote in sorted(e.votes_c[cid]) if vote != ('-noCVR',)]
+               for cid in cids}
+    synthetic = {}
+    for (i, cid) in enumerate(cids):
+        for vote in votes_c[cid]:
+            pattern = tuple(vote if ii == i else no_such for ii in range(len(cids)))
+            if pattern not in pattern_index:
+                pattern_index[pattern] = len(patterns)
+                patterns.append(pattern)
+            synthetic[(cid, vote)] = pattern_index[pattern]
+
+    actual_votes = np.zeros((len(pbcids), len(patterns)))
+    for (k, counts) in enumerate(counts_p):
+        for pattern in counts:
+            actual_votes[k, pattern_index[pattern]] = counts[pattern]
+    nonsample_sizes = np.array([e.rn_p[pbcid] for pbcid in pbcids]) - actual_votes.sum(axis=1)
+
+    projections = {}
+    pseudocounts = np.zeros(actual_votes.shape)
+    for (i, cid) in enumerate(cids):
+        vote_index = {vote: v for (v, vote) in enumerate(votes_c[cid])}
+        M = np.zeros((len(patterns), len(votes_c[cid])))
+        for (j, pattern) in enumerate(patterns):
+            if pattern[i] in vote_index:
+                M[j, vote_index[pattern[i]]] = 1
+        projections[cid] = (votes_c[cid], M)
+        marginals = actual_votes @ M
+        for (k, pbcid) in enumerate(pbcids):
+            if pbcid not in e.possible_pbcid_c[cid]:
                 continue
-            for rv in e.sn_tcpra[e.stage_time][cid][pbcid]:
-                # create actual votes
-                if pbcid not in actual_votes:
-                    actual_votes[pbcid] = {}
-                if possible_candidate not in actual_votes[pbcid]:
-                    actual_votes[pbcid][possible_candidate] = 0
-                if possible_candidate in e.sn_tcpra[e.stage_time][cid][pbcid][rv]:
-                    actual_votes[pbcid][possible_candidate] += (e.sn_tcpra[
-                        e.stage_time][cid][pbcid][rv][possible_candidate])
-        # Initialize the x's for a county to be init_x and keep track of the 
-        # sample size and non-sample size for the county.
-        xs[pbcid] = init_x
-        stratum_size = e.rn_p[pbcid]
-        sample_size = sum([actual_votes[pbcid][k] for k in actual_votes[pbcid]])
-        nonsample_size = stratum_size - sample_size
-        nonsample_sizes[pbcid] = nonsample_size
-    return xs, actual_votes, nonsample_sizes
-
-def get_sample_size(e, pbcids_to_adjust, init_x=1, pick_pbcid_func=round_robin):
+            for (v, vote) in enumerate(votes_c[cid]):
+                if marginals[k, v] == 0:
+                    pseudocounts[k, synthetic[(cid, vote)]] += 50
+    return projections, actual_votes, pseudocounts, nonsample_sizes
+
+def simulate_extended_samples(actual_votes, xs, nonsample_sizes, picked, rs,
+                              pseudocounts=None):
+    """
+    Simulate one extended sample for each random-walk step in a batch.
+
+    Step b picks pbcid position picked[b].  As in the sequential walk, that
+    pbcid's sample (with a pseudocount of 50 for each vote not yet seen,
+    or with the given array of pseudocounts added)
+    is first extended by xs[picked[b]] ballots, and then every pbcid k is
+    extended by nonsample_sizes[k] - xs[k] more, each extension drawn from
+    the Dirichlet-multinomial distribution given the counts so far.
+
+    Returns array of shape (len(picked), number of votes) of merged tallies
+    (summed over pbcids).
+    """
+
+    B = len(picked)
+    steps = np.arange(B)
+    current = np.repeat(actual_votes[None, :, :], B, axis=0)
+    picked_rows = current[steps, picked]
+    if pseudocounts is None:
+        picked_rows[picked_rows == 0] += 50      # pseudocount
+    else:
+        picked_rows += pseudocounts[picked]
+    ps = risk_bayes_2.dirichlet_batch(picked_rows, 1, rs)[0]
+    current[steps, picked] = picked_rows + \
+        risk_bayes_2.multinomial_batch(xs[picked], ps, rs)
+
+    ps = risk_bayes_2.dirichlet_batch(current, 1, rs)[0]
+    rest = np.maximum(nonsample_sizes - xs, 0)
+    current += risk_bayes_2.multinomial_batch(np.broadcast_to(rest, (B, len(xs))), ps, rs)
+    return current.sum(axis=1)
+
+def pick_pbcids(pick_pbcid_func, pbcids, num, start, actual_votes, xs, nonsample_sizes):
+    """
+    Return (list of num pbcid positions picked by pick_pbcid_func, new start)
+    for a batch of random-walk steps; start is the round-robin position.
+    """
+
+    positions = {pbcid: k for (k, pbcid) in enumerate(pbcids)}
+    picked = []
+    for _ in range(num):
+        if pick_pbcid_func == random_min_var:
+            actual_votes_d = {pbcid: {i: actual_votes[k, i]
+                                      for i in range(actual_votes.shape[1])}
+                              for (k, pbcid) in enumerate(pbcids)}
+            xs_d = {pbcid: xs[k] for (k, pbcid) in enumerate(pbcids)}
+            nonsample_sizes_d = {pbcid: nonsample_sizes[k]
+                                 for (k, pbcid) in enumerate(pbcids)}
+            pbcid = pick_pbcid_func(pbcids, actual_votes_d, xs_d, nonsample_sizes_d)
+        elif pick_pbcid_func == round_robin:
+            pbcid = pick_pbcid_func(pbcids, start)
+            start = (start + 1) % len(pbcids)
+        else:
+            pbcid = pick_pbcid_func(pbcids)
+        picked.append(positions[pbcid])
+    return np.array(picked, dtype=int), start
+
+def get_sample_size(e, pbcids_to_adjust, init_x=1, pick_pbcid_func=round_robin,
+                    batch_size=8, rs=None, tolerance=None, window=100, deadline=None):
     """
     Get sample size, for a given county, given how many ballots have been sampled before, and the number left
     to audit, as well as the required risk limit.
+
+    All open measurements are planned together: each simulated extension
+    of the sample is drawn once, over joint vote patterns (see
+    create_joint_arrays), and counts as correct only if every open
+    contest's outcome on it equals the reported outcome.  The smallest
+    risk limit of the open measurements is used.
+
+    Each step's extended sample is drawn with array operations, and its
+    outcome computed once (with the batched outcome rule, if any).
+    Samples are drawn several steps at a time (at most batch_size, and
+    about twice as many as the x values have recently stayed fixed for),
+    all using the current x values; the updates are then applied step
+    by step, and the steps after the first one that changes the x values
+    are discarded (their samples would have been drawn with other x
+    values) and redrawn in the next batch.  So the walk is exactly the
+    sequential random walk, for any batch_size; batch_size only affects
+    speed.  A batch costs little more than a single step, but the x
+    values change every few steps near convergence, and at almost every
+    step before, so the gain is modest.
+
+    init_x may be a dict mapping pbcids to starting x values (e.g. those
+    of the previous stage), so that a warm-started walk need not
+    reconverge from scratch.  If tolerance is not None (compute_plan
+    sets it only for warm starts), the walk stops early once the mean
+    x of each pbcid over a window of window steps differs by at most
+    tolerance from its mean over the previous window.  The walk also
+    stops once time.time() passes deadline (if given).  Either way, the
+    x values reached so far are returned.  The number of steps taken and the last
+    change (overall and per pbcid) are recorded in e.planner_state.
+
+    Random numbers come from rs, a numpy.random.Generator; by default,
+    one seeded from audit.auditRandomState (Generator draws are
+    considerably faster than RandomState ones).
     """
-    default_start_pbcid = 0
-    start = None
+
+    if rs is None:
+        rs = planner_generator()
+    pbcids = list(pbcids_to_adjust)
+    mids = open_mids(e)
+    if len(mids) == 0:
+        return {pbcid: 0 for pbcid in pbcids}
+    cids = sorted(set(e.cid_m[mid] for mid in mids))
+    risk_limit = min(e.risk_limit_m[mid] for mid in mids)
+    start = 0
     num_winners = e.num_winners
     max_num_it = e.max_num_it
-    for mid in e.cid_m:
-        cid = e.cid_m[mid]
 
-        xs, actual_votes, nonsample_sizes = create_helper_dicts(e, mid, init_x, pbcids_to_adjust)
-
-        # For max_num_it iterations, we first choose a county, then, we extend the county
-        # by x. Then, given this extended sample, we use it to extend the entire contest to
-        # n votes. We calculate the winner of the extended contest - if all the winners are
-        # correct, then we update the x for that pbcid, by possibly decreasing it. If not,
-        # with some probability, we increase x for that county.
-        for i in range(max_num_it):
-            current_sample = copy.deepcopy(actual_votes) # pbcid -> av -> count
-            if pick_pbcid_func == random_min_var:
-                pbcid = pick_pbcid_func(pbcids_to_adjust, actual_votes, xs, nonsample_sizes)
-            elif pick_pbcid_func == round_robin:
-                if start is None:
-                    start = default_start_pbcid
-                pbcid = pick_pbcid_func(pbcids_to_adjust, start)
-                start += 1
-                start = (start % len(pbcids_to_adjust))
+    projections, actual_votes, pseudocounts, nonsample_sizes = \
+        create_joint_arrays(e, cids, pbcids)
+    xs = initial_xs(init_x, pbcids, nonsample_sizes, 1)
+    old_means = None
+    changes = np.zeros(len(pbcids))
+    window_sum_xs = np.zeros(len(pbcids))
+    window_steps = 0
+    converged = False
+    run_length = 1.0        # running mean of steps between changes of x values
+
+    # For max_num_it iterations, we first choose a county, then, we extend the county
+    # by x. Then, given this extended sample, we use it to extend the entire contest to
+    # n votes. We calculate the winner of the extended contest - if all the winners are
+    # correct, then we update the x for that pbcid, by possibly decreasing it. If not,
+    # with some probability, we increase x for that county.
+    i = 0
+    while i < max_num_it and not converged:
+        # speculate about twice as many steps as x values usually stay fixed for
+        num = min(batch_size, max_num_it - i, int(2 * run_length) + 1)
+        first_step = i
+        picked, _ = pick_pbcids(pick_pbcid_func, pbcids, num, start,
+                                actual_votes, xs, nonsample_sizes)
+        merged_samples = simulate_extended_samples(actual_votes, xs, nonsample_sizes,
+                                                   picked, rs, pseudocounts)
+        all_correct = np.ones(num, dtype=bool)
+        for cid in cids:
+            votes, M = projections[cid]
+            sample_outcomes = outcomes.compute_outcomes_batch(e, cid, votes,
+                                                              merged_samples @ M)
+            all_correct &= [outcome == e.ro_c[cid] for outcome in sample_outcomes]
+        coins = rs.random((num, len(pbcids)))
+        for correct, coin in zip(all_correct, coins):
+            old_xs = xs
+            if correct:
+                xs = update_correct(xs, nonsample_sizes, num_winners, risk_limit, coin)
             else:
-                pbcid = pick_pbcid_func(pbcids_to_adjust)
-            for av in current_sample[pbcid]:
-                if current_sample[pbcid][av] == 0:
-                    current_sample[pbcid][av] += 50 # pseudocount
-            dirichlet_dict = risk_bayes.dirichlet(current_sample[pbcid])
-            extended_sample = risk_bayes.multinomial(xs[pbcid], dirichlet_dict)
-            for av in current_sample[pbcid]:
-                current_sample[pbcid][av] += extended_sample[av]
-
-            for k, pbcid in enumerate(pbcids_to_adjust):
-                dirichlet_dict = risk_bayes.dirichlet(current_sample[pbcid])
-                extended_sample = risk_bayes.multinomial(nonsample_sizes[pbcid] - xs[pbcid], dirichlet_dict)
-                for av in current_sample[pbcid]:
-                    current_sample[pbcid][av] += extended_sample[av]
-
-            merged_sample = {}
-            for pbcid in pbcids_to_adjust:
-                for av in current_sample[pbcid]:
-                    if av not in merged_sample:
-                        merged_sample[av] = 0
-                    merged_sample[av] += current_sample[pbcid][av]
-
-            winners = []
-            for k in range(num_winners):
-                winners.append(outcomes.compute_outcome(e, cid, merged_sample))
-            if len(set(winners)) == 1 and winners[0] == e.ro_c[cid]:
-                xs = update_correct(xs, [pbcid], nonsample_sizes, num_winners, e.risk_limit_m[mid])
-            else:
-                xs = update_incorrect(xs, [pbcid], nonsample_sizes, num_winners, e.risk_limit_m[mid])
+                xs = update_incorrect(xs, nonsample_sizes, num_winners, risk_limit, coin)
+            i += 1
+            start = (start + 1) % len(pbcids)
+            window_sum_xs += xs
+            window_steps += 1
+            if window_steps == window:
+                means = window_sum_xs / window
+                if old_means is not None:
+                    changes = np.abs(means - old_means)
+                    if tolerance is not None and np.all(changes <= tolerance):
+                        converged = True
+                        break
+                old_means = means
+                window_sum_xs = np.zeros(len(pbcids))
+                window_steps = 0
+            if not np.array_equal(xs, old_xs):
+                break       # rest of batch was drawn with the old x values
+        run_length = 0.9 * run_length + 0.1 * (i - first_step)
+        if deadline is not None and time.time() >= deadline:
+            break
+    record_planner_diagnostics(e, pbcids, i, changes)
+    return {pbcid: int(xs[k]) for (k, pbcid) in enumerate(pbcids)}
+
+def record_planner_diagnostics(e, pbcids, iterations, changes):
+    """
+    Record convergence diagnostics of a planning pass in e.planner_state:
+    the number of iterations done, and the last change in x (overall,
+    and for each pbcid in pbcids, given by array changes).
+    """
+
+    e.planner_state["iterations"] = int(iterations)
+    e.planner_state["last_change"] = float(np.max(changes, initial=0.0))
+    e.planner_state["last_change_p"] = {pbcid: float(changes[k])
+                                        for (k, pbcid) in enumerate(pbcids)}
+
+def planning_tree(e, cid):
+    """
+    Return count tree for contest cid (as from risk_bayes_2.make_tree),
+    but with a stratum for every (pbcid, rv) with reported ballots,
+    sampled or not, so that the unsampled ballots of every pbcid are
+    in the tree.
+    """
+
+    sn_cpra = {}
+    for pbcid in e.possible_pbcid_c[cid]:
+        sn_cpra[pbcid] = dict(e.sn_tcpra[e.stage_time][cid].get(pbcid, {}))
+        for rv in e.rn_cpr[cid][pbcid]:
+            if e.rn_cpr[cid][pbcid][rv] > 0:
+                sn_cpra[pbcid].setdefault(rv, {})
+    return risk_bayes_2.make_tree(e, cid, {e.stage_time: {cid: sn_cpra}})
+
+def projected_risks(e, mids, trees, sn_cp, tweak_p, trials, seed):
+    """
+    Return dict mapping each mid in mids to its projected risk, if the
+    sample in each pbcid were increased by tweak_p[pbcid] ballots.
+
+    As in risk_bayes.compute_risk_with_tweak, the sample tallies of each
+    sampled pbcid are scaled up in proportion.  A pbcid with no sample
+    yet has nothing to scale, so its projected sample is drawn from the
+    prior instead: each stratum gets its share (by reported count) of
+    the tweak_p[pbcid] ballots, split among actual votes in proportion
+    to the stratum's prior pseudocounts.  Here trees maps cids to count
+    trees (from planning_tree) and sn_cp gives current sample sizes.
+    The posterior draws come from a generator seeded with seed, so calls
+    with the same seed use common random numbers and differences between
+    their risks reflect the tweaks, not sampling noise.
+    """
+
+    risk_m = {}
+    for mid in mids:
+        cid = e.cid_m[mid]
+        T = trees[cid]
+        countA = np.array(T.countA, dtype=float)
+        for (s, stratum) in enumerate(T.strata):
+            pbcid = stratum[0]
+            tweak = tweak_p.get(pbcid, 0)
+            if sn_cp[cid][pbcid] > 0:
+                countA[s] *= 1 + tweak / sn_cp[cid][pbcid]
+            elif tweak > 0 and T.countP[s].sum() > 0:
+                share = T.countR[s].sum() / max(e.rn_p[pbcid], 1)
+                countA[s] = tweak * share * T.countP[s] / T.countP[s].sum()
+        nonsample_sizes = np.maximum(T.countR.sum(axis=1) - countA.sum(axis=1), 0)
+        rs = np.random.default_rng(seed)
+        ps = risk_bayes_2.dirichlet_batch(countA + T.countP, trials, rs)
+        draws = risk_bayes_2.multinomial_batch(nonsample_sizes, ps, rs) + countA
+        tallies = draws.sum(axis=1)
+        test_outcomes = outcomes.compute_outcomes_batch(e, cid, T.vs, tallies)
+        wrong = sum([1 for outcome in test_outcomes if outcome != e.ro_c[cid]])
+        risk_m[mid] = wrong / trials
+    return risk_m
+
+def greedy_plan(e, pbcids_to_adjust, budget=None, chunk_size=None, trials=1000, rs=None,
+                deadline=None):
+    """
+    Return dict mapping pbcids to sample size increments, allocated
+    greedily by marginal reduction in projected risk.
+
+    Ballots are allocated in chunks of chunk_size (default: about a
+    quarter of the average per-pbcid cap).  At each step the chunk goes
+    to the pbcid whose increment most reduces the total projected risk
+    of the open measurements (see projected_risks), per ballot added.
+    Increments stay within the per-pbcid caps e.max_audit_rate_p[pbcid]
+    (and the number of unsampled ballots), and their total within
+    budget (default: no limit beyond the caps).  Allocation stops when
+    every open measurement's projected risk is within its risk limit,
+    when no chunk reduces risk, or once time.time() passes deadline (if
+    given).
+
+    If nothing is allocated, the increments are zero when there is
+    nothing to gain (no open measurement, or all projected risks already
+    within limits); but if some projected risk is over its limit and
+    only no chunk reduced it (as can happen when the simulated gains are
+    noisy), one chunk goes to the pbcid whose chunk did best, so the
+    audit still makes progress.  The reason is logged.  The number of
+    chunks allocated and the last chunk's size are recorded in
+    e.planner_state.
+    """
+
+    if rs is None:
+        rs = planner_generator()
+    pbcids = sorted(pbcids_to_adjust)
+    mids = open_mids(e)
+    if len(mids) == 0 or len(pbcids) == 0:
+        logger.info("Greedy planner: no open measurements; no ballots planned.")
+        return {pbcid: 0 for pbcid in pbcids}
+
+    trees = {}
+    sn_cp = {}
+    for mid in mids:
+        cid = e.cid_m[mid]
+        if cid not in trees:
+            trees[cid] = planning_tree(e, cid)
+            sn_cp[cid] = {pbcid: sum(sum(e.sn_tcpra[e.stage_time][cid][pbcid][rv].values())
+                                     for rv in e.sn_tcpra[e.stage_time][cid][pbcid])
+                          for pbcid in e.possible_pbcid_c[cid]}
+    caps = {pbcid: int(max(0, min(e.max_audit_rate_p[pbcid],
+                                  e.rn_p[pbcid] - e.sn_tp[e.stage_time][pbcid])))
+            for pbcid in pbcids}
+    if budget is None:
+        budget = sum(caps.values())
+    if chunk_size is None:
+        chunk_size = max(1, sum(caps.values()) // (4 * len(pbcids)))
+
+    seed = rs.integers(2**63)
+    tweak_p = {pbcid: 0 for pbcid in pbcids}
+    risk_m = projected_risks(e, mids, trees, sn_cp, tweak_p, trials, seed)
+    spent = 0
+    chunks = 0
+    changes = np.zeros(len(pbcids))
+    best = None
+    while spent < budget and \
+          any(risk_m[mid] > e.risk_limit_m[mid] for mid in mids) and \
+          (deadline is None or time.time() < deadline):
+        best = None
+        for pbcid in pbcids:
+            step = min(chunk_size, caps[pbcid] - tweak_p[pbcid], budget - spent)
+            if step <= 0:
+                continue
+            new_tweak_p = dict(tweak_p)
+            new_tweak_p[pbcid] += step
+            new_risk_m = projected_risks(e, mids, trees, sn_cp, new_tweak_p, trials, seed)
+            gain = (sum(risk_m.values()) - sum(new_risk_m.values())) / step
+            if best is None or gain > best[0]:
+                best = (gain, pbcid, step, new_risk_m)
+        if best is None or best[0] <= 0:
+            break
+        (gain, pbcid, step, risk_m) = best
+        tweak_p[pbcid] += step
+        spent += step
+        chunks += 1
+        changes = np.zeros(len(pbcids))
+        changes[pbcids.index(pbcid)] = step
+
+    if spent == 0:
+        if all(risk_m[mid] <= e.risk_limit_m[mid] for mid in mids):
+            logger.info("Greedy planner: projected risks already within limits; "
+                        "no ballots planned.")
+        elif best is not None:
+            (gain, pbcid, step, new_risk_m) = best
+            logger.info("Greedy planner: no chunk reduces projected risk (noisy "
+                        "simulated gains?); planning one chunk of %d ballots for %s.",
+                        step, pbcid)
+            tweak_p[pbcid] += step
+            chunks = 1
+            changes[pbcids.index(pbcid)] = step
+        else:
+            logger.info("Greedy planner: no ballots planned (no capacity, budget, "
+                        "or time left).")
+    record_planner_diagnostics(e, pbcids, chunks, changes)
+    return tweak_p
+
+def compute_plan_increments(e, pbcids_to_adjust):
+    """
+    Return dict mapping each pbcid in pbcids_to_adjust to the number of
+    additional ballots to sample there in the next stage.
+
+    The planner (if any) is run once, for all pbcids together.  The x
+    values it plans are kept in e.planner_state (which is saved in the
+    saved-state), and the random-walk planners are warm started from
+    those of the previous stage.  If
+    e.plan_time_budget is set, the planner returns the best plan found
+    within that many seconds.
+    """
+
+    pbcids = sorted(pbcids_to_adjust)
+    x_p = e.planner_state.get("x_p", {})
+    deadline = None
+    if e.plan_time_budget is not None:
+        deadline = time.time() + e.plan_time_budget
+    # If no planner flag is set, then we keep the sample size the same, for
+    # each county, throughout the audit.
+    if e.sample_by_size:
+        pick_pbcid_func = eval(e.pick_county_func)
+        # stop early on convergence only when warm started; a cold start
+        # runs the full walk, as it always has
+        tolerance = 1 if len(x_p) > 0 else None
+        xs = get_sample_size(e, pbcids, init_x=x_p, pick_pbcid_func=pick_pbcid_func,
+                             tolerance=tolerance, deadline=deadline)
+    elif e.use_greedy_planner:
+        xs = greedy_plan(e, pbcids, budget=e.stage_budget, deadline=deadline)
+    elif e.use_discrete_rm:
+        rm_k = e.planner_state.get("rm_k", 0)
+        xs = discrete_rm(e, pbcids, init_x=x_p, first_step=rm_k, deadline=deadline)
+        e.planner_state["rm_k"] = rm_k + e.planner_state["iterations"]
+    else:
+        return {pbcid: e.max_audit_rate_p[pbcid] for pbcid in pbcids}
+    x_p = dict(x_p)
+    x_p.update(xs)
+    e.planner_state["x_p"] = x_p
     return xs
 
 def compute_plan(e):
@@ -287,32 +705,13 @@ def compute_plan(e):
         for pbcid in e.possible_pbcid_c[cid]:
             if e.status_tm[e.stage_time][mid] == "Open":
                 pbcids_to_adjust.add(pbcid)
-    for i, pbcid in enumerate(pbcids_to_adjust):
+    increments = compute_plan_increments(e, pbcids_to_adjust)
+    for pbcid in pbcids_to_adjust:
         # if contest still being audited do as much as you can without
         # exceeding size of paper ballot collection
         # CHECK: is e.rn_p[pbcid] right number to use here?
-
-        # If this flag is not true, then we keep the sample size the same, for
-        # each county, throughout the audit.
-        if e.sample_by_size:
-            pick_pbcid_func = eval(e.pick_county_func)
-            sample_size = get_sample_size(e, list(pbcids_to_adjust),
-                                          pick_pbcid_func=pick_pbcid_func)
-            e.plan_tp[e.stage_time][pbcid] = \
-                min(
-                    e.sn_tp[e.stage_time][pbcid] + sample_size[pbcid],
-                    e.rn_p[pbcid])
-        elif e.use_discrete_rm:
-            sample_size = discrete_rm(e, list(pbcids_to_adjust))
-            e.plan_tp[e.stage_time][pbcid] = \
-                min(
-                    e.sn_tp[e.stage_time][pbcid] + sample_size[pbcid],
-                    e.rn_p[pbcid])
-        else:
-            e.plan_tp[e.stage_time][pbcid] = \
-                min(
-                    e.sn_tp[e.stage_time][pbcid] + e.max_audit_rate_p[pbcid],
-                    e.rn_p[pbcid])
+        e.plan_tp[e.stage_time][pbcid] = \
+            min(
+                e.sn_tp[e.stage_time][pbcid] + increments[pbcid],
+                e.rn_p[pbcid])
     return
-
-
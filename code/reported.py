@@ -38,8 +38,12 @@ import os
 import warnings
 
 import OpenAuditTool
+import column_cache
 import csv_readers
 import ids
+import ingest
+import outcomes
+import reported_cache
 import utils
 
 logging.basicConfig(level=logging.INFO)
@@ -51,10 +55,44 @@ logger = logging.getLogger(__name__)
 ##############################################################################
 
 
-def read_reported(e):
+def read_reported(e, aggregates_only=False):
+    """
+    Read and check reported data (ballot manifests, CVRs, and outcomes),
+    and compute the reported totals from them.
+
+    If e.reported_cache is True and the election spec and reported data
+    are unchanged since they were last read, the totals (and e.votes_c,
+    e.selids_c, and e.ro_c) are instead taken from the cache (see
+    reported_cache.py), without being checked again; and if aggregates_only
+    is True (the caller needs no per-ballot data, such as e.rv_cpb), the
+    reported files are not read at all.  Otherwise e.reported_cache also
+    turns on e.column_cache, so the per-ballot data (e.bids_p, e.boxid_pb,
+    e.rv_cpb, ...) of unchanged files come from the column cache (see
+    column_cache.py) rather than being parsed again.
+    """
 
-    read_reported_ballot_manifests(e)
-    read_reported_cvrs(e)
+    if e.reported_cache:
+        key = reported_cache.inputs_key(e)
+        if aggregates_only and reported_cache.read_cache(e, key):
+            logger.info("Using cached reported aggregates.")
+            show_reported(e)
+            return
+        e.column_cache = True
+
+    if e.async_ingest or e.ingest_processes != None:
+        ingest.read_collections(e,
+                                [(parse_reported_ballot_manifest,
+                                  merge_reported_ballot_manifest),
+                                 (parse_reported_cvrs,
+                                  merge_reported_cvrs)],
+                                processes=e.ingest_processes)
+    else:
+        read_reported_ballot_manifests(e)
+        read_reported_cvrs(e)
+    if e.reported_cache and reported_cache.read_cache(e, key):
+        logger.info("Using cached reported aggregates.")
+        show_reported(e)
+        return
     read_reported_outcomes(e)
     
     finish_reported(e)
@@ -62,6 +100,8 @@ def read_reported(e):
         check_reported(e)
         if len(w) > 0:
             raise RuntimeError("Too many errors; terminating.")
+    if e.reported_cache:
+        reported_cache.write_cache(e, key)
     show_reported(e)
 
 
@@ -70,6 +110,23 @@ def read_reported_ballot_manifests(e):
     Read ballot manifest file 21-reported-ballot-manifests and expand rows if needed.
     """
 
+    for pbcid in e.pbcids:
+        merge_reported_ballot_manifest(e, pbcid,
+                                       parse_reported_ballot_manifest(e, pbcid, stream=True))
+
+
+def parse_reported_ballot_manifest(e, pbcid, stream=False):
+    """
+    Return columns (list of lists of values, one list per field, in the
+    order of fieldnames below) of ballot manifest file for pbcid
+    (21-reported-ballot-manifests/manifest-PBCID.csv).
+    If stream is True, return instead an iterator over its rows (tuples
+    of values in the same order), read lazily.
+    If e.column_cache is True, the columns come from the cache if it is
+    up to date (see column_cache.py).
+    Does not change e.
+    """
+
     election_pathname = os.path.join(OpenAuditTool.ELECTIONS_ROOT, e.election_dirname)
     specification_pathname = os.path.join(election_pathname,
                                           "2-reported",
@@ -77,72 +134,115 @@ def read_reported_ballot_manifests(e):
     fieldnames = ["Collection", "Box", "Position", "Stamp", 
                   "Ballot id", "Number of ballots",
                   "Required Contests", "Possible Contests", "Comments"]
-    for pbcid in e.pbcids:
-        safe_pbcid = ids.filename_safe(pbcid)
-        filename = utils.greatest_name(specification_pathname,
-                                       "manifest-" + safe_pbcid,
-                                       ".csv")
-        file_pathname = os.path.join(specification_pathname, filename)
-        rows = csv_readers.read_csv_file(file_pathname, fieldnames, varlen=False)
-        for row in rows:
-            pbcid = row["Collection"]
-            boxid = row["Box"]
-            position = row["Position"]
-            stamp = row["Stamp"]
-            bid = row["Ballot id"]
-            try:
-                num = int(row["Number of ballots"])
-            except ValueError as e:
-                raise ValueError("Number {} of ballots not an integer.".format(num)) from e
-            if num<=0:
-                warnings.warn("Number {} of ballots not positive.".format(num))
-            req = row["Required Contests"]
-            poss = row["Possible Contests"]
-            comments = row["Comments"]
-
-            bids = utils.count_on(bid, num)
-            stamps = utils.count_on(stamp, num)
-            # positions = utils.count_on(position, num)
-
-            for i in range(num):
-                # utils.nested_set(e.bids_p, [pbcid, bids[i]], True)
-                if pbcid not in e.bids_p:
-                    e.bids_p[pbcid] = []
-                e.bids_p[pbcid].append(bids[i])
-                utils.nested_set(e.boxid_pb, [pbcid, bids[i]], boxid)
-                utils.nested_set(e.position_pb, [pbcid, bids[i]], position[i])
-                utils.nested_set(e.stamp_pb, [pbcid, bids[i]], stamps[i])
-                utils.nested_set(e.required_gid_pb, [pbcid, bids[i]], req)
-                utils.nested_set(e.possible_gid_pb, [pbcid, bids[i]], poss)
-                utils.nested_set(e.comments_pb, [pbcid, bids[i]], comments)
-                          
+    safe_pbcid = ids.filename_safe(pbcid)
+    filename = utils.greatest_name(specification_pathname,
+                                   "manifest-" + safe_pbcid,
+                                   ".csv")
+    file_pathname = os.path.join(specification_pathname, filename)
+    if e.column_cache:
+        result = column_cache.read_csv_columns(e, file_pathname, fieldnames, False,
+                                               fieldnames, e.ingest_processes)
+        return zip(*result) if stream else result
+    if stream:
+        return csv_readers.iter_csv_file(file_pathname, fieldnames, varlen=False,
+                                         columns=fieldnames)
+    columns = csv_readers.read_csv_columns(file_pathname, fieldnames, varlen=False,
+                                           processes=e.ingest_processes,
+                                           columns=fieldnames)
+    return [columns[fieldname] for fieldname in fieldnames]
+
+
+def merge_reported_ballot_manifest(e, pbcid, rows):
+    """
+    Merge ballot manifest rows for pbcid into e, expanding rows if needed.
+    Each row is a tuple of values in the field order of
+    parse_reported_ballot_manifest.
+    """
+
+    for row in rows:
+        (pbcid, boxid, position, stamp, bid, num, req, poss, comments) = row
+        try:
+            num = int(num)
+        except ValueError as e:
+            raise ValueError("Number {} of ballots not an integer.".format(num)) from e
+        if num<=0:
+            warnings.warn("Number {} of ballots not positive.".format(num))
+
+        bids = utils.count_on(bid, num)
+        stamps = utils.count_on(stamp, num)
+        # positions = utils.count_on(position, num)
+
+        for i in range(num):
+            # utils.nested_set(e.bids_p, [pbcid, bids[i]], True)
+            if pbcid not in e.bids_p:
+                e.bids_p[pbcid] = []
+            e.bids_p[pbcid].append(bids[i])
+            utils.nested_set(e.boxid_pb, [pbcid, bids[i]], boxid)
+            utils.nested_set(e.position_pb, [pbcid, bids[i]], position[i])
+            utils.nested_set(e.stamp_pb, [pbcid, bids[i]], stamps[i])
+            utils.nested_set(e.required_gid_pb, [pbcid, bids[i]], req)
+            utils.nested_set(e.possible_gid_pb, [pbcid, bids[i]], poss)
+            utils.nested_set(e.comments_pb, [pbcid, bids[i]], comments)
+                      
 
 def read_reported_cvrs(e):
     """
     Read reported votes 22-reported-cvrs/reported-cvrs-PBCID.csv.
     """
 
+    for pbcid in e.pbcids:
+        merge_reported_cvrs(e, pbcid, parse_reported_cvrs(e, pbcid, stream=True))
+
+
+def parse_reported_cvrs(e, pbcid, stream=False):
+    """
+    Return columns (list of lists of values, one list per field, in the
+    order of columns below) of reported votes file for pbcid
+    (22-reported-cvrs/reported-cvrs-PBCID.csv).
+    The Scanner field is checked for but not returned.
+    If stream is True, return instead an iterator over its rows (tuples
+    of values in the same order), read lazily.
+    If e.column_cache is True, the columns come from the cache if it is
+    up to date (see column_cache.py).
+    Does not change e.
+    """
+
     election_pathname = os.path.join(OpenAuditTool.ELECTIONS_ROOT, e.election_dirname)
     specification_pathname = os.path.join(election_pathname,
                                           "2-reported","22-reported-cvrs")
     fieldnames = ["Collection", "Scanner", "Ballot id",
                   "Contest", "Selections"]
-    for pbcid in e.pbcids:
-        safe_pbcid = ids.filename_safe(pbcid)
-        filename = utils.greatest_name(specification_pathname,
-                                       "reported-cvrs-" + safe_pbcid,
-                                       ".csv")
-        file_pathname = os.path.join(specification_pathname, filename)
-        rows = csv_readers.read_csv_file(file_pathname, fieldnames, varlen=True)
-        for row in rows:
-            pbcid = row["Collection"]
-            # scanner = row["Scanner"]
-            bid = row["Ballot id"]
-            cid = row["Contest"]
-            vote = row["Selections"]
-            vote = tuple(sorted(vote))     # put vote selids into canonical order
-            utils.nested_set(e.rv_cpb, [cid, pbcid, bid], vote)
-            utils.nested_set(e.votes_c, [cid, vote], True)
+    columns = ["Collection", "Ballot id", "Contest", "Selections"]
+    safe_pbcid = ids.filename_safe(pbcid)
+    filename = utils.greatest_name(specification_pathname,
+                                   "reported-cvrs-" + safe_pbcid,
+                                   ".csv")
+    file_pathname = os.path.join(specification_pathname, filename)
+    if e.column_cache:
+        result = column_cache.read_csv_columns(e, file_pathname, fieldnames, True,
+                                               columns, e.ingest_processes)
+        return zip(*result) if stream else result
+    if stream:
+        return csv_readers.iter_csv_file(file_pathname, fieldnames, varlen=True,
+                                         columns=columns)
+    result = csv_readers.read_csv_columns(file_pathname, fieldnames, varlen=True,
+                                          processes=e.ingest_processes,
+                                          columns=columns)
+    return [result[column] for column in columns]
+
+
+def merge_reported_cvrs(e, pbcid, rows):
+    """
+    Merge reported votes rows for pbcid into e.rv_cpb and e.votes_c.
+    Each row is a tuple of values in the field order of parse_reported_cvrs.
+    """
+
+    for row in rows:
+        (pbcid, bid, cid, vote) = row
+        if not outcomes.is_ranked(e, cid):
+            vote = tuple(sorted(vote)) # put vote selids into canonical order
+        utils.nested_set(e.rv_cpb, [cid, pbcid, bid], vote)
+        utils.nested_set(e.votes_c, [cid, vote], True)
 
 
 def read_reported_outcomes(e):
@@ -159,6 +259,8 @@ def read_reported_outcomes(e):
     for row in rows:
         cid = row["Contest"]
         winners = row["Winner(s)"]
+        if outcomes.number_of_winners(e, cid) > 1:
+            winners = tuple(sorted(winners)) # multi-winner outcomes are sorted
         utils.nested_set(e.ro_c, [cid], winners)
 
 
@@ -0,0 +1,158 @@
+# reported_cache.py
+# Ronald L. Rivest
+# October 19, 2026
+# python3
+
+"""
+Cache of the aggregates derived from reported data, for OpenAuditTool.py.
+
+reported.read_reported reads every ballot manifest and CVR, then
+derives the reported totals (e.rn_cpr, e.rn_c, e.rn_cr, e.rn_p), the
+vote and selection tables (e.votes_c, e.selids_c), and reads the
+reported outcomes (e.ro_c), and checks them all.  None of these change
+unless some file under 1-election-spec or 2-reported changes.
+
+So (when e.reported_cache is True; command-line option --reported_cache)
+they are saved, once checked, in ELECTION/.cache/reported-aggregates.json,
+together with a key: the SHA256 hash of the snapshot (see
+snapshot.compute_dir_hash) of those two directories.  When the key
+still matches, read_reported loads them from there instead of deriving
+and checking them again, and a caller that needs only the aggregates
+(not the per-ballot e.bids_p, e.rv_cpb, ...) skips reading the
+reported files altogether.  Other callers still need the per-ballot
+data; for those, read_reported also turns on the column cache (see
+column_cache.py), so unchanged files are not parsed again either.
+
+Votes (tuples) are not valid json keys, so each table is saved as a
+list of [key, ..., key, value] entries, with votes as lists.
+
+The cache is only an optimization: it may be deleted at any time.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import OpenAuditTool
+import snapshot
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+CACHE_VERSION = 1
+# increase whenever the cache file layout (or the derivation it records) changes
+
+INPUT_DIRNAMES = ["1-election-spec", "2-reported"]
+
+# tables cached, each with its key depth and which of its keys (by
+# position) are votes
+TABLES = {"votes_c": (2, [1]),
+          "selids_c": (2, []),
+          "rn_cpr": (3, [2]),
+          "rn_c": (1, []),
+          "rn_cr": (2, [1]),
+          "rn_p": (1, []),
+          "ro_c": (1, [])}
+
+
+def cache_filename(e):
+    """ Return pathname of the reported-aggregates cache file of e. """
+
+    return os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                        e.election_dirname,
+                        ".cache",
+                        "reported-aggregates.json")
+
+
+def inputs_key(e):
+    """
+    Return SHA256 hash (hex) of the snapshot of e's election spec and
+    reported data directories (with filenames relative to the election
+    directory, so the key does not depend on where the election is).
+    """
+
+    election_pathname = os.path.join(OpenAuditTool.ELECTIONS_ROOT, e.election_dirname)
+    hashes = {}
+    for dirname in INPUT_DIRNAMES:
+        dir_hash = snapshot.compute_dir_hash(os.path.join(election_pathname, dirname))
+        for filename in dir_hash:
+            relpath = os.path.relpath(filename, election_pathname)
+            hashes[relpath.replace(os.sep, "/")] = dir_hash[filename]
+    text = json.dumps({"version": CACHE_VERSION, "hashes": hashes}, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def flatten(table, depth, vote_positions, prefix=()):
+    """ Return list of [key, ..., key, value] entries of nested dict table. """
+
+    entries = []
+    for key in table:
+        keys = prefix + (list(key) if len(prefix) in vote_positions else key,)
+        value = table[key]
+        if len(keys) == depth:
+            entries.append(list(keys) + [list(value) if isinstance(value, tuple) else value])
+        elif len(value) == 0:
+            entries.append(list(keys) + [{}])      # keep empty subtables
+        else:
+            entries.extend(flatten(value, depth, vote_positions, keys))
+    return entries
+
+
+def unflatten(entries, vote_positions):
+    """ Return nested dict table with given [key, ..., key, value] entries. """
+
+    table = {}
+    for entry in entries:
+        keys = [tuple(key) if i in vote_positions else key
+                for (i, key) in enumerate(entry[:-1])]
+        value = entry[-1]
+        d = table
+        for key in keys[:-1]:
+            d = d.setdefault(key, {})
+        d[keys[-1]] = tuple(value) if isinstance(value, list) else value
+    return table
+
+
+def write_cache(e, key):
+    """ Save e's reported aggregates, with the given key. """
+
+    filename = cache_filename(e)
+    cache = {"key": key}
+    for name in TABLES:
+        (depth, vote_positions) = TABLES[name]
+        cache[name] = flatten(getattr(e, name), depth, vote_positions)
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + ".tmp", "w") as file:
+            json.dump(cache, file)
+        os.replace(filename + ".tmp", filename)
+    except OSError as error:
+        logger.warning("Could not write cache file %s: %s", filename, error)
+
+
+def read_cache(e, key):
+    """
+    If the cache has the given key, set e's reported aggregates from it
+    and return True; otherwise return False.
+    """
+
+    filename = cache_filename(e)
+    try:
+        with open(filename) as file:
+            cache = json.load(file)
+        if cache.get("key") != key:
+            return False
+        tables = {}
+        for name in TABLES:
+            (depth, vote_positions) = TABLES[name]
+            tables[name] = unflatten(cache[name], vote_positions)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError, KeyError, TypeError, IndexError) as error:
+        logger.warning("Ignoring unreadable cache file %s: %s", filename, error)
+        return False
+    for name in tables:
+        setattr(e, name, tables[name])
+    return True
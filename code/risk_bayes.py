@@ -264,10 +264,15 @@ def compute_risk(e, mid, sn_tcpra, trials=None):
     """
 
     cid = e.cid_m[mid]
-    wrong_outcome_count = 0
     if trials == None:
         trials = e.n_trials
     vs = e.votes_c[cid]
+    # test tallies are collected as rows of a (trials x votes) matrix,
+    # so that outcomes can be computed for all trials at once
+    # (see outcomes.compute_outcomes_batch)
+    votes = list(vs)
+    vote_index = {vote: i for (i, vote) in enumerate(votes)}
+    test_tally_rows = []
     for trial in range(trials):
         test_tally = {vote: 0 for vote in vs}
         for pbcid in sorted(e.possible_pbcid_c[cid]):
@@ -299,8 +304,18 @@ def compute_risk(e, mid, sn_tcpra, trials=None):
                                                        nonsample_size)
                 add_dicts(test_tally, nonsample_tally)
 
-        if e.ro_c[cid] != outcomes.compute_outcome(e, cid, test_tally):  
-            wrong_outcome_count += 1
+        for vote in test_tally:
+            if vote not in vote_index:
+                vote_index[vote] = len(votes)
+                votes.append(vote)
+        test_tally_rows.append([test_tally.get(vote, 0) for vote in votes])
+
+    test_tallies = np.zeros((trials, len(votes)))
+    for trial, row in enumerate(test_tally_rows):
+        test_tallies[trial, :len(row)] = row
+    test_outcomes = outcomes.compute_outcomes_batch(e, cid, votes, test_tallies)
+    wrong_outcome_count = sum([1 for outcome in test_outcomes
+                               if outcome != e.ro_c[cid]])
 
     risk = wrong_outcome_count / e.n_trials
     e.risk_tm[e.stage_time][mid] = risk
@@ -8,8 +8,9 @@ Improved code for computing Bayes risks.
 
 Will replace risk_bayes.py, and be called by audit.py.
 
-THIS FILE IS INCOMPLETE.  TO BE THOUGHT THROUGH
-MORE CAREFULLY, AND THEN IMPLEMENTED.
+The tree described below is implemented by the class CountTree,
+which stores the tree in flattened, array-backed form (see the
+"Implementation" notes further down).
 """
 
 """
@@ -132,3 +133,378 @@ ballot manifest.
 
 T.getR((),av) gives the reported vote total for candidate av.
 """
+
+"""
+Implementation.
+
+A naive recursive implementation of T.get is too slow to be used
+inside the risk-measurement loop, so the tree is flattened into arrays:
+
+    -- A node whose children are leaves (that is, whose children
+       are obtained by appending an av) is called a 'stratum'.
+       Every stratum has one leaf for each av in the vote domain vs,
+       so the leaf counts for all strata are stored as three
+       matrices countA, countR, countP, each of shape
+           (number of strata) x len(vs)
+       with row s giving the counts for stratum s.
+
+    -- Strata are sorted lexicographically.  Since nodes are tuples,
+       all strata below a given node x then form a contiguous range
+       of rows lo_x .. hi_x-1.
+
+    -- Internal nodes are likewise stored in sorted (preorder) order,
+       with their children given in CSR (compressed sparse row) form:
+       the children of node i are
+           nodes[child_index[child_ptr[i] : child_ptr[i+1]]]
+
+    -- Prefix sums over the rows of each count matrix give
+           T.get(x, av) = prefix[hi_x, av] - prefix[lo_x, av]
+       so every aggregation is O(1), whatever the size of the subtree.
+
+Posterior draws are done for all strata and many trials at once,
+as array operations of shape (trials, strata, len(vs)); any node's
+posterior tally is then the sum of a contiguous slice of strata.
+
+The stratification is arbitrary: a stratum may be (pbcid, rv), or
+(pbcid, card type, rv), or (pbcid, scanner, rv), and so on, and
+different subtrees may have different depths.
+"""
+
+import numpy as np
+
+import audit
+import outcomes
+import risk_bayes
+
+
+class CountTree(object):
+
+    """
+    Count tree for a single contest, flattened into arrays.
+
+    Usage:
+        T = CountTree(vs)
+        T.add(("DEN-A01", ("Alice",)), ("Alice",), countA=10, countP=50.0)
+        ...
+        T.finish()
+        T.getA(("DEN-A01",), ("Alice",))
+
+    Here vs is the vote domain (list of avs), and the first argument
+    of T.add is a stratum (a tuple of meta-information); the leaf
+    is the stratum extended by the given av.
+    """
+
+    def __init__(self, vs):
+
+        T = self
+        T.vs = list(vs)
+        T.av_index = {av: i for (i, av) in enumerate(T.vs)}
+        T.root = ()
+        T.counts_s = {}          # stratum->[countA, countR, countP] (while building)
+        T.finished = False
+
+    def add(self, stratum, av, countA=0, countR=0, countP=0):
+        """
+        Add given counts to the leaf (stratum + (av,)).
+        Must be called before finish().
+        """
+
+        T = self
+        if T.finished:
+            raise ValueError("CountTree.add called after CountTree.finish.")
+        stratum = tuple(stratum)
+        if stratum not in T.counts_s:
+            T.counts_s[stratum] = np.zeros((3, len(T.vs)))
+        a = T.av_index[av]
+        T.counts_s[stratum][0, a] += countA
+        T.counts_s[stratum][1, a] += countR
+        T.counts_s[stratum][2, a] += countP
+
+    def finish(self):
+        """
+        Flatten tree into arrays: sorted strata, count matrices,
+        prefix sums, and CSR child structure for internal nodes.
+        """
+
+        T = self
+        T.strata = sorted(T.counts_s, key=sort_key)
+        T.stratum_set = set(T.strata)
+        for stratum in T.strata:
+            for k in range(len(stratum)):
+                if stratum[:k] in T.stratum_set:
+                    raise ValueError("Stratum {} is a prefix of stratum {}."
+                                     .format(stratum[:k], stratum))
+        S = len(T.strata)
+        V = len(T.vs)
+        counts = np.zeros((3, S, V))
+        for s, stratum in enumerate(T.strata):
+            counts[:, s, :] = T.counts_s[stratum]
+        T.countA, T.countR, T.countP = counts[0], counts[1], counts[2]
+        zero_row = np.zeros((1, V))
+        T.prefixA = np.vstack((zero_row, np.cumsum(T.countA, axis=0)))
+        T.prefixR = np.vstack((zero_row, np.cumsum(T.countR, axis=0)))
+        T.prefixP = np.vstack((zero_row, np.cumsum(T.countP, axis=0)))
+
+        # internal nodes: all proper prefixes of strata, plus strata.
+        # Sorting strata makes each node's strata a contiguous range.
+        T.lo_x = {}
+        T.hi_x = {}
+        for s, stratum in enumerate(T.strata):
+            for k in range(len(stratum)+1):
+                x = stratum[:k]
+                if x not in T.lo_x:
+                    T.lo_x[x] = s
+                T.hi_x[x] = s+1
+        if S == 0:
+            T.lo_x[()] = 0
+            T.hi_x[()] = 0
+        T.internal_nodes = sorted(T.lo_x, key=sort_key)
+        T.node_index = {x: i for (i, x) in enumerate(T.internal_nodes)}
+        T.lo = np.array([T.lo_x[x] for x in T.internal_nodes], dtype=int)
+        T.hi = np.array([T.hi_x[x] for x in T.internal_nodes], dtype=int)
+
+        # CSR children of internal nodes (only internal children;
+        # the leaf children of a stratum are implicit, one per av).
+        children_i = [[] for _ in T.internal_nodes]
+        for i, x in enumerate(T.internal_nodes):
+            if len(x) > 0:
+                children_i[T.node_index[x[:-1]]].append(i)
+        T.child_ptr = np.zeros(len(T.internal_nodes)+1, dtype=int)
+        T.child_ptr[1:] = np.cumsum([len(c) for c in children_i])
+        T.child_index = np.array([i for c in children_i for i in c], dtype=int)
+
+        T.leaves = [stratum + (av,) for stratum in T.strata for av in T.vs]
+        T.nodes = T.internal_nodes + T.leaves
+        T.finished = True
+
+    def children(self, x):
+        """ Return list of children of node x (empty list for a leaf). """
+
+        T = self
+        x = tuple(x)
+        if x in T.stratum_set:
+            return [x + (av,) for av in T.vs]
+        if x not in T.node_index:
+            return []
+        i = T.node_index[x]
+        return [T.internal_nodes[j]
+                for j in T.child_index[T.child_ptr[i]:T.child_ptr[i+1]]]
+
+    def get(self, x, av, prefix):
+        """
+        Return sum of counts (from given prefix-sum matrix) for av over 
+        all leaves in subtree rooted at x.  O(1) for an internal node.
+        """
+
+        T = self
+        x = tuple(x)
+        a = T.av_index[av]
+        if x in T.lo_x:
+            return prefix[T.hi_x[x], a] - prefix[T.lo_x[x], a]
+        # x is a leaf (stratum + (av',)), or not in tree at all
+        stratum = x[:-1]
+        if len(x) > 0 and stratum in T.stratum_set and x[-1] == av:
+            s = T.lo_x[stratum]
+            return prefix[s+1, a] - prefix[s, a]
+        return 0.0
+
+    def getA(self, x, av):
+        return self.get(x, av, self.prefixA)
+
+    def getR(self, x, av):
+        return self.get(x, av, self.prefixR)
+
+    def getP(self, x, av):
+        return self.get(x, av, self.prefixP)
+
+    def get_all(self, x, prefix):
+        """
+        Return array (indexed like T.vs) of counts for subtree at internal node x.
+        """
+
+        T = self
+        x = tuple(x)
+        return prefix[T.hi_x[x]] - prefix[T.lo_x[x]]
+
+    def stratum_range(self, x):
+        """ Return (lo, hi) range of stratum rows for subtree at internal node x. """
+
+        x = tuple(x)
+        return (self.lo_x[x], self.hi_x[x])
+
+    def nonsample_sizes(self):
+        """
+        Return array giving, for each stratum, the number of ballots not yet
+        sampled:  (reported count) - (actual (sample) count).
+        """
+
+        T = self
+        return np.maximum(T.countR.sum(axis=1) - T.countA.sum(axis=1), 0.0)
+
+
+def sort_key(x):
+    """
+    Sort key for tree nodes.  Nodes may contain a mixture of strings and
+    votes (tuples), so compare elementwise on their reprs; any consistent 
+    order keeps subtrees contiguous.
+    """
+
+    return tuple(repr(xi) for xi in x)
+
+
+##############################################################################
+# Batched posterior draws
+
+
+def dirichlet_batch(alpha, trials, rs):
+    """
+    Return array of shape (trials,) + alpha.shape of Dirichlet samples,
+    normalized along the last axis.  Entries of alpha may be zero, in
+    which case the corresponding probabilities are zero (as in
+    risk_bayes.gamma).
+    """
+
+    g = rs.gamma(np.broadcast_to(alpha, (trials,) + alpha.shape))
+    total = g.sum(axis=-1, keepdims=True)
+    return np.divide(g, total, out=np.zeros_like(g), where=total > 0)
+
+
+def multinomial_batch(n, ps, rs):
+    """
+    Batched version of risk_bayes.multinomial.
+
+    Here ps has shape (..., V) with rows summing to one (or zero), and
+    n is broadcastable to ps.shape[:-1].  Each row gets a multinomial
+    sample of size floor(n), drawn as a chain of conditional binomials,
+    plus the fractional part of n times the row's probabilities.
+    """
+
+    n = np.broadcast_to(n, ps.shape[:-1])
+    n_floor = np.floor(n)
+    n_frac = n - n_floor
+    remaining = n_floor.astype(np.int64)
+    remaining_p = np.ones(ps.shape[:-1])
+    freq = np.zeros(ps.shape)
+    V = ps.shape[-1]
+    for v in range(V-1):
+        p = np.divide(ps[..., v], remaining_p,
+                      out=np.zeros(remaining_p.shape), where=remaining_p > 0)
+        x = rs.binomial(remaining, np.clip(p, 0.0, 1.0))
+        freq[..., v] = x
+        remaining = remaining - x
+        remaining_p = remaining_p - ps[..., v]
+    if V > 0:
+        freq[..., V-1] = remaining
+    return freq + n_frac[..., None] * ps
+
+
+def draw_posterior(T, trials, rs=None):
+    """
+    Draw trials-many samples from the Bayesian posterior on full stratum
+    tallies.
+
+    For each stratum, the nonsample tally is drawn from the
+    Dirichlet-multinomial distribution with hyperparameters
+    countA + countP and size (countR - countA total); the sample tally
+    countA is then added in.  (This is risk_bayes.draw_nonsample_tally,
+    done for every stratum and trial at once.)
+
+    Returns array of shape (trials, number of strata, len(T.vs)).
+    """
+
+    if rs is None:
+        rs = audit.auditRandomState
+    alpha = T.countA + T.countP
+    ps = dirichlet_batch(alpha, trials, rs)
+    nonsample = multinomial_batch(T.nonsample_sizes(), ps, rs)
+    return nonsample + T.countA
+
+
+def posterior_tallies(T, draws, x=()):
+    """
+    Return (trials, len(T.vs)) array of posterior tallies for the subtree
+    rooted at internal node x, from draws made by draw_posterior.
+    """
+
+    (lo, hi) = T.stratum_range(x)
+    return draws[:, lo:hi, :].sum(axis=1)
+
+
+##############################################################################
+# Risk measurement using the count tree
+
+
+def make_tree(e, cid, sn_tcpra):
+    """
+    Return finished CountTree for contest cid, stratified by (pbcid, rv),
+    with 'A' counts from sample tallies sn_tcpra[e.stage_time], 'R' counts
+    from e.rn_cpr, and 'P' counts from the usual two-level prior
+    (see risk_bayes.compute_prior_pseudocounts).
+
+    Audited votes that are not among the reported votes e.votes_c[cid]
+    are added to the vote domain, with no prior pseudocounts (as in
+    risk_bayes.compute_risk).
+    """
+
+    vs = sorted(e.votes_c[cid])
+    unseen_avs = set(av
+                     for pbcid in e.possible_pbcid_c[cid]
+                     for sample_tally in sn_tcpra[e.stage_time][cid][pbcid].values()
+                     for av in sample_tally
+                     if av not in e.votes_c[cid])
+    T = CountTree(vs + sorted(unseen_avs))
+    for pbcid in sorted(e.possible_pbcid_c[cid]):
+        for rv in sorted(sn_tcpra[e.stage_time][cid][pbcid]):
+            stratum = (pbcid, rv)
+            sample_tally = sn_tcpra[e.stage_time][cid][pbcid][rv]
+            for av in sample_tally:
+                T.add(stratum, av, countA=sample_tally[av])
+            T.add(stratum, rv, countR=e.rn_cpr[cid][pbcid][rv])
+            prior_pseudocounts = \
+                risk_bayes.compute_prior_pseudocounts(vs,
+                                                      rv,
+                                                      e.pseudocount_base,
+                                                      e.pseudocount_match)
+            for av in prior_pseudocounts:
+                T.add(stratum, av, countP=prior_pseudocounts[av])
+    T.finish()
+    return T
+
+
+def compute_risk(e, mid, sn_tcpra, trials=None, chunk_size=10000, rs=None):
+    """
+    Compute (estimate) Bayesian risk (chance that reported outcome
+    is wrong for contest e.cid_m[mid]), as in risk_bayes.compute_risk,
+    but with all posterior draws made as batched array operations
+    over a CountTree, and outcomes computed by the batched outcome
+    rule for the contest type when there is one.
+
+    Trials are done in chunks of at most chunk_size, to bound memory.
+    """
+
+    cid = e.cid_m[mid]
+    if trials == None:
+        trials = e.n_trials
+    T = make_tree(e, cid, sn_tcpra)
+    wrong_outcome_count = 0
+    done = 0
+    while done < trials:
+        n = min(chunk_size, trials - done)
+        tallies = posterior_tallies(T, draw_posterior(T, n, rs))
+        test_outcomes = outcomes.compute_outcomes_batch(e, cid, T.vs, tallies)
+        wrong_outcome_count += sum([1 for outcome in test_outcomes
+                                    if outcome != e.ro_c[cid]])
+        done += n
+
+    risk = wrong_outcome_count / trials
+    e.risk_tm[e.stage_time][mid] = risk
+    return risk
+
+
+def compute_risks(e, st, trials=None):
+    """
+    Compute risks via all measurement approaches, for current sample.
+    """
+
+    for mid in e.mids:
+        compute_risk(e, mid, st, trials)
@@ -15,6 +15,15 @@ def write_initial_saved_state(e):
     Write the first saved-state, after the election-spec has been read."
     """
 
+    write_state(e, initial_saved_state(e))
+
+
+def initial_saved_state(e):
+    """
+    Set up the initial stage (no sampling done yet) in e, and
+    return the first saved-state dict (not written out).
+    """
+
     initial_stage_time = "0000-00-00-00-00-00" # stage_time for initial saved-state
 
     e.sn_tp[initial_stage_time] = {}
@@ -37,8 +46,9 @@ def write_initial_saved_state(e):
     ss["sn_tp"] = e.sn_tp             # sample sizes, by stage and pbcid
     ss["status_tm"] = e.status_tm     # measurement statuses, by stage and mid
     ss["plan_tp"] = e.plan_tp         # plan for next stage of audit
+    ss["planner_state"] = e.planner_state   # planner warm-start state
 
-    write_state(e, ss)
+    return ss
 
 
 def write_intermediate_saved_state(e):
@@ -47,14 +57,23 @@ def write_intermediate_saved_state(e):
     after the election-spec has been read and the first audit stage done.
     """
 
+    write_state(e, intermediate_saved_state(e))
+
+
+def intermediate_saved_state(e):
+    """
+    Return saved-state dict for the current stage (not written out).
+    """
+
     ss = {}                 # saved state dict, to be written out
 
     ss["stage_time"] = e.stage_time
     ss["sn_tp"] = e.sn_tp             # sample sizes, by stage and pbcid
     ss["status_tm"] = e.status_tm     # measurement statuses, by stage and mid
     ss["plan_tp"] = e.plan_tp         # plan for next stage of audit
+    ss["planner_state"] = e.planner_state   # planner warm-start state
 
-    write_state(e, ss)
+    return ss
 
 
 def write_state(e, ss):
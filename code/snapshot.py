@@ -26,7 +26,8 @@ def hash_file(filename):
 
     h = hashlib.sha256()
     with open(filename, "rb") as f:
-        h.update(f.read(2**20))
+        for block in iter(lambda: f.read(2**20), b""):
+            h.update(block)
     return h.hexdigest()
 
 
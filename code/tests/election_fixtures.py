@@ -0,0 +1,111 @@
+"""
+Small test elections shared by the tests.
+
+syn2_election builds an election in memory from syn2 spec rows;
+write_test_election writes one to an election directory, and
+read_test_election reads it back.  sampled_election sets up the state
+of an audit in progress directly, for the planner.
+"""
+
+import audit
+import audit_orders
+import csv_writers
+import election_spec
+import OpenAuditTool
+import reported
+import syn2
+import utils
+import workload
+
+
+def syn2_election(rows, n_trials=None, audit_seed=None):
+    """
+    Return election "test" built in memory from syn2 spec rows
+    (contest, collection, reported vote, actual vote, number).
+    Every collection gets an (empty) entry for every contest in e.rv_cpb.
+    """
+
+    e = OpenAuditTool.Election()
+    e.election_dirname = "test"
+    if n_trials != None:
+        e.n_trials = n_trials
+    syn2.process_spec(e, workload.Syn2_Params("test"), rows)
+    for cid in e.cids:
+        for pbcid in e.pbcids:
+            e.rv_cpb[cid].setdefault(pbcid, {})
+    election_spec.finish_election_spec(e)
+    reported.finish_reported(e)
+    if audit_seed != None:
+        audit.set_audit_seed(e, audit_seed)
+    return e
+
+
+def sampled_election(pbcids=("p1", "p2"), n=1000, counts=(60, 40)):
+    """
+    Return election (stage "t") with one plurality contest "c" (Alice
+    vs Bob), measured by "m", in collections pbcids of n ballots each;
+    each collection's sample so far is counts[0] votes for Alice and
+    counts[1] for Bob, each matching its reported vote.
+    """
+
+    e = OpenAuditTool.Election(num_winners=2, max_num_it=200)
+    e.stage_time = "t"
+    e.cids = ["c"]
+    e.mids = ["m"]
+    e.cid_m = {"m": "c"}
+    e.contest_type_c = {"c": "plurality"}
+    e.params_c = {"c": ""}
+    e.votes_c = {"c": {("Alice",): True, ("Bob",): True}}
+    e.ro_c = {"c": ("Alice",)}
+    e.risk_limit_m = {"m": 0.05}
+    e.rn_p = {pbcid: n for pbcid in pbcids}
+    e.sn_tcpra = {"t": {"c": {pbcid: {("Alice",): {("Alice",): counts[0]},
+                                      ("Bob",): {("Bob",): counts[1]}}
+                              for pbcid in pbcids}}}
+    e.sn_tp = {"t": {pbcid: sum(counts) for pbcid in pbcids}}
+    e.possible_pbcid_c = {"c": list(pbcids)}
+    e.bids_p = {pbcid: ["{}-{}".format(pbcid, i) for i in range(n)] for pbcid in pbcids}
+    sample_votes = [("Alice",)] * counts[0] + [("Bob",)] * counts[1]
+    e.av_cpb = {"c": {pbcid: dict(zip(e.bids_p[pbcid], sample_votes)) for pbcid in pbcids}}
+    return e
+
+
+def write_test_election(tmpdir, monkeypatch):
+    """
+    Write a two-contest, two-collection election "test", with audited
+    votes for every ballot, under tmpdir (made ELECTIONS_ROOT).
+    """
+
+    monkeypatch.setattr(OpenAuditTool, "ELECTIONS_ROOT", str(tmpdir))
+    utils.start_datetime_string = utils.datetime_string()
+    e = OpenAuditTool.Election()
+    e.election_dirname = "test"
+    rows = [("cid1", "pbcid1", ("Alice",), ("Alice",), 30),
+            ("cid1", "pbcid1", ("Bob",), ("Bob",), 20),
+            ("cid1", "pbcid2", ("Alice",), ("Bob",), 5),
+            ("cid1", "pbcid2", ("Bob",), ("Bob",), 25),
+            ("cid2", "pbcid1", ("No",), ("No",), 50),
+            ("cid2", "pbcid2", ("Yes",), ("Yes",), 30)]
+    syn2.process_spec(e, workload.Syn2_Params("test"), rows)
+    e.audit_seed = 1
+    audit_orders.compute_audit_orders(e)
+    csv_writers.write_csv(e)
+
+
+def read_test_election(aggregates_only=False, audited_votes=False, **options):
+    """
+    Read election "test" (see write_test_election): its election spec,
+    reported data (see reported.read_reported for aggregates_only), and
+    audited votes if audited_votes is True.  Election attributes given
+    as keyword options (e.g. column_cache=True) are set first.
+    """
+
+    e = OpenAuditTool.Election()
+    e.election_dirname = "test"
+    for name in options:
+        setattr(e, name, options[name])
+    election_spec.read_election_spec(e)
+    reported.read_reported(e, aggregates_only)
+    if audited_votes:
+        audit.read_audited_votes(e)
+    return e
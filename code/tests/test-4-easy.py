@@ -41,11 +41,19 @@ def test_4_easy():
         OpenAuditTool_args.read_audited = False
         OpenAuditTool_args.audit = True
         OpenAuditTool_args.pause = False
+        OpenAuditTool_args.simulate = False
+        OpenAuditTool_args.async_ingest = False
+        OpenAuditTool_args.ingest_processes = None
+        OpenAuditTool_args.column_cache = False
+        OpenAuditTool_args.reported_cache = False
 
         # added for new planner code:
         OpenAuditTool_args.num_winners = 2
         OpenAuditTool_args.max_num_it = 100
         OpenAuditTool_args.sample_by_size = False 
         OpenAuditTool_args.use_discrete_rm = False
+        OpenAuditTool_args.use_greedy_planner = False
+        OpenAuditTool_args.stage_budget = None
+        OpenAuditTool_args.plan_time_budget = None
         OpenAuditTool_args.pick_county_func = "round_robin"
         cli_OpenAuditTool.dispatch(e, OpenAuditTool_args)
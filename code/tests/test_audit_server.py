@@ -0,0 +1,132 @@
+"""
+Tests for audit_server.py
+"""
+
+import http.server
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import audit
+import audit_server
+import OpenAuditTool
+
+from election_fixtures import syn2_election
+
+
+def make_test_service(tmpdir, monkeypatch, rows=None, possible_pbcid_c=None):
+
+    monkeypatch.setattr(OpenAuditTool, "ELECTIONS_ROOT", str(tmpdir))
+    if rows == None:
+        rows = [("cid1", "pbcid1", ("Alice",), ("Alice",), 300),
+                ("cid1", "pbcid1", ("Bob",), ("Bob",), 200)]
+    e = syn2_election(rows, n_trials=500)
+    if possible_pbcid_c != None:
+        e.possible_pbcid_c = possible_pbcid_c
+    e.av_cpb = {}
+    audit.set_audit_seed(e, 1)
+    service = audit_server.AuditService(e)
+    service.start()
+    return service
+
+
+def audited_votes_text(e, n):
+
+    lines = ["Collection,Ballot id,Contest,Selections"] + \
+            ["pbcid1,{},cid1,{}".format(bid, e.rv_cpb["cid1"]["pbcid1"][bid][0])
+             for bid in e.bids_p["pbcid1"][:n]]
+    return "\n".join(lines)
+
+
+def test_audit_server(tmpdir, monkeypatch):
+
+    service = make_test_service(tmpdir, monkeypatch)
+    server = http.server.HTTPServer(("127.0.0.1", 0), audit_server.make_handler(service))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = "http://127.0.0.1:{}".format(server.server_port)
+    try:
+        status = json.loads(urllib.request.urlopen(url+"/status").read())
+        assert status["stage_time"] == None
+        assert status["plan_p"] == {"pbcid1": 40}
+
+        e = service.e
+        request = urllib.request.Request(url+"/audited-votes/pbcid1",
+                                         data=audited_votes_text(e, 40).encode("utf-8"))
+        assert json.loads(urllib.request.urlopen(request).read()) == {"collection": "pbcid1"}
+        assert len(e.av_cpb["cid1"]["pbcid1"]) == 40
+
+        request = urllib.request.Request(url+"/stage", data=b"")
+        status = json.loads(urllib.request.urlopen(request).read())
+        assert status["sn_p"] == {"pbcid1": 40}
+        assert set(status["risk_m"]) == {"M1-cid1"}
+        assert status["status_m"]["M1-cid1"] in ("Open", "Passed")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def post_error_code(url, data):
+
+    try:
+        urllib.request.urlopen(urllib.request.Request(url, data=data))
+    except urllib.error.HTTPError as error:
+        return error.code
+    return 200
+
+
+def test_audit_server_errors(tmpdir, monkeypatch):
+
+    service = make_test_service(tmpdir, monkeypatch)
+    e = service.e
+    server = http.server.HTTPServer(("127.0.0.1", 0), audit_server.make_handler(service))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = "http://127.0.0.1:{}".format(server.server_port)
+    try:
+        service.submit_audited_votes("pbcid1", audited_votes_text(e, 10))
+        dirpath = os.path.join(str(tmpdir), "test", "3-audit", "33-audited-votes")
+        filename = os.path.join(dirpath, "audited-votes-pbcid1.csv")
+        with open(filename) as file:
+            text = file.read()
+
+        # a bad upload leaves the file and the audited votes unchanged
+        assert post_error_code(url+"/audited-votes/pbcid1", b"Ballot id\nb1") == 400
+        with open(filename) as file:
+            assert file.read() == text
+        assert len(e.av_cpb["cid1"]["pbcid1"]) == 10
+        assert sorted(os.listdir(dirpath)) == ["audited-votes-pbcid1.csv"]
+
+        # as does one with rows for other collections, or for unknown ballots
+        text = audited_votes_text(e, 10)
+        for bad_text in [text + "\npbcid2,{},cid1,Bob".format(e.bids_p["pbcid1"][20]),
+                         text + "\npbcid1,no-such-ballot,cid1,Bob"]:
+            assert post_error_code(url+"/audited-votes/pbcid1",
+                                   bad_text.encode("utf-8")) == 400
+            with open(filename) as file:
+                assert file.read() == text
+            assert sorted(e.av_cpb) == ["cid1"]
+            assert sorted(e.av_cpb["cid1"]) == ["pbcid1"]
+            assert len(e.av_cpb["cid1"]["pbcid1"]) == 10
+
+        # files of other collections, or with version labels, do not hide it
+        for name in ["audited-votes-pbcid1_2.csv", "audited-votes-pbcid1-2026-10-19.csv"]:
+            with open(os.path.join(dirpath, name), "w") as file:
+                file.write(audited_votes_text(e, 20))
+        data = audited_votes_text(e, 30).encode("utf-8")
+        assert post_error_code(url+"/audited-votes/pbcid1", data) == 200
+        assert len(e.av_cpb["cid1"]["pbcid1"]) == 30
+        assert audit.audited_votes_filename(e, "pbcid1") == filename
+
+        # unexpected errors give a response too
+        def fail():
+            raise RuntimeError("broken")
+        monkeypatch.setattr(service, "compute_stage", fail)
+        assert post_error_code(url+"/stage", b"") == 500
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,108 @@
+"""
+Tests for audit_watch.py
+"""
+
+import os
+
+import OpenAuditTool
+import audit
+import audit_watch
+import risk_bayes
+from test_audit_server import make_test_service
+
+
+def test_audit_watch(tmpdir, monkeypatch):
+
+    service = make_test_service(tmpdir, monkeypatch)
+    e = service.e
+    watcher = audit_watch.AuditedVotesWatcher(e, poll_interval=0.01)
+    assert watcher.changed_pbcids() == []
+    assert audit_watch.affected_mids(e, ["pbcid1"]) == e.mids
+    assert audit_watch.affected_mids(e, []) == []
+
+    lines = ["Collection,Ballot id,Contest,Selections"] + \
+            ["pbcid1,{},cid1,{}".format(bid, e.rv_cpb["cid1"]["pbcid1"][bid][0])
+             for bid in e.bids_p["pbcid1"][:40]]
+    with open(os.path.join(watcher.dirpath, "audited-votes-pbcid1.csv"), "w") as file:
+        file.write("\n".join(lines))
+    assert watcher.changed_pbcids() == ["pbcid1"]
+    assert watcher.changed_pbcids() == []
+
+    e.risk_limit_m = {mid: 0.0 for mid in e.mids}     # keep the audit open
+    status = audit_watch.update(service, ["pbcid1"])
+    assert len(e.av_cpb["cid1"]["pbcid1"]) == 40
+    assert status["sn_p"] == {"pbcid1": 40}
+    assert set(status["risk_m"]) == set(e.mids)
+
+    # a stage with no changed collection keeps the samples, and so the risks
+    computed = []
+    compute_risk = risk_bayes.compute_risk
+    def counting_compute_risk(e, mid, sn_tcpra):
+        computed.append(mid)
+        compute_risk(e, mid, sn_tcpra)
+    monkeypatch.setattr(risk_bayes, "compute_risk", counting_compute_risk)
+    assert e.saved_state["plan_tp"][e.saved_state["stage_time"]]["pbcid1"] > 40
+    status = service.compute_stage(pbcids=[])
+    assert status["sn_p"] == {"pbcid1": 40}
+    assert computed == []
+
+    # but recomputes them if the sample tallies changed
+    for bid in e.bids_p["pbcid1"][:10]:
+        e.av_cpb["cid1"]["pbcid1"][bid] = ("Bob",)
+    status = service.compute_stage(pbcids=[])
+    assert computed == e.mids
+
+
+def write_audited_votes(e, dirpath, pbcid, cid, n):
+
+    lines = ["Collection,Ballot id,Contest,Selections"] + \
+            ["{},{},{},{}".format(pbcid, bid, cid, e.rv_cpb[cid][pbcid][bid][0])
+             for bid in e.bids_p[pbcid][:n]]
+    with open(os.path.join(dirpath, "audited-votes-{}.csv".format(pbcid)), "w") as file:
+        file.write("\n".join(lines))
+
+
+def test_audit_watch_unrelated_contests(tmpdir, monkeypatch):
+
+    rows = [("cid1", "pbcid1", ("Alice",), ("Alice",), 300),
+            ("cid1", "pbcid1", ("Bob",), ("Bob",), 200),
+            ("cid2", "pbcid2", ("Yes",), ("Yes",), 260),
+            ("cid2", "pbcid2", ("No",), ("No",), 240)]
+    service = make_test_service(tmpdir, monkeypatch, rows,
+                                {"cid1": ["pbcid1"], "cid2": ["pbcid2"]})
+    e = service.e
+    e.risk_limit_m = {mid: 0.0 for mid in e.mids}     # keep the audit open
+    (mid1, mid2) = sorted(e.mids, key=lambda mid: e.cid_m[mid])
+    watcher = audit_watch.AuditedVotesWatcher(e, poll_interval=0.01)
+    write_audited_votes(e, watcher.dirpath, "pbcid1", "cid1", 40)
+    write_audited_votes(e, watcher.dirpath, "pbcid2", "cid2", 40)
+    status = audit_watch.update(service, watcher.changed_pbcids())
+    assert status["sn_p"] == {"pbcid1": 40, "pbcid2": 40}
+    risk2 = status["risk_m"][mid2]
+
+    # more ballots audited in pbcid1 only: cid2's sample and risk are untouched
+    computed = []
+    compute_risk = risk_bayes.compute_risk
+    def counting_compute_risk(e, mid, sn_tcpra):
+        computed.append(mid)
+        compute_risk(e, mid, sn_tcpra)
+    monkeypatch.setattr(risk_bayes, "compute_risk", counting_compute_risk)
+    plan_p = e.saved_state["plan_tp"][e.saved_state["stage_time"]]
+    write_audited_votes(e, watcher.dirpath, "pbcid1", "cid1", plan_p["pbcid1"])
+    assert watcher.changed_pbcids() == ["pbcid1"]
+    status = audit_watch.update(service, ["pbcid1"])
+    assert computed == [mid1]
+    assert status["sn_p"] == {"pbcid1": plan_p["pbcid1"], "pbcid2": 40}
+    assert status["risk_m"][mid2] == risk2
+
+
+def test_audited_votes_pbcid():
+
+    e = OpenAuditTool.Election()
+    e.pbcids = ["DEN", "DEN-A01", "BOU"]
+    assert audit.audited_votes_pbcid(e, "audited-votes-DEN.csv") == "DEN"
+    assert audit.audited_votes_pbcid(e, "audited-votes-DEN-A01.csv") == "DEN-A01"
+    assert audit.audited_votes_pbcid(e, "audited-votes-DEN-A01-2026-10-19.csv.gz") == "DEN-A01"
+    assert audit.audited_votes_pbcid(e, "audited-votes-DEN-2026-10-19.csv") == "DEN"
+    assert audit.audited_votes_pbcid(e, "audited-votes-DENVER.csv") == None
+    assert audit.audited_votes_pbcid(e, "audited-votes-BOU.txt") == None
@@ -0,0 +1,93 @@
+"""
+Tests for batch_audit.py
+"""
+
+import os
+
+import audit
+import batch_audit
+import OpenAuditTool
+
+from election_fixtures import syn2_election
+
+
+def make_test_election(tmpdir, monkeypatch):
+
+    monkeypatch.setattr(OpenAuditTool, "ELECTIONS_ROOT", str(tmpdir))
+    rows = [("cid1", "pbcid1", ("Alice",), ("Alice",), 300),
+            ("cid1", "pbcid1", ("Bob",), ("Bob",), 200)]
+    e = syn2_election(rows, n_trials=2000, audit_seed=1)
+    # fifty boxes of ten ballots
+    for (i, bid) in enumerate(e.bids_p["pbcid1"]):
+        e.boxid_pb["pbcid1"][bid] = "box{:02d}".format(i // 10)
+    e.boxids_p["pbcid1"] = sorted(set(e.boxid_pb["pbcid1"].values()))
+    e.rn_pk["pbcid1"] = {boxid: 10 for boxid in e.boxids_p["pbcid1"]}
+    return e
+
+
+def test_batch_audit(tmpdir, monkeypatch):
+
+    e = make_test_election(tmpdir, monkeypatch)
+    batch_audit.write_reported_batch_tallies(e)
+    batch_audit.read_reported_batch_tallies(e)
+    assert sum(e.rn_cpkr["cid1"]["pbcid1"][boxid].get(("Alice",), 0)
+               for boxid in e.boxids_p["pbcid1"]) == 300
+
+    # nothing audited yet: reported outcome is far from certain
+    e.stage_time = "t1"
+    batch_audit.compute_batch_audit_orders(e)
+    batch_audit.read_audited_batch_tallies(e)
+    batch_audit.batch_audit_stage(e)
+    assert e.risk_tm["t1"]["M1-cid1"] > 0.2
+    assert e.status_tm["t1"]["M1-cid1"] == "Open"
+    assert 0 < e.plan_boxes_tp["t1"]["pbcid1"] < 50
+    assert e.plan_tp["t1"]["pbcid1"] == 10 * e.plan_boxes_tp["t1"]["pbcid1"]
+
+    # twenty boxes audited, with no discrepancies
+    audited = e.shuffled_boxids_p["pbcid1"][:20]
+    dirpath = os.path.join(str(tmpdir), "test", "2-reported", "24-reported-batch-tallies")
+    with open(os.path.join(dirpath, "reported-batch-tallies-pbcid1.csv")) as file:
+        lines = file.read().splitlines()
+    lines = lines[:1] + [line for line in lines[1:] if line.split(",")[1] in audited]
+    dirpath = os.path.join(str(tmpdir), "test", "3-audit", "33-audited-votes")
+    os.makedirs(dirpath)
+    with open(os.path.join(dirpath, "audited-batch-tallies-pbcid1.csv"), "w") as file:
+        file.write("\n".join(lines))
+    # boxes audited out of audit order are refused
+    skipped = e.shuffled_boxids_p["pbcid1"][20]
+    with open(os.path.join(dirpath, "audited-batch-tallies-pbcid1.csv"), "w") as file:
+        file.write("\n".join(lines[:1] + [line for line in lines[1:]
+                                          if line.split(",")[1] != audited[0]] +
+                             [line.replace(audited[0], skipped) for line in lines[1:]
+                              if line.split(",")[1] == audited[0]]))
+    try:
+        batch_audit.read_audited_batch_tallies(e)
+        assert False
+    except ValueError:
+        pass
+    with open(os.path.join(dirpath, "audited-batch-tallies-pbcid1.csv"), "w") as file:
+        file.write("\n".join(lines))
+
+    e.stage_time = "t2"
+    batch_audit.read_audited_batch_tallies(e)
+    assert sorted(e.audited_boxids_p["pbcid1"]) == sorted(audited)
+    batch_audit.batch_audit_stage(e)
+    assert e.risk_tm["t2"]["M1-cid1"] < 0.05
+    assert e.sn_tp["t2"] == {"pbcid1": 200}
+    assert e.status_tm["t2"]["M1-cid1"] == "Passed"
+
+    # a passed measurement stays passed, whatever later risks are
+    e.stage_time = "t3"
+    e.risk_tm["t3"] = {"M1-cid1": 0.9}
+    batch_audit.compute_batch_statuses(e)
+    assert e.status_tm["t3"]["M1-cid1"] == "Passed"
+
+    # also when the previous stage was run earlier, and only its output remains
+    e.stage_time = "2026-10-19-10-00-00"
+    e.status_tm[e.stage_time] = e.status_tm["t3"]
+    audit.write_audit_output_contest_status(e)
+    e.status_tm = {}
+    e.stage_time = "2026-10-19-11-00-00"
+    e.risk_tm[e.stage_time] = {"M1-cid1": 0.9}
+    batch_audit.compute_batch_statuses(e)
+    assert e.status_tm[e.stage_time]["M1-cid1"] == "Passed"
@@ -0,0 +1,86 @@
+"""
+Tests for column_cache.py
+"""
+
+import numpy as np
+import os
+
+import column_cache
+import snapshot
+
+from election_fixtures import write_test_election, read_test_election
+
+
+def test_column_cache(tmpdir, monkeypatch):
+
+    write_test_election(tmpdir, monkeypatch)
+    e1 = read_test_election(column_cache=False)
+    cache_dirname = os.path.join(str(tmpdir), "test", ".cache")
+    assert not os.path.exists(cache_dirname)
+
+    # first read writes the cache, second read uses it
+    e2 = read_test_election(column_cache=True)
+    cvrs_dirname = os.path.join(str(tmpdir), "test", "2-reported", "22-reported-cvrs")
+    cvrs_filename = os.path.join(cvrs_dirname, os.listdir(cvrs_dirname)[0])
+    cache_dirname = column_cache.cache_pathname(e2, cvrs_filename)
+    meta_filename = os.path.join(cache_dirname, "meta.json")
+    assert os.path.exists(meta_filename)
+
+    # an unchanged file is not even hashed
+    hashed = []
+    hash_file = snapshot.hash_file
+    def counting_hash_file(filename):
+        hashed.append(filename)
+        return hash_file(filename)
+    monkeypatch.setattr(snapshot, "hash_file", counting_hash_file)
+    e3 = read_test_election(column_cache=True)
+    assert hashed == []
+    for e in [e2, e3]:
+        assert e.bids_p == e1.bids_p
+        assert e.boxid_pb == e1.boxid_pb
+        assert e.rv_cpb == e1.rv_cpb
+        assert e.rn_cpr == e1.rn_cpr
+
+    # columns are integer codes, memory-mapped from .npy files
+    fieldnames = ["Collection", "Scanner", "Ballot id", "Contest", "Selections"]
+    columns = ["Collection", "Ballot id", "Contest", "Selections"]
+    result = column_cache.read_csv_columns(e3, cvrs_filename, fieldnames, True, columns)
+    assert hashed == []
+    for column in result:
+        assert isinstance(column, column_cache.CodedColumn)
+        assert isinstance(column.codes, np.memmap)
+        assert column.codes.dtype == np.int32
+    assert list(result[3]) == [result[3][i] for i in range(len(result[3]))]
+    assert all(isinstance(vote, tuple) for vote in result[3])
+
+    # a touched but unchanged file is hashed, but not parsed again
+    os.utime(cvrs_filename, ns=(0, 0))
+    parsed = []
+    read_columns = column_cache.csv_readers.read_csv_columns
+    def counting_read_csv_columns(*args, **kwargs):
+        parsed.append(args[0])
+        return read_columns(*args, **kwargs)
+    monkeypatch.setattr(column_cache.csv_readers, "read_csv_columns",
+                        counting_read_csv_columns)
+    assert read_test_election(column_cache=True).rv_cpb == e1.rv_cpb
+    assert hashed == [cvrs_filename] and parsed == []
+    assert read_test_election(column_cache=True).rv_cpb == e1.rv_cpb
+    assert hashed == [cvrs_filename]
+
+    # a changed file is parsed again, and its cache rewritten
+    with open(cvrs_filename) as file:
+        lines = file.readlines()
+    with open(cvrs_filename, "w") as file:
+        file.writelines(lines[:-1])
+    mtime = os.path.getmtime(meta_filename)
+    e4 = read_test_election(column_cache=True)
+    assert sum(len(e4.rv_cpb[cid][pbcid]) for cid in e4.rv_cpb for pbcid in e4.rv_cpb[cid]) \
+        == sum(len(e1.rv_cpb[cid][pbcid]) for cid in e1.rv_cpb for pbcid in e1.rv_cpb[cid]) - 1
+    assert os.path.getmtime(meta_filename) >= mtime
+    assert parsed == [cvrs_filename]
+    assert read_test_election(column_cache=True).rv_cpb == e4.rv_cpb
+
+    # an unreadable cache is ignored
+    with open(meta_filename, "w") as file:
+        file.write("junk")
+    assert read_test_election(column_cache=True).rv_cpb == e4.rv_cpb
@@ -1,7 +1,10 @@
+import bz2
+import gzip
+import lzma
 import os
 import warnings
 
-from csv_readers import read_csv_file
+from csv_readers import iter_csv_file, read_csv_file, read_csv_columns, read_csv_columns_chunked
 
 test_filename = 'test_file.csv'
 
@@ -168,3 +171,91 @@ def test_csv_duplicate_field():
         assert str(e) == 'Duplicate field name: {}'.format(duplicate_fieldnames)
 
     os.remove(test_filename)
+
+def test_csv_columns():
+    contents = 'A,B,C\n1,2,3\n4,5\n1,7,8,9'
+    with open(test_filename, 'w') as f:
+        f.write(contents)
+    columns = read_csv_columns(test_filename, varlen=True)
+    assert columns == {'A': ['1', '4', '1'],
+                       'B': ['2', '5', '7'],
+                       'C': [('3',), (), ('8', '9')]}
+    assert columns['A'][0] is columns['A'][2]
+    os.remove(test_filename)
+
+def test_csv_columns_chunked():
+    lines = ['A,B,C'] + ['{},x{},{}'.format(i % 3, i, ','.join(['s'] * (i % 4)))
+                         for i in range(200)]
+    with open(test_filename, 'w') as f:
+        f.write('\n'.join(lines))
+    expected = read_csv_columns(test_filename, varlen=True)
+    assert read_csv_columns(test_filename, varlen=True,
+                            processes=2, chunk_size=100) == expected
+    with warnings.catch_warnings(record=True):
+        assert read_csv_columns_chunked(test_filename, None, False,
+                                        processes=2, chunk_size=100) \
+            == read_csv_columns(test_filename, varlen=False)
+    # quoted values might hold newlines, so are not split into chunks
+    with open(test_filename, 'a') as f:
+        f.write('\n1,"y",z')
+    assert read_csv_columns_chunked(test_filename, None, True,
+                                    processes=2, chunk_size=100) == None
+    assert read_csv_columns(test_filename, varlen=True,
+                            processes=2, chunk_size=100)['B'][-1] == 'y'
+    os.remove(test_filename)
+
+def test_iter_csv_file():
+    contents = 'A,B,C\n1,2,3\n4,5\n6,7,8,9'
+    with open(test_filename, 'w') as f:
+        f.write(contents)
+    rows = iter_csv_file(test_filename, varlen=True)
+    assert next(rows) == {'A':'1', 'B':'2', 'C':('3',)}
+    assert list(rows) == read_csv_file(test_filename, varlen=True)[1:]
+    # header is checked before any row is read
+    try:
+        iter_csv_file(test_filename, required_fieldnames=['A', 'D'])
+        assert False
+    except ValueError:
+        pass
+    os.remove(test_filename)
+
+
+def test_columns_projection():
+    contents = 'A,B,C\n1, x  y ,3\n4,5\n6,7,8,9'
+    with open(test_filename, 'w') as f:
+        f.write(contents)
+    assert read_csv_file(test_filename, varlen=True, columns=['C', 'A']) == \
+        [(('3',), '1'), ((), '4'), (('8','9'), '6')]
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        assert read_csv_file(test_filename, varlen=False, columns=['B']) == \
+            [('x y',), ('5',), ('7',)]
+        assert len(w) == 1      # extra values in last row
+    assert list(iter_csv_file(test_filename, varlen=True, columns=['A'])) == \
+        [('1',), ('4',), ('6',)]
+    assert read_csv_columns(test_filename, varlen=True, columns=['B', 'A']) == \
+        {'B': ['x y', '5', '7'], 'A': ['1', '4', '6']}
+    # requested columns must be present
+    try:
+        read_csv_file(test_filename, columns=['A', 'D'])
+        assert False
+    except ValueError:
+        pass
+    os.remove(test_filename)
+
+
+def test_compressed_files():
+    contents = 'A,B,C\n1,2,3\n4,5\n6,7,8,9'
+    with open(test_filename, 'w') as f:
+        f.write(contents)
+    expected = read_csv_columns(test_filename, varlen=True)
+    for (suffix, module) in [('.gz', gzip), ('.bz2', bz2), ('.xz', lzma)]:
+        with module.open(test_filename+suffix, 'wt') as f:
+            f.write(contents)
+        assert read_csv_file(test_filename+suffix, varlen=True) == \
+            read_csv_file(test_filename, varlen=True)
+        # compressed files are read sequentially, even if chunking is asked for
+        assert read_csv_columns(test_filename+suffix, varlen=True,
+                                processes=1, chunk_size=1) == expected
+        os.remove(test_filename+suffix)
+    os.remove(test_filename)
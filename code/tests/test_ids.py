@@ -10,6 +10,8 @@ def test_clean_id():
     assert ids.clean_id("ab ") == "ab"
     assert ids.clean_id("  ab cd  ") == "ab cd"
     assert ids.clean_id("\t ab\n cd\n") == "ab cd"
+    assert ids.clean_id("ab  cd") == "ab cd"
+    assert ids.clean_id("ab\x00cd") == "abcd"
 
 
 def test_filename_safe():
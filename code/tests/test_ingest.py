@@ -0,0 +1,28 @@
+"""
+Tests for ingest.py
+"""
+
+from election_fixtures import write_test_election, read_test_election
+
+
+def test_async_ingest(tmpdir, monkeypatch):
+
+    write_test_election(tmpdir, monkeypatch)
+    e1 = read_test_election(audited_votes=True, async_ingest=False)
+    e2 = read_test_election(audited_votes=True, async_ingest=True)
+    assert e2.bids_p == e1.bids_p
+    assert e2.rv_cpb == e1.rv_cpb
+    assert e2.rn_cpr == e1.rn_cpr
+    assert e2.av_cpb == e1.av_cpb
+    assert len(e2.av_cpb["cid1"]["pbcid2"]) == 30
+
+
+def test_ingest_processes(tmpdir, monkeypatch):
+
+    write_test_election(tmpdir, monkeypatch)
+    e1 = read_test_election(audited_votes=True)
+    e2 = read_test_election(audited_votes=True, ingest_processes=2)
+    assert e2.bids_p == e1.bids_p
+    assert e2.rv_cpb == e1.rv_cpb
+    assert e2.rn_cpr == e1.rn_cpr
+    assert e2.av_cpb == e1.av_cpb
@@ -50,3 +50,169 @@ def test_approval():
     str_tally = {("Alice", "Bob", "Charlie", "David"): 1, ("Alice", "Charlie"): 2, (): 1, ("Alice","David"): 1}
     expected_str_winner = ("Alice",)
     assert(expected_str_winner==outcomes.approval(None, None,str_tally))
+
+
+def test_irv():
+    # Alice leads on first preferences, but Carol's votes transfer to Bob.
+    tally = {("Alice",): 40, ("Bob", "Alice"): 10, ("Bob",): 20,
+             ("Carol", "Bob"): 25, ("Carol", "Alice"): 4,
+             ("-Invalid",): 7}
+    assert(("Bob",)==outcomes.irv(None, None, tally))
+    # outright majority on first preferences
+    assert(("Alice",)==outcomes.irv(None, None, {("Alice", "Bob"): 51, ("Bob",): 49}))
+    # exhausted ballots don't count toward majority:
+    # Carol wins with 34 of 64 continuing ballots (of 89 in all)
+    tally = {("Alice",): 30, ("Bob",): 25, ("Carol",): 24, ("Dave", "Carol"): 10}
+    assert(("Carol",)==outcomes.irv(None, None, tally))
+
+
+def test_irv_batch():
+    votes = [("Alice",), ("Bob", "Alice"), ("Bob",), ("Carol", "Bob"), ("Carol", "Alice")]
+    tallies = [[40, 10, 20, 25, 4],
+               [40, 10, 20, 5, 25],
+               [10, 40, 20, 25, 4]]
+    outcome_list = outcomes.irv_batch(None, None, votes, tallies)
+    assert(outcome_list==[("Bob",), ("Alice",), ("Bob",)])
+    for tally_row, outcome in zip(tallies, outcome_list):
+        assert(outcome==outcomes.irv(None, None, dict(zip(votes, tally_row))))
+
+
+class MultiWinnerElection(object):
+    """ Minimal stand-in for an Election with one 3-winner contest. """
+
+    def __init__(self):
+        self.contest_type_c = {"Board": "plurality"}
+        self.params_c = {"Board": "3"}
+
+
+def test_plurality_multiwinner():
+    e = MultiWinnerElection()
+    tally = {("Alice", "Bob", "Carol"): 10, ("Dave", "Eve"): 8, ("Alice",): 3,
+             ("Eve",): 4, ("Alice", "Bob", "Carol", "Dave"): 50, ("-Invalid",): 100}
+    # Bob and Carol tie (10 each); the smaller selid wins the tie
+    assert(("Alice", "Bob", "Eve")==outcomes.plurality(e, "Board", tally))
+    votes = sorted(tally)
+    assert(outcomes.plurality_batch(e, "Board", votes, [[tally[v] for v in votes]])
+           ==[("Alice", "Bob", "Eve")])
+    tally[("Bob",)] = 1
+    assert(("Alice", "Bob", "Eve")==outcomes.plurality(e, "Board", tally))
+
+
+def test_number_of_winners():
+    e = MultiWinnerElection()
+    assert outcomes.number_of_winners(e, "Board") == 3
+    assert outcomes.number_of_winners(None, "Board") == 1
+    # params of other contest types are not numbers of winners
+    e.contest_type_c = {"Board": "irv", "Mayor": "approval"}
+    e.params_c = {"Board": "some-irv-param", "Mayor": ""}
+    assert outcomes.number_of_winners(e, "Board") == 1
+    assert outcomes.number_of_winners(e, "Mayor") == 1
+
+
+def test_plurality_batch():
+    votes = [("Alice",), ("Bob",), ("Alice", "Bob"), ("Carol",), ("-Invalid",)]
+    tallies = [[5, 3, 100, 4, 50],
+               [1, 3, 100, 4, 50]]
+    assert(outcomes.plurality_batch(None, None, votes, tallies)==[("Alice",), ("Carol",)])
+    e = MultiWinnerElection()
+    e.params_c["Board"] = "2"
+    tallies = [[5, 3, 1, 5, 50],
+               [1, 3, 1, 4, 50]]
+    outcome_list = outcomes.plurality_batch(e, "Board", votes, tallies)
+    assert(outcome_list==[("Alice", "Carol"), ("Bob", "Carol")])
+    for tally_row, outcome in zip(tallies, outcome_list):
+        assert(outcome==outcomes.plurality(e, "Board", dict(zip(votes, tally_row))))
+
+    # ties: highest count, then smallest selid, in both rules
+    tallies = [[4, 4, 0, 4, 50],
+               [0, 4, 0, 4, 50],
+               [0, 0, 0, 0, 50]]
+    assert(outcomes.plurality_batch(e, "Board", votes, tallies)==
+           [("Alice", "Bob"), ("Bob", "Carol"), ("Alice", "Bob")])
+    e.params_c["Board"] = "1"
+    assert(outcomes.plurality_batch(e, "Board", votes, tallies)==
+           [("Alice",), ("Bob",), ("Alice",)])
+    for tally_row in tallies:
+        tally = dict(zip(reversed(votes), reversed(tally_row)))
+        assert(outcomes.plurality(e, "Board", tally)==
+               outcomes.plurality_batch(e, "Board", votes, [tally_row])[0])
+
+
+def test_schulze():
+    # Example from Wikipedia article on the Schulze method; E wins.
+    tally = {tuple("ACBED"): 5, tuple("ADECB"): 5, tuple("BEDAC"): 8,
+             tuple("CABED"): 3, tuple("CAEBD"): 7, tuple("CBADE"): 2,
+             tuple("DCEBA"): 7, tuple("EBADC"): 8}
+    assert(("E",)==outcomes.schulze(None, None, tally))
+
+
+def tennessee_tally():
+    # Tennessee capital example: Nashville is the Condorcet winner.
+    return {("Memphis", "Nashville", "Chattanooga", "Knoxville"): 42,
+            ("Nashville", "Chattanooga", "Knoxville", "Memphis"): 26,
+            ("Chattanooga", "Knoxville", "Nashville", "Memphis"): 15,
+            ("Knoxville", "Chattanooga", "Nashville", "Memphis"): 17}
+
+
+def test_ranked_pairs():
+    assert(("Nashville",)==outcomes.ranked_pairs(None, None, tennessee_tally()))
+    # a cycle A>B>C>A; weakest defeat (C>A) is not locked in, so A wins
+    tally = {("A", "B", "C"): 40, ("B", "C", "A"): 35, ("C", "A", "B"): 25}
+    assert(("A",)==outcomes.ranked_pairs(None, None, tally))
+    assert(("A",)==outcomes.schulze(None, None, tally))
+
+
+def test_pairwise_batch():
+    tally = tennessee_tally()
+    votes = list(tally)
+    index = outcomes.pairwise_index(votes)
+    (candidates, W) = index
+    tallies = [[tally[vote] for vote in votes],
+               [60, 26, 15, 17]]
+    d = outcomes.pairwise_matrix(tallies, index)
+    m, n = candidates.index("Memphis"), candidates.index("Nashville")
+    assert(d[0, m, n]==42 and d[0, n, m]==58)
+    # pairwise matrices add, as tallies do
+    assert((outcomes.pairwise_matrix([[1, 0, 0, 0]], index)[0]*42
+            + outcomes.pairwise_matrix([[0, 26, 15, 17]], index)[0]==d[0]).all())
+    assert(outcomes.schulze_batch(None, None, votes, tallies, index)==
+           [("Nashville",), ("Memphis",)])
+    assert(outcomes.ranked_pairs_batch(None, None, votes, tallies, index)==
+           [("Nashville",), ("Memphis",)])
+
+
+class RegistryElection(object):
+    """ Minimal stand-in for an Election, for outcome-rule registry tests. """
+
+    def __init__(self, contest_type):
+        self.contest_type_c = {"c1": contest_type}
+        self.params_c = {"c1": ""}
+        self.outcome_index_c = {}
+
+
+def test_registry_batch_and_fallback():
+    votes = [("Alice",), ("Bob",), ("Alice", "Bob")]
+    tallies = [[5, 3, 10], [1, 3, 10]]
+    # plurality: batched kernel, with cached index
+    e = RegistryElection("Plurality")
+    assert(outcomes.compute_outcomes_batch(e, "c1", votes, tallies)==[("Alice",), ("Bob",)])
+    assert(e.outcome_index_c["c1"][0]==tuple(votes))
+    # approval: no batched kernel, falls back to scalar rule
+    e = RegistryElection("approval")
+    assert(outcomes.compute_outcomes_batch(e, "c1", votes, tallies)==[("Alice",), ("Bob",)])
+    assert(e.outcome_index_c=={})
+
+
+def test_register_outcome_rule():
+    outcomes.register_outcome_rule("TestFirstVote",
+                                   lambda e, cid, tally: sorted(tally)[0],
+                                   ranked=True)
+    e = RegistryElection("testfirstvote")
+    assert(outcomes.is_ranked(e, "c1"))
+    assert(outcomes.compute_outcome(e, "c1", {("B",): 3, ("A",): 1})==("A",))
+    del outcomes.OUTCOME_RULES["testfirstvote"]
+    try:
+        outcomes.compute_outcome(e, "c1", {("A",): 1})
+        assert(False)
+    except NotImplementedError:
+        pass
@@ -0,0 +1,333 @@
+"""
+Tests for planner.py
+"""
+
+import numpy as np
+import time
+
+import audit
+import planner
+
+from election_fixtures import sampled_election
+
+
+def test_update_rules():
+
+    xs = np.array([0, 5, 10])
+    nonsample_sizes = np.array([10, 10, 10])
+    coin = np.zeros(3)
+    assert list(planner.update_correct(xs, nonsample_sizes, 1, 0.05, coin)) == [0, 4, 9]
+    assert list(planner.update_incorrect(xs, nonsample_sizes, 1, 0.05, coin)) == [1, 6, 10]
+    coin = np.ones(3) * 0.99
+    assert list(planner.update_correct(xs, nonsample_sizes, 1, 0.05, coin)) == [0, 5, 10]
+    assert list(planner.update_incorrect(xs, nonsample_sizes, 1, 0.05, coin)) == [0, 5, 10]
+
+
+def test_create_helper_arrays():
+
+    e = sampled_election()
+    votes, actual_votes, nonsample_sizes = planner.create_helper_arrays(e, "m", ["p1", "p2"])
+    assert votes == [("Alice",), ("Bob",)]
+    assert actual_votes.tolist() == [[60, 40], [60, 40]]
+    assert nonsample_sizes.tolist() == [900, 900]
+
+
+def test_get_sample_size():
+
+    e = sampled_election()
+    audit.set_audit_seed(e, 1)
+    xs = planner.get_sample_size(e, ["p1", "p2"])
+    assert set(xs) == {"p1", "p2"}
+    assert all(0 <= xs[pbcid] <= 900 for pbcid in xs)
+
+    # reproducible from the audit seed
+    audit.set_audit_seed(e, 1)
+    assert planner.get_sample_size(e, ["p1", "p2"]) == xs
+    assert e.planner_state["iterations"] == e.max_num_it
+
+
+def test_get_noisy_guess():
+
+    e = sampled_election()
+    votes, actual_votes, nonsample_sizes = planner.create_helper_arrays(e, "m", ["p1", "p2"])
+    xs = np.array([10, 10])
+    guess = planner.get_noisy_guess(e, "m", votes, actual_votes, xs, nonsample_sizes,
+                                    rs=np.random.default_rng(1))
+    assert guess == planner.get_noisy_guess(e, "m", votes, actual_votes, xs, nonsample_sizes,
+                                            rs=np.random.default_rng(1))
+    assert guess >= 0
+
+
+def test_discrete_rm():
+
+    e = sampled_election(pbcids=("p1", "p2", "p3"))
+    e.cids = ["c", "d"]
+    e.mids = ["m", "n"]
+    e.cid_m = {"m": "c", "n": "d"}
+    e.contest_type_c["d"] = "plurality"
+    e.params_c["d"] = ""
+    e.votes_c["d"] = {("Yes",): True, ("No",): True}
+    e.ro_c["d"] = ("Yes",)
+    e.risk_limit_m["n"] = 0.05
+    e.possible_pbcid_c = {"c": ["p1", "p2"], "d": ["p3"]}
+    e.sn_tcpra["t"]["d"] = {"p3": {("Yes",): {("Yes",): 51}, ("No",): {("No",): 49}}}
+    xs = planner.discrete_rm(e, ["p1", "p2", "p3"], rs=np.random.default_rng(1))
+    assert set(xs) == {"p1", "p2", "p3"}
+    assert all(0 <= xs[pbcid] <= 900 for pbcid in xs)
+
+
+def test_compute_plan_runs_planner_once():
+
+    e = sampled_election(pbcids=("p1", "p2", "p3"))
+    e.possible_pbcid_c = {"c": ["p1", "p2", "p3"]}
+    e.status_tm = {"t": {"m": "Open"}}
+    e.sn_tp = {"t": {"p1": 100, "p2": 100, "p3": 100}}
+    e.sample_by_size = True
+    e.pick_county_func = "round_robin"
+    calls = []
+
+    def fake_get_sample_size(e, pbcids, init_x=1, pick_pbcid_func=None, tolerance=None,
+                             deadline=None):
+        calls.append((pbcids, init_x, tolerance))
+        return {pbcid: 10 * (k+1) for (k, pbcid) in enumerate(pbcids)}
+
+    saved = planner.get_sample_size
+    planner.get_sample_size = fake_get_sample_size
+    try:
+        planner.compute_plan(e)
+    finally:
+        planner.get_sample_size = saved
+    # cold start: no early stopping
+    assert calls == [(["p1", "p2", "p3"], {}, None)]
+    assert e.plan_tp["t"] == {"p1": 110, "p2": 120, "p3": 130}
+
+    # next stage is warm started from this stage's x values
+    e.stage_time = "u"
+    e.sn_tp["u"] = e.plan_tp["t"]
+    e.status_tm["u"] = {"m": "Open"}
+    e.sn_tcpra["u"] = e.sn_tcpra["t"]
+    e.plan_tp = {}
+    planner.get_sample_size = fake_get_sample_size
+    try:
+        planner.compute_plan(e)
+    finally:
+        planner.get_sample_size = saved
+    assert calls[1] == (["p1", "p2", "p3"], {"p1": 10, "p2": 20, "p3": 30}, 1)
+
+
+def test_get_sample_size_warm_start():
+
+    e = sampled_election()
+    audit.set_audit_seed(e, 1)
+    xs = planner.get_sample_size(e, ["p1", "p2"], init_x={"p1": 5000, "p2": 7})
+    assert all(0 <= xs[pbcid] <= 900 for pbcid in xs)
+    assert e.planner_state["iterations"] == e.max_num_it      # no early stop by default
+    assert e.planner_state["last_change"] >= 0
+
+    # with a tolerance, stops once means over successive windows agree
+    audit.set_audit_seed(e, 1)
+    planner.get_sample_size(e, ["p1", "p2"], init_x=xs, tolerance=1000, window=20)
+    assert e.planner_state["iterations"] == 40
+    assert list(planner.initial_xs({"p1": 5000}, ["p1", "p2"], np.array([900, 900]), 1)) \
+        == [900, 1]
+
+
+def test_create_joint_arrays():
+
+    e = sampled_election(n=10, counts=(2, 1))
+    e.votes_c["d"] = {("Yes",): True, ("No",): True}
+    e.possible_pbcid_c["d"] = ["p2"]
+    e.av_cpb["d"] = {"p2": {"p2-0": ("Yes",), "p2-2": ("Yes",)}}
+    projections, actual_votes, pseudocounts, nonsample_sizes = \
+        planner.create_joint_arrays(e, ["c", "d"], ["p1", "p2"])
+    # observed patterns (Alice,-), (Alice,Yes), (Bob,-), (Bob,Yes); then synthetic (-,No), (-,Yes)
+    assert actual_votes.tolist() == [[2, 0, 1, 0, 0, 0], [1, 1, 0, 1, 0, 0]]
+    assert nonsample_sizes.tolist() == [7, 7]
+    votes, M = projections["c"]
+    assert (actual_votes @ M).tolist() == [[2, 1], [2, 1]]
+    votes, M = projections["d"]
+    assert votes == [("No",), ("Yes",)]
+    assert (actual_votes @ M).tolist() == [[0, 0], [0, 2]]
+    assert pseudocounts.tolist() == [[0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 50, 0]]
+
+
+def test_get_sample_size_joint():
+
+    e = sampled_election(pbcids=("p1", "p2"))
+    e.cids = ["c", "d"]
+    e.mids = ["m", "n"]
+    e.cid_m = {"m": "c", "n": "d"}
+    e.contest_type_c["d"] = "plurality"
+    e.params_c["d"] = ""
+    e.votes_c["d"] = {("Yes",): True, ("No",): True}
+    e.ro_c["d"] = ("Yes",)
+    e.risk_limit_m["n"] = 0.01
+    e.possible_pbcid_c["d"] = ["p2"]
+    e.av_cpb["d"] = {"p2": {bid: ("Yes",) if i < 51 else ("No",)
+                            for (i, bid) in enumerate(e.bids_p["p2"][:100])}}
+    e.status_tm = {"t": {"m": "Passed", "n": "Open"}}
+    audit.set_audit_seed(e, 1)
+    xs = planner.get_sample_size(e, ["p1", "p2"])
+    assert all(0 <= xs[pbcid] <= 900 for pbcid in xs)
+    e.status_tm = {"t": {"m": "Passed", "n": "Passed"}}
+    assert planner.get_sample_size(e, ["p1", "p2"]) == {"p1": 0, "p2": 0}
+
+
+def test_greedy_plan():
+
+    e = sampled_election(pbcids=("p1", "p2"), n=1000, counts=(26, 24))
+    # no CVRs, so risk is not already small from matching reported votes
+    e.votes_c["c"][("-noCVR",)] = True
+    e.rn_cpr = {"c": {pbcid: {("-noCVR",): 1000} for pbcid in ("p1", "p2")}}
+    e.sn_tcpra["t"]["c"] = {pbcid: {("-noCVR",): {("Alice",): 26, ("Bob",): 24}}
+                            for pbcid in ("p1", "p2")}
+    e.max_audit_rate_p = {"p1": 40, "p2": 40}
+    e.status_tm = {"t": {"m": "Open"}}
+    e.sn_tp = {"t": {"p1": 50, "p2": 50}}
+    tweak_p = planner.greedy_plan(e, ["p1", "p2"], budget=60, chunk_size=20,
+                                  trials=2000, rs=np.random.default_rng(1))
+    assert all(0 <= tweak_p[pbcid] <= 40 for pbcid in tweak_p)
+    assert 0 < sum(tweak_p.values()) <= 60
+
+    # nothing to plan for: no ballots
+    e.status_tm = {"t": {"m": "Passed"}}
+    assert planner.greedy_plan(e, ["p1", "p2"]) == {"p1": 0, "p2": 0}
+    e.status_tm = {"t": {"m": "Open"}}
+    e.risk_limit_m = {"m": 1.0}
+    assert planner.greedy_plan(e, ["p1", "p2"], chunk_size=20, trials=200,
+                               rs=np.random.default_rng(1)) == {"p1": 0, "p2": 0}
+
+    # risk over limit, but no chunk reduces it: one chunk, not the full rates
+    e.risk_limit_m = {"m": 0.05}
+    saved = planner.projected_risks
+    planner.projected_risks = lambda e, mids, trees, sn_cp, tweak_p, trials, seed: \
+        {"m": 0.5 + 0.01 * sum(tweak_p.values())}
+    try:
+        tweak_p = planner.greedy_plan(e, ["p1", "p2"], chunk_size=20,
+                                      rs=np.random.default_rng(1))
+    finally:
+        planner.projected_risks = saved
+    assert sorted(tweak_p.values()) == [0, 20]
+
+
+def test_greedy_plan_unsampled_collection():
+
+    e = sampled_election(pbcids=("p1", "p2"), n=1000, counts=(26, 24))
+    e.votes_c["c"][("-noCVR",)] = True
+    e.rn_cpr = {"c": {pbcid: {("-noCVR",): 1000} for pbcid in ("p1", "p2")}}
+    # p2 not yet sampled: its projected sample comes from the prior
+    e.sn_tcpra["t"]["c"] = {"p1": {("-noCVR",): {("Alice",): 26, ("Bob",): 24}},
+                            "p2": {}}
+    e.max_audit_rate_p = {"p1": 40, "p2": 40}
+    e.status_tm = {"t": {"m": "Open"}}
+    e.sn_tp = {"t": {"p1": 50, "p2": 0}}
+    tweak_p = planner.greedy_plan(e, ["p1", "p2"], budget=60, chunk_size=20,
+                                  trials=2000, rs=np.random.default_rng(1))
+    assert tweak_p["p2"] > 0
+
+    # and the greedy plan is kept in e.planner_state, as the walks' plans are
+    e.use_greedy_planner = True
+    e.stage_budget = 60
+    xs = planner.compute_plan_increments(e, ["p1", "p2"])
+    assert e.planner_state["x_p"] == xs
+
+
+def test_deadline():
+
+    e = sampled_election()
+    audit.set_audit_seed(e, 1)
+    xs = planner.get_sample_size(e, ["p1", "p2"], batch_size=10, tolerance=None,
+                                 deadline=time.time())
+    # stops after the first batch
+    assert 1 <= e.planner_state["iterations"] <= 10
+    assert set(e.planner_state["last_change_p"]) == {"p1", "p2"}
+    assert all(0 <= xs[pbcid] <= 900 for pbcid in xs)
+    planner.discrete_rm(e, ["p1", "p2"], deadline=time.time())
+    assert e.planner_state["iterations"] == 0
+
+
+def sequential_walk(e, pbcids, max_num_it, rs):
+    """
+    Reference implementation: the original (baseline) get_sample_size,
+    for one contest with round robin, step by step with dicts and no
+    array batching.
+    """
+
+    cid = "c"
+    votes = sorted(e.votes_c[cid])
+    risk_limit = e.risk_limit_m["m"]
+    actual = {pbcid: {vote: 0 for vote in votes} for pbcid in pbcids}
+    for pbcid in pbcids:
+        for rv in e.sn_tcpra["t"][cid][pbcid]:
+            for av in e.sn_tcpra["t"][cid][pbcid][rv]:
+                actual[pbcid][av] += e.sn_tcpra["t"][cid][pbcid][rv][av]
+    nonsample = {pbcid: e.rn_p[pbcid] - sum(actual[pbcid].values()) for pbcid in pbcids}
+    xs = {pbcid: 1 for pbcid in pbcids}
+    for i in range(max_num_it):
+        picked = pbcids[i % len(pbcids)]
+        current = {pbcid: dict(actual[pbcid]) for pbcid in pbcids}
+        for vote in votes:
+            if current[picked][vote] == 0:
+                current[picked][vote] += 50
+        ps = rs.dirichlet([current[picked][vote] for vote in votes])
+        for (vote, n) in zip(votes, rs.multinomial(xs[picked], ps)):
+            current[picked][vote] += n
+        merged = {vote: 0 for vote in votes}
+        for pbcid in pbcids:
+            ps = rs.dirichlet([current[pbcid][vote] for vote in votes])
+            rest = max(nonsample[pbcid] - xs[pbcid], 0)
+            for (vote, n) in zip(votes, rs.multinomial(rest, ps)):
+                merged[vote] += current[pbcid][vote] + n
+        correct = max(votes, key=lambda vote: (merged[vote], vote)) == e.ro_c[cid]
+        for pbcid in pbcids:
+            if correct and xs[pbcid] != 0 and \
+               rs.random() < 1-(1-risk_limit)**e.num_winners:
+                xs[pbcid] -= 1
+            elif not correct and xs[pbcid] != nonsample[pbcid] and \
+                 rs.random() < (1-risk_limit)**e.num_winners:
+                xs[pbcid] += 1
+    return xs
+
+
+def test_get_sample_size_matches_sequential_walk():
+
+    # a close contest, so the walk moves both up and down
+    e = sampled_election(pbcids=("p1", "p2", "p3"), n=300, counts=(11, 9))
+    e.max_num_it = 90
+    runs = 150
+    reference = np.array([list(sequential_walk(e, ["p1", "p2", "p3"], e.max_num_it,
+                                               np.random.default_rng(10000+seed)).values())
+                          for seed in range(runs)], dtype=float)
+    assert reference.mean() > 1
+    for batch_size in (1, 8):
+        walk = np.array([list(planner.get_sample_size(e, ["p1", "p2", "p3"],
+                                                      batch_size=batch_size,
+                                                      rs=np.random.default_rng(seed)).values())
+                         for seed in range(runs)], dtype=float)
+        # same mean and spread of final x per pbcid, within sampling error
+        se = np.sqrt((walk.var(axis=0) + reference.var(axis=0)) / runs)
+        assert np.all(np.abs(walk.mean(axis=0) - reference.mean(axis=0)) <= 4 * se + 0.5)
+        assert np.all(np.abs(walk.std(axis=0) - reference.std(axis=0))
+                      <= 0.3 * reference.std(axis=0) + 0.5)
+
+
+def test_get_sample_size_batches_steps():
+
+    e = sampled_election(pbcids=("p1", "p2"), n=1000, counts=(51, 49))
+    e.max_num_it = 400
+    batches = []
+    simulate_extended_samples = planner.simulate_extended_samples
+    def counting_simulate_extended_samples(actual_votes, xs, nonsample_sizes, picked,
+                                           rs, pseudocounts=None):
+        batches.append(len(picked))
+        return simulate_extended_samples(actual_votes, xs, nonsample_sizes, picked,
+                                         rs, pseudocounts)
+    planner.simulate_extended_samples = counting_simulate_extended_samples
+    try:
+        planner.get_sample_size(e, ["p1", "p2"], rs=np.random.default_rng(1))
+    finally:
+        planner.simulate_extended_samples = simulate_extended_samples
+    # every step is taken, but several at a time while x values stay fixed
+    assert e.planner_state["iterations"] == e.max_num_it
+    assert max(batches) > 1
+    assert len(batches) < 0.8 * e.max_num_it
@@ -0,0 +1,62 @@
+"""
+Tests for reported_cache.py
+"""
+
+import os
+
+import csv_readers
+import OpenAuditTool
+import reported_cache
+
+from election_fixtures import write_test_election, read_test_election
+
+
+def test_flatten():
+
+    rn_cpr = {"c": {"p1": {("Alice",): 3, ("Bob", "Carol"): 4}, "p2": {}}}
+    entries = reported_cache.flatten(rn_cpr, 3, [2])
+    assert entries == [["c", "p1", ["Alice"], 3],
+                       ["c", "p1", ["Bob", "Carol"], 4],
+                       ["c", "p2", {}]]
+    assert reported_cache.unflatten(entries, [2]) == rn_cpr
+    ro_c = {"c": ("Alice",)}
+    assert reported_cache.unflatten(reported_cache.flatten(ro_c, 1, []), []) == ro_c
+
+
+def test_reported_cache(tmpdir, monkeypatch):
+
+    write_test_election(tmpdir, monkeypatch)
+    e1 = read_test_election(reported_cache=False)
+    e2 = read_test_election(reported_cache=True)
+    assert os.path.exists(reported_cache.cache_filename(e2))
+
+    # cache hit: same aggregates, and no reported file is parsed again;
+    # with aggregates_only, no ballots read
+    parsed = []
+    for name in ["read_csv_columns", "iter_csv_file"]:
+        def counting(filename, *args, parse=getattr(csv_readers, name), **kwargs):
+            parsed.append(filename)
+            return parse(filename, *args, **kwargs)
+        monkeypatch.setattr(csv_readers, name, counting)
+    for aggregates_only in [False, True]:
+        e3 = read_test_election(aggregates_only, reported_cache=True)
+        for name in reported_cache.TABLES:
+            assert getattr(e3, name) == getattr(e1, name)
+        assert (e3.rv_cpb == e1.rv_cpb) == (not aggregates_only)
+        assert (e3.bids_p == e1.bids_p) == (not aggregates_only)
+        assert [filename for filename in parsed if "2-reported" in filename] == []
+    monkeypatch.undo()
+    monkeypatch.setattr(OpenAuditTool, "ELECTIONS_ROOT", str(tmpdir))
+
+    # changed reported data is read again
+    cvrs_dirname = os.path.join(str(tmpdir), "test", "2-reported", "22-reported-cvrs")
+    cvrs_filename = os.path.join(cvrs_dirname, sorted(os.listdir(cvrs_dirname))[0])
+    with open(cvrs_filename) as file:
+        lines = file.readlines()
+    with open(cvrs_filename, "w") as file:
+        file.writelines(lines[:-1])
+    e4 = read_test_election(aggregates_only=True, reported_cache=True)
+    assert sum(e4.rn_p.values()) == sum(e1.rn_p.values()) - 1
+    e5 = read_test_election(aggregates_only=True, reported_cache=True)
+    assert e5.rv_cpb == {}
+    assert e5.rn_cpr == e4.rn_cpr
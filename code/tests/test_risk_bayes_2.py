@@ -0,0 +1,130 @@
+"""
+Tests for risk_bayes_2.py
+"""
+
+import numpy as np
+
+import OpenAuditTool
+import risk_bayes_2
+
+
+def make_test_tree():
+
+    vs = [("Alice",), ("Bob",)]
+    T = risk_bayes_2.CountTree(vs)
+    T.add(("p1", ("Alice",)), ("Alice",), countA=8, countR=100)
+    T.add(("p1", ("Alice",)), ("Bob",), countA=1)
+    T.add(("p1", ("Bob",)), ("Bob",), countA=5, countR=60)
+    T.add(("p2", "scanner1", ("-noCVR",)), ("Alice",), countA=3, countR=20, countP=0.5)
+    T.add(("p2", "scanner1", ("-noCVR",)), ("Bob",), countA=4, countP=0.5)
+    T.add(("p2", "scanner2", ("-noCVR",)), ("Bob",), countA=2, countR=10)
+    T.finish()
+    return T
+
+
+def test_count_tree_get():
+
+    T = make_test_tree()
+    assert T.getA((), ("Alice",)) == 11
+    assert T.getA((), ("Bob",)) == 12
+    assert T.getA(("p1",), ("Bob",)) == 6
+    assert T.getA(("p2",), ("Bob",)) == 6
+    assert T.getA(("p2", "scanner1"), ("Alice",)) == 3
+    assert T.getA(("p1", ("Alice",), ("Bob",)), ("Bob",)) == 1
+    assert T.getA(("p1", ("Alice",), ("Bob",)), ("Alice",)) == 0
+    assert T.getR((), ("Alice",)) == 120
+    assert T.getP(("p2",), ("Bob",)) == 0.5
+    assert T.getA(("p3",), ("Bob",)) == 0.0
+
+
+def test_count_tree_structure():
+
+    T = make_test_tree()
+    assert T.children(()) == [("p1",), ("p2",)]
+    assert T.children(("p2",)) == [("p2", "scanner1"), ("p2", "scanner2")]
+    assert T.children(("p1", ("Bob",))) == [("p1", ("Bob",), ("Alice",)),
+                                            ("p1", ("Bob",), ("Bob",))]
+    assert T.children(("p1", ("Bob",), ("Bob",))) == []
+    assert len(T.leaves) == 4 * 2
+    assert list(T.nonsample_sizes()) == [91, 55, 13, 8]
+
+
+def test_count_tree_prefix_stratum():
+
+    T = risk_bayes_2.CountTree([("A",)])
+    T.add(("p1",), ("A",), countA=1)
+    T.add(("p1", "x"), ("A",), countA=1)
+    try:
+        T.finish()
+        assert False
+    except ValueError:
+        pass
+
+
+def test_draw_posterior():
+
+    T = make_test_tree()
+    rs = np.random.RandomState(1)
+    draws = risk_bayes_2.draw_posterior(T, 50, rs)
+    assert draws.shape == (50, 4, 2)
+    # every stratum is extended to its reported size
+    assert np.allclose(draws.sum(axis=2), T.countR.sum(axis=1))
+    # sample counts are always included
+    assert np.all(draws >= T.countA)
+    tallies = risk_bayes_2.posterior_tallies(T, draws)
+    assert np.allclose(tallies.sum(axis=1), 190)
+    tallies_p2 = risk_bayes_2.posterior_tallies(T, draws, ("p2",))
+    assert np.allclose(tallies_p2.sum(axis=1), 30)
+
+
+def test_multinomial_batch_fractional():
+
+    rs = np.random.RandomState(2)
+    ps = np.array([[0.6, 0.4], [0.5, 0.5]])
+    freq = risk_bayes_2.multinomial_batch(np.array([100.5, 10.0]), ps, rs)
+    assert np.allclose(freq.sum(axis=1), [100.5, 10.0])
+
+
+def test_compute_risk():
+
+    e = OpenAuditTool.Election()
+    e.stage_time = "t1"
+    e.cids = ["c1"]
+    e.mids = ["m1"]
+    e.cid_m = {"m1": "c1"}
+    e.contest_type_c = {"c1": "plurality"}
+    e.votes_c = {"c1": {("Alice",): True, ("Bob",): True}}
+    e.possible_pbcid_c = {"c1": {"p1": True}}
+    e.rn_cpr = {"c1": {"p1": {("Alice",): 600, ("Bob",): 400}}}
+    e.ro_c = {"c1": ("Alice",)}
+    e.risk_tm = {"t1": {}}
+    sn_tcpra = {"t1": {"c1": {"p1": {("Alice",): {("Alice",): 60},
+                                     ("Bob",): {("Bob",): 40}}}}}
+    rs = np.random.RandomState(3)
+    risk = risk_bayes_2.compute_risk(e, "m1", sn_tcpra, trials=200, rs=rs)
+    assert 0.0 <= risk < 0.05
+    assert e.risk_tm["t1"]["m1"] == risk
+
+
+def test_compute_risk_unseen_audited_vote():
+
+    e = OpenAuditTool.Election()
+    e.stage_time = "t1"
+    e.cids = ["c1"]
+    e.mids = ["m1"]
+    e.cid_m = {"m1": "c1"}
+    e.contest_type_c = {"c1": "plurality"}
+    e.votes_c = {"c1": {("Alice",): True, ("Bob",): True}}
+    e.possible_pbcid_c = {"c1": {"p1": True}}
+    e.rn_cpr = {"c1": {"p1": {("Alice",): 600, ("Bob",): 400}}}
+    e.ro_c = {"c1": ("Alice",)}
+    e.risk_tm = {"t1": {}}
+    # audited vote ("+Carol",) was never a reported vote
+    sn_tcpra = {"t1": {"c1": {"p1": {("Alice",): {("Alice",): 58, ("+Carol",): 2},
+                                     ("Bob",): {("Bob",): 40}}}}}
+    T = risk_bayes_2.make_tree(e, "c1", sn_tcpra)
+    assert T.vs == [("Alice",), ("Bob",), ("+Carol",)]
+    assert T.getA(("p1", ("Alice",)), ("+Carol",)) == 2
+    risk = risk_bayes_2.compute_risk(e, "m1", sn_tcpra, trials=200,
+                                     rs=np.random.RandomState(3))
+    assert 0.0 <= risk < 0.05
@@ -0,0 +1,24 @@
+"""
+Tests for utils.py
+"""
+
+import gzip
+import os
+
+import utils
+
+
+def test_greatest_name_compressed(tmp_path):
+
+    for filename in ["foo-11-07.csv", "foo-11-08.csv.gz", "zeb-12-12.csv"]:
+        with utils.open_file(os.path.join(tmp_path, filename), "w") as file:
+            file.write("A\n1\n")
+    assert utils.greatest_name(tmp_path, "foo", ".csv") == "foo-11-08.csv.gz"
+    with gzip.open(os.path.join(tmp_path, "foo-11-08.csv.gz"), "rt") as file:
+        assert file.read() == "A\n1\n"
+
+    # uncompressed file preferred to a compressed variant of it
+    with open(os.path.join(tmp_path, "foo-11-08.csv"), "w") as file:
+        file.write("A\n1\n")
+    assert utils.greatest_name(tmp_path, "foo", ".csv") == "foo-11-08.csv"
+    assert utils.strip_compression_suffix("foo.csv.xz") == "foo.csv"
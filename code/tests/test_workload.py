@@ -0,0 +1,105 @@
+"""
+Tests for workload.py
+"""
+
+import os
+
+import audit
+import OpenAuditTool
+import utils
+import workload
+
+from election_fixtures import syn2_election
+
+
+def make_test_election():
+
+    rows = [("cid1", "pbcid1", ("Alice",), ("Alice",), 300),
+            ("cid1", "pbcid1", ("Bob",), ("Bob",), 200),
+            ("cid1", "pbcid2", ("-noCVR",), ("Alice",), 100),
+            ("cid1", "pbcid2", ("-noCVR",), ("Bob",), 80)]
+    return syn2_election(rows, n_trials=500)
+
+
+def test_simulate_workload():
+
+    e = make_test_election()
+    results = workload.simulate_workload(e, 3, error_rate=0.01, processes=1)
+    assert len(results) == 3
+    for (sn_p, stages) in results:
+        assert stages >= 1
+        assert 0 < sn_p["pbcid1"] <= 500
+        assert 0 < sn_p["pbcid2"] <= 180
+    # runs are reproducible from their seeds
+    assert workload.simulate_workload(e, 3, error_rate=0.01, processes=1) == results
+
+    summary = workload.summarize_workload(e, results)
+    assert set(summary) == {"pbcid1", "pbcid2", "Total ballots", "Stages"}
+    (mean, qs) = summary["Stages"]
+    assert qs[0] <= qs[1] <= qs[2]
+
+
+def test_load_election_from_syn2_is_reproducible(tmpdir, monkeypatch):
+
+    monkeypatch.setattr(OpenAuditTool, "ELECTIONS_ROOT", str(tmpdir))
+    os.makedirs(os.path.join(str(tmpdir), "syn2_specs"))
+    with open(os.path.join(str(tmpdir), "syn2_specs", "test.csv"), "w") as file:
+        file.write("Contest,Collection,Reported Vote,Actual Vote,Number\n"
+                   "cid1,pbcid1,Alice,Alice,300\n"
+                   "cid1,pbcid1,Bob,Bob,200\n"
+                   "cid1,pbcid2,-noCVR,Alice,100\n"
+                   "cid1,pbcid2,-noCVR,Bob,80\n")
+
+    def run():
+        e = OpenAuditTool.Election()
+        e.election_dirname = "test"
+        e.n_trials = 500
+        workload.load_election(e, None, from_syn2=True, seed=7)
+        assert e.audit_seed == 7
+        return workload.simulate_workload(e, 2, error_rate=0.01, processes=1,
+                                          seed=int(e.audit_seed))
+
+    assert run() == run()
+
+
+def test_baseline_actual_votes():
+
+    e = make_test_election()
+    e.av_cpb["cid1"]["pbcid2"] = {}
+    workload.baseline_actual_votes(e, utils.RandomState(1))
+    avs = list(e.av_cpb["cid1"]["pbcid2"].values())
+    assert len(avs) == 180
+    assert set(avs) == {("Alice",), ("Bob",)}
+
+
+def test_simulate_audit_output():
+
+    e = make_test_election()
+    audit.set_audit_seed(e, 1)
+    output = audit.AuditOutput()
+    stages = audit.simulate_audit(e, max_stages=2, output=output)
+    assert 1 <= stages <= 2
+    assert sorted(output.contest_status_t) == ["{:06d}".format(t) for t in range(1, stages+1)]
+    assert output.collection_status_t["000001"].startswith("Collection,")
+    assert "0000-00-00-00-00-00" in output.saved_state_t
+
+
+def test_simulate_audit_stops_when_plan_stalls():
+
+    e = make_test_election()
+    audit.set_audit_seed(e, 1)
+    # no ballots may ever be sampled, and no risk is below the limit,
+    # so the measurement stays open
+    e.risk_limit_m = {mid: 0.0 for mid in e.mids}
+    e.max_audit_rate_p = {pbcid: 0 for pbcid in e.pbcids}
+    stages = audit.simulate_audit(e)
+    assert stages == 1
+    assert e.status_tm[e.stage_time][e.mids[0]] == "Open"
+    assert all(e.sn_tp[e.stage_time][pbcid] == 0 for pbcid in e.pbcids)
+
+    # and the stage bound holds even if the plan keeps growing
+    e = make_test_election()
+    audit.set_audit_seed(e, 1)
+    e.risk_limit_m = {mid: 0.0 for mid in e.mids}
+    e.max_audit_rate_p = {pbcid: 1 for pbcid in e.pbcids}
+    assert audit.simulate_audit(e, max_stages=3) == 3
@@ -8,8 +8,11 @@ Code to work with OpenAuditTool.py on post-election audits.
 Various utilities.
 """
 
+import bz2
 import datetime
+import gzip
 import logging
+import lzma
 import numpy as np
 import os
 import sys
@@ -49,6 +52,44 @@ start_datetime_string = datetime_string()
 # Input/output at the file-handling level
 ##############################################################################
 
+# Compressed variants of input files (e.g. "reported-cvrs-P1.csv.gz") are
+# read as if uncompressed, decompressing on the fly.
+
+COMPRESSION_OPENERS = {".gz": gzip.open,
+                       ".bz2": bz2.open,
+                       ".xz": lzma.open}
+
+
+def compression_suffix(filename):
+    """ Return compression suffix (e.g. ".gz") of filename, or "" if none. """
+
+    for suffix in COMPRESSION_OPENERS:
+        if filename.endswith(suffix):
+            return suffix
+    return ""
+
+
+def strip_compression_suffix(filename):
+    """ Return filename without any compression suffix. """
+
+    return filename[:len(filename)-len(compression_suffix(filename))]
+
+
+def open_file(filename, mode="r"):
+    """
+    Open filename, as open() would, but if it has a compression suffix
+    (.gz, .bz2, or .xz), open it through the matching decompressor,
+    so reading it gives the uncompressed contents.
+    """
+
+    suffix = compression_suffix(filename)
+    if suffix == "":
+        return open(filename, mode)
+    if "b" not in mode and "t" not in mode:
+        mode = mode + "t"
+    return COMPRESSION_OPENERS[suffix](filename, mode)
+
+
 def greatest_name(dirpath,
                   startswith,
                   endswith,
@@ -78,6 +119,10 @@ def greatest_name(dirpath,
         "foo-11-07.csv" , and
         "zeb-12-12.csv" .
 
+    Compressed files (such as "foo-11-08.csv.gz"; see open_file) are
+    considered too, as if named without their compression suffix; if
+    both a file and a compressed variant of it are present, the
+    uncompressed file is returned.
     """
 
     if max_label == None:
@@ -85,15 +130,19 @@ def greatest_name(dirpath,
     else:
         max_filename = os.path.join(dirpath, startswith, max_label, endswith)
     selected_filename = ""
+    selected_basename = ""
     for filename in os.listdir(dirpath):
         full_filename = os.path.join(dirpath,filename)
+        basename = filename if dir_wanted else strip_compression_suffix(filename)
         if (dir_wanted == False and os.path.isfile(full_filename) or \
             dir_wanted == True and not os.path.isfile(full_filename)) and \
-           filename.startswith(startswith) and \
-           filename.endswith(endswith) and \
-           filename > selected_filename and \
-           (max_filename == None or filename <= max_filename):
+           basename.startswith(startswith) and \
+           basename.endswith(endswith) and \
+           (basename > selected_basename or \
+            basename == selected_basename and filename < selected_filename) and \
+           (max_filename == None or basename <= max_filename):
             selected_filename = filename
+            selected_basename = basename
     if selected_filename == "":
         if dir_wanted == False:
             raise FileNotFoundError(("No files in `{}` have a name starting with `{}`"
@@ -0,0 +1,248 @@
+# workload.py
+# Ronald L. Rivest
+# October 19, 2026
+# python3
+
+"""
+Monte Carlo workload simulator for OpenAuditTool.py.
+
+Forecasts the work a Bayesian audit will require (ballots sampled per
+paper ballot collection, and number of audit stages) by running many
+complete simulated audits (audit.simulate_audit) in memory, each on
+actual votes drawn from an error model applied to the reported (or
+synthetic) votes.
+"""
+
+import copy
+import logging
+import multiprocessing
+import numpy as np
+import os
+
+import OpenAuditTool
+import audit
+import election_spec
+import reported
+import risk_bayes_2
+import syn2
+import utils
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+##############################################################################
+# Election to simulate
+##############################################################################
+
+
+class Syn2_Params(object):
+    """ Stand-in for syn.Syn_Params, with just what syn2.read_syn2_csv needs. """
+
+    def __init__(self, election_dirname):
+        self.election_dirname = election_dirname
+
+
+def load_election(e, args, from_syn2=False, seed=1):
+    """
+    Set up election e for workload simulation.
+
+    If from_syn2 is True, e is built in memory from the syn2 spec
+    elections/syn2_specs/<election_dirname>.csv (nothing is written);
+    the spec gives the actual votes.  Otherwise the election spec,
+    reported data, and audit spec are read from the election directory,
+    and audited votes too, if there are any.
+
+    If e.audit_seed is still None (as it always is for a syn2 spec,
+    unless given on the command line), it is set to seed, so that the
+    workload is the same from one run to the next.
+
+    Ballots with no known actual vote are given one (see
+    baseline_actual_votes).
+    """
+
+    if from_syn2:
+        synpar = Syn2_Params(e.election_dirname)
+        rows = syn2.read_syn2_csv(e, synpar)
+        syn2.process_spec(e, synpar, rows)
+        election_spec.finish_election_spec(e)
+        reported.finish_reported(e)
+    else:
+        election_spec.read_election_spec(e)
+        reported.read_reported(e)
+        audit.read_audit_spec(e, args)
+        try:
+            audit.read_audited_votes(e)
+        except FileNotFoundError:
+            logger.info("No audited votes found; using reported votes as actual votes.")
+    if e.audit_seed == None:
+        audit.set_audit_seed(e, seed)
+    baseline_actual_votes(e, utils.RandomState(e.audit_seed))
+
+
+def baseline_actual_votes(e, rs):
+    """
+    Give each ballot without an actual vote in e.av_cpb one:
+    its reported vote, or for ("-noCVR",) ballots a vote drawn in
+    proportion to the contest's reported totals over CVR collections
+    (the reported outcome, if there are none).
+    """
+
+    for cid in e.rv_cpb:
+        totals = {rv: e.rn_cr[cid][rv] for rv in sorted(e.rn_cr[cid])
+                  if rv != ("-noCVR",) and e.rn_cr[cid][rv] > 0}
+        votes = list(totals)
+        if len(votes) > 0:
+            ps = np.array([totals[vote] for vote in votes], dtype=float)
+            ps = ps / ps.sum()
+        for pbcid in e.rv_cpb[cid]:
+            for bid in sorted(e.rv_cpb[cid][pbcid]):
+                if bid in e.av_cpb.get(cid, {}).get(pbcid, {}):
+                    continue
+                rv = e.rv_cpb[cid][pbcid][bid]
+                if rv != ("-noCVR",):
+                    av = rv
+                elif len(votes) > 0:
+                    av = votes[rs.choice(len(votes), p=ps)]
+                else:
+                    av = e.ro_c[cid]
+                utils.nested_set(e.av_cpb, [cid, pbcid, bid], av)
+
+
+##############################################################################
+# Error model
+##############################################################################
+
+
+def apply_error_model(e, error_rate, rs):
+    """
+    Error model for one simulated audit.
+
+    Each actual vote is, independently with probability error_rate,
+    replaced by a different vote for its contest chosen uniformly at
+    random; and the sampling order of each collection (e.bids_p) is
+    shuffled.
+    """
+
+    for cid in sorted(e.av_cpb):
+        votes = [vote for vote in sorted(e.votes_c[cid]) if vote != ("-noCVR",)]
+        for pbcid in sorted(e.av_cpb[cid]):
+            av_b = e.av_cpb[cid][pbcid]
+            for bid in sorted(av_b):
+                if error_rate > 0 and rs.uniform() < error_rate:
+                    others = [vote for vote in votes if vote != av_b[bid]]
+                    if len(others) > 0:
+                        av_b[bid] = others[rs.randint(len(others))]
+    for pbcid in e.pbcids:
+        bids = list(e.bids_p[pbcid])
+        rs.shuffle(bids)
+        e.bids_p[pbcid] = bids
+
+
+##############################################################################
+# Simulated audits
+##############################################################################
+
+
+_election = None            # election to simulate, in each worker process
+
+
+def _init_worker(e):
+
+    global _election
+    _election = e
+
+
+def _run_one(job):
+    """ Run simulated audit number run of _election; return its workload. """
+
+    (run, seed, error_rate, max_stages) = job
+    e = copy.deepcopy(_election)
+    audit.set_audit_seed(e, seed)
+    apply_error_model(e, error_rate, np.random.RandomState(seed))
+    stages = audit.simulate_audit(e, max_stages,
+                                  risk_module=risk_bayes_2)
+    return dict(e.sn_tp[e.stage_time]), stages
+
+
+def simulate_workload(e, runs, error_rate=0.0, processes=None, seed=1,
+                      max_stages=1000):
+    """
+    Run runs-many simulated audits of election e (seeded seed, seed+1, ...),
+    spread over a pool of processes (the number of CPUs by default; with
+    processes=1, everything runs in this process).
+
+    Return list of (sample sizes by pbcid, number of stages), one per run.
+    """
+
+    jobs = [(run, seed+run, error_rate, max_stages) for run in range(runs)]
+    if processes == 1:
+        _init_worker(e)
+        return [_run_one(job) for job in jobs]
+    with multiprocessing.Pool(processes, _init_worker, (e,)) as pool:
+        return pool.map(_run_one, jobs)
+
+
+def summarize_workload(e, results, quantiles=(0.05, 0.5, 0.95)):
+    """
+    Return dict mapping items to (mean, list of quantiles) over the runs:
+    the items are the pbcids (number of ballots sampled), "Total ballots",
+    and "Stages".
+    """
+
+    summary = {}
+    samples = {pbcid: [sn_p[pbcid] for (sn_p, stages) in results]
+               for pbcid in e.pbcids}
+    samples["Total ballots"] = [sum(sn_p.values()) for (sn_p, stages) in results]
+    samples["Stages"] = [stages for (sn_p, stages) in results]
+    for item in samples:
+        values = np.array(samples[item], dtype=float)
+        summary[item] = (float(values.mean()),
+                         [float(q) for q in np.quantile(values, quantiles)])
+    return summary
+
+
+def write_workload_summary(e, summary, quantiles=(0.05, 0.5, 0.95)):
+    """ Write 3-audit/35-workload/workload-forecast-DATETIME.csv """
+
+    dirpath = os.path.join(OpenAuditTool.ELECTIONS_ROOT,
+                           e.election_dirname,
+                           "3-audit",
+                           "35-workload")
+    os.makedirs(dirpath, exist_ok=True)
+    filename = os.path.join(dirpath,
+                            "workload-forecast-"+utils.datetime_string()+".csv")
+    with open(filename, "w") as file:
+        fieldnames = ["Item", "Mean"] + \
+                     ["Quantile {}".format(q) for q in quantiles]
+        file.write(",".join(fieldnames))
+        file.write("\n")
+        for item in summary:
+            (mean, qs) = summary[item]
+            file.write(",".join(["{}".format(item), "{}".format(mean)] +
+                                ["{}".format(q) for q in qs]))
+            file.write("\n")
+    return filename
+
+
+def forecast(e, args):
+    """ Run workload forecast for election e, as directed by command-line args. """
+
+    load_election(e, args, from_syn2=args.workload_from_syn2,
+                  seed=int(args.workload_seed))
+    e.n_trials = int(args.workload_trials)
+    processes = None
+    if args.workload_processes != None:
+        processes = int(args.workload_processes)
+    results = simulate_workload(e,
+                                int(args.workload_runs),
+                                float(args.workload_error_rate),
+                                processes,
+                                int(e.audit_seed))
+    summary = summarize_workload(e, results)
+    logger.info("====== Workload forecast ({} simulated audits) ======".format(len(results)))
+    for item in summary:
+        (mean, qs) = summary[item]
+        logger.info("    {}: mean {:.1f}, quantiles {}".format(item, mean, qs))
+    filename = write_workload_summary(e, summary)
+    logger.info("Workload forecast written to: %s", filename)